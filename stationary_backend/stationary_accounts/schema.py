@@ -235,5 +235,7 @@ class Query(graphene.ObjectType):
     def resolve_me(self, info):
         user = info.context.user
         if user.is_authenticated:
-            return user
+            # request.user only has the auth snapshot fields loaded; fetch
+            # the profile in one query rather than one per deferred field
+            return User.objects.get(pk=user.pk)
         return None
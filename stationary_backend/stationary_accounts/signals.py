@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from stationary_accounts.models import User
+from stationary_core.auth import SNAPSHOT_FIELDS, invalidate_user_snapshot
+
+# Requests authenticate from cached user snapshots (stationary_core.auth);
+# any save touching a snapshot field must drop the user's entry. Saves
+# limited to other fields (last_login, password, profile) leave it alone.
+
+
+def _touches_snapshot(update_fields):
+    return update_fields is None or bool(SNAPSHOT_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_email(sender, instance, update_fields=None, **kwargs):
+    # Tokens name the user by email; after a change the old email's
+    # snapshot must go too
+    instance._previous_email = None
+    if instance.pk and _touches_snapshot(update_fields):
+        instance._previous_email = (
+            User.objects.filter(pk=instance.pk).values_list('email', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, update_fields=None, **kwargs):
+    if _touches_snapshot(update_fields):
+        invalidate_user_snapshot(instance.email, getattr(instance, '_previous_email', None))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    invalidate_user_snapshot(instance.email)
@@ -1,3 +1,68 @@
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
 from django.test import TestCase
+from graphql_jwt.shortcuts import get_token
 
-# Create your tests here.
+from stationary_accounts.models import User
+from stationary_core.auth import get_user_snapshot, user_for_token
+
+
+class UserSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user(email='a@example.com', password='x')
+        self.token = get_token(self.user)
+
+    def save(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(**kwargs)
+
+    def test_snapshot_cached(self):
+        self.assertEqual(user_for_token(self.token).pk, self.user.pk)
+
+        with self.assertNumQueries(0):
+            user = user_for_token(self.token)
+        self.assertEqual(user.role, User.Role.CUSTOMER)
+
+    def test_role_change_drops_snapshot(self):
+        user_for_token(self.token)
+
+        self.user.role = User.Role.ADMIN
+        self.save()
+
+        self.assertEqual(user_for_token(self.token).role, User.Role.ADMIN)
+
+    def test_deactivated_user_rejected_at_once(self):
+        user_for_token(self.token)
+
+        self.user.is_active = False
+        self.save(update_fields=['is_active'])
+
+        self.assertIsNone(user_for_token(self.token))
+
+    def test_last_login_save_keeps_snapshot(self):
+        user_for_token(self.token)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.user)
+
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(user_for_token(self.token))
+
+    def test_email_change_drops_old_email_snapshot(self):
+        get_user_snapshot('a@example.com')
+
+        self.user.email = 'b@example.com'
+        self.save()
+
+        self.assertIsNone(get_user_snapshot('a@example.com'))
+        self.assertEqual(get_user_snapshot('b@example.com').pk, self.user.pk)
+
+    def test_created_user_replaces_cached_miss(self):
+        self.assertIsNone(get_user_snapshot('new@example.com'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(email='new@example.com', password='x')
+
+        self.assertIsNotNone(get_user_snapshot('new@example.com'))
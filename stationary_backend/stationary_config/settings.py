@@ -45,6 +45,8 @@ ALLOWED_HOSTS = [
 # Application definition
 
 INSTALLED_APPS = [
+    # Must come first: runserver serves ASGI (HTTP and WebSockets) through it
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -54,6 +56,7 @@ INSTALLED_APPS = [
     # Third-party apps
     "graphene_django",
     "corsheaders",
+    "channels",
     "graphql_jwt.refresh_token",
     "tarxemo_django_graphene_utils",
 
@@ -69,6 +72,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "stationary_core.middleware.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -97,29 +101,175 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "stationary_config.wsgi.application"
+ASGI_APPLICATION = "stationary_config.asgi.application"
+
+# Threads (and so database connections) executing GraphQL operations per
+# ASGI worker process; further requests wait on the event loop
+GRAPHQL_EXECUTOR_THREADS = int(os.environ.get("GRAPHQL_EXECUTOR_THREADS", "16"))
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# PostgreSQL when DB_NAME is set (docker-compose), SQLite for local hacking.
+# Connections persist for DB_CONN_MAX_AGE seconds and are health-checked
+# before reuse. Behind PgBouncer in transaction mode set DB_CONN_MAX_AGE=0
+# and DB_DISABLE_SERVER_SIDE_CURSORS=True.
+if os.environ.get("DB_NAME"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME"),
+            "USER": os.environ.get("DB_USER"),
+            "PASSWORD": os.environ.get("DB_PASSWORD"),
+            "HOST": os.environ.get("DB_HOST", "db"),
+            "PORT": os.environ.get("DB_PORT", "5432"),
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            "DISABLE_SERVER_SIDE_CURSORS": os.environ.get("DB_DISABLE_SERVER_SIDE_CURSORS", "False") == "True",
+            "OPTIONS": {
+                "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", "5")),
+            },
+        }
     }
-}
 
-# DATABASES = {
-#     "default": {
-#         "ENGINE": "django.db.backends.postgresql",
-#         "NAME": os.environ.get("DB_NAME"),
-#         "USER": os.environ.get("DB_USER"),
-#         "PASSWORD": os.environ.get("DB_PASSWORD"),
-#         "HOST": os.environ.get("DB_HOST", "db"),
-#         "PORT": os.environ.get("DB_PORT", "5432"),
-#     }
-# }
+    # Streaming read replica; read-only GraphQL queries are routed to it by
+    # stationary_core.db_routers.PrimaryReplicaRouter
+    if os.environ.get("DB_REPLICA_HOST"):
+        DATABASES["replica"] = {
+            **DATABASES["default"],
+            "HOST": os.environ.get("DB_REPLICA_HOST"),
+            "PORT": os.environ.get("DB_REPLICA_PORT", DATABASES["default"]["PORT"]),
+            "TEST": {"MIRROR": "default"},
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+
+DATABASE_ROUTERS = ["stationary_core.db_routers.PrimaryReplicaRouter"]
+
+# Replica reads are skipped while replication lag exceeds this
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("REPLICA_LAG_CHECK_INTERVAL", "2"))
+# Upper bound on how long a client stays on the primary after a write
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", "30"))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Redis (from docker-compose) is shared by every gunicorn/celery process; the
+# local-memory fallback is only suitable for single-process development.
 
+REDIS_URL = os.environ.get("REDIS_URL", "")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {
+                "MAX_ENTRIES": 10000,
+            },
+        }
+    }
+
+# Channels (payment status push)
+# Redis pub/sub fans updates out across processes; in-memory only reaches
+# sockets served by the same process (development).
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+            "CONFIG": {"hosts": [REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+    }
+
+# Celery
+# Redis doubles as the broker; without it tasks run inline (development).
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", REDIS_URL or "")
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_SERIALIZER = "json"
+CELERY_ACCEPT_CONTENT = ["json"]
+
+# Payment status reconciliation (stationary_orders.tasks.reconcile_payments):
+# open payments between MIN_AGE and MAX_AGE seconds old are re-checked with ClickPesa every
+# INTERVAL seconds, CONCURRENCY at a time and at most RATE lookups per second.
+PAYMENT_RECONCILE_INTERVAL = int(os.environ.get("PAYMENT_RECONCILE_INTERVAL", "30"))
+PAYMENT_RECONCILE_MIN_AGE = int(os.environ.get("PAYMENT_RECONCILE_MIN_AGE", "30"))
+# Payments still open after this long are left alone (abandoned USSD prompts)
+PAYMENT_RECONCILE_MAX_AGE = int(os.environ.get("PAYMENT_RECONCILE_MAX_AGE", str(60 * 60 * 24)))
+PAYMENT_RECONCILE_CONCURRENCY = int(os.environ.get("PAYMENT_RECONCILE_CONCURRENCY", "4"))
+PAYMENT_RECONCILE_RATE = float(os.environ.get("PAYMENT_RECONCILE_RATE", "5"))
+PAYMENT_RECONCILE_BATCH_SIZE = int(os.environ.get("PAYMENT_RECONCILE_BATCH_SIZE", "500"))
+
+# Webhook events still unapplied after this many seconds are queued again
+WEBHOOK_REQUEUE_AFTER = int(os.environ.get("WEBHOOK_REQUEUE_AFTER", "60"))
+
+CELERY_BEAT_SCHEDULE = {
+    "reconcile-payments": {
+        "task": "stationary_orders.tasks.reconcile_payments",
+        "schedule": PAYMENT_RECONCILE_INTERVAL,
+    },
+    "requeue-webhook-events": {
+        "task": "stationary_orders.tasks.requeue_webhook_events",
+        "schedule": WEBHOOK_REQUEUE_AFTER,
+    },
+    "purge-stale-uploads": {
+        "task": "stationary_storage.tasks.purge_stale_uploads",
+        "schedule": 60 * 60,
+    },
+    "extract-pending-metadata": {
+        "task": "stationary_storage.tasks.extract_pending_metadata",
+        "schedule": 5 * 60,
+    },
+}
+
+# Compiled per-shop price sheets (see stationary_shops.price_cache)
+PRICE_SHEET_LRU_SIZE = int(os.environ.get("PRICE_SHEET_LRU_SIZE", "512"))
+PRICE_SHEET_CACHE_TIMEOUT = int(os.environ.get("PRICE_SHEET_CACHE_TIMEOUT", str(60 * 60 * 24)))
+
+
+# SQL capture for `manage.py index_advisor`
+# Django only logs queries while DEBUG is on; point SQL_LOG_FILE at a file to
+# record them, then replay it with `manage.py index_advisor <file>`.
+SQL_LOG_FILE = os.environ.get("SQL_LOG_FILE")
+if SQL_LOG_FILE:
+    LOGGING = {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "handlers": {
+            "sql_file": {
+                "class": "logging.FileHandler",
+                "filename": SQL_LOG_FILE,
+            },
+        },
+        "loggers": {
+            "django.db.backends": {
+                "handlers": ["sql_file"],
+                "level": "DEBUG",
+                "propagate": False,
+            },
+        },
+    }
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -157,6 +307,22 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# How document downloads are delivered (stationary_storage.serving):
+# "accel" hands them to nginx via X-Accel-Redirect to DOCUMENT_ACCEL_PREFIX
+# (an internal location aliased to MEDIA_ROOT), "sendfile" uses X-Sendfile,
+# "stream" streams them from Django.
+DOCUMENT_SERVE_MODE = os.environ.get("DOCUMENT_SERVE_MODE", "stream")
+DOCUMENT_ACCEL_PREFIX = os.environ.get("DOCUMENT_ACCEL_PREFIX", "/protected-media/")
+# Seconds a (user, document) access decision is cached (stationary_storage.access)
+DOCUMENT_ACCESS_CACHE_TIMEOUT = int(os.environ.get("DOCUMENT_ACCESS_CACHE_TIMEOUT", "300"))
+
+# Resumable uploads (stationary_storage.uploads): largest file, largest
+# PATCH chunk, and how long an unfinished upload is kept. Under ASGI the
+# chunk limit must also be set in the proxy (stationary_frontend/nginx.conf)
+UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_SIZE", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get("UPLOAD_CHUNK_MAX_SIZE", str(5 * 1024 * 1024)))
+UPLOAD_EXPIRE_AFTER = int(os.environ.get("UPLOAD_EXPIRE_AFTER", str(60 * 60 * 24)))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -167,7 +333,7 @@ AUTH_USER_MODEL = "stationary_accounts.User"
 GRAPHENE = {
     "SCHEMA": "stationary_config.schema.schema",
     "MIDDLEWARE": [
-        "stationary_core.middleware.SafeJSONWebTokenMiddleware",
+        "stationary_core.dataloaders.DataLoaderMiddleware",
     ],
 }
 
@@ -181,6 +347,10 @@ LOGIN_URL = '/api/login/'
 LOGIN_REDIRECT_URL = '/api/'
 LOGOUT_REDIRECT_URL = '/api/'
 
+# How long a user's snapshot (stationary_core.auth) serves JWT requests
+# without a query; saving the user drops it earlier
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get("AUTH_USER_CACHE_TIMEOUT", "60"))
+
 GRAPHQL_JWT = {
     "JWT_VERIFY_EXPIRATION": True,
     "JWT_EXPIRATION_DELTA": timedelta(days=7),
@@ -201,9 +371,22 @@ CORS_ALLOWED_ORIGINS = [
     ).split(",")
     if origin.strip()
 ]
+# Resumable uploads (stationary_storage.uploads) send and read Upload-Offset
+from corsheaders.defaults import default_headers  # noqa: E402
+CORS_ALLOW_HEADERS = (*default_headers, "upload-offset")
+CORS_EXPOSE_HEADERS = ["Upload-Offset", "Upload-Length"]
 
 # ClickPesa Configuration
 CLICKPESA_CLIENT_ID = os.getenv('CLICKPESA_CLIENT_ID', '')
 CLICKPESA_API_KEY = os.getenv('CLICKPESA_API_KEY', '')
 CLICKPESA_SECRET_KEY = os.getenv('CLICKPESA_SECRET_KEY', '')
+# Tokens are valid for an hour; shared via the cache and refreshed this many
+# seconds before they expire
+CLICKPESA_TOKEN_TTL = int(os.getenv('CLICKPESA_TOKEN_TTL', 60 * 60))
+CLICKPESA_TOKEN_REFRESH_MARGIN = int(os.getenv('CLICKPESA_TOKEN_REFRESH_MARGIN', 5 * 60))
+# Keep-alive pool and timeouts (seconds) for calls to the ClickPesa API
+CLICKPESA_POOL_MAXSIZE = int(os.getenv('CLICKPESA_POOL_MAXSIZE', 10))
+CLICKPESA_CONNECT_TIMEOUT = float(os.getenv('CLICKPESA_CONNECT_TIMEOUT', 5))
+CLICKPESA_READ_TIMEOUT = float(os.getenv('CLICKPESA_READ_TIMEOUT', 30))
+CLICKPESA_HTTP_RETRIES = int(os.getenv('CLICKPESA_HTTP_RETRIES', 2))
 BASE_URL = os.getenv('BASE_URL', 'http://localhost:8000')
@@ -14,27 +14,114 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
 from django.contrib import admin
+from django.db import close_old_connections
 from django.urls import path, include
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.conf.urls.static import static
 from graphene_django.views import GraphQLView
+from graphql import GraphQLError, get_operation_ast, parse
 from stationary_storage import document_urls
 from stationary_config.schema import schema
-from stationary_core.middleware import SafeJSONWebTokenMiddleware
+from stationary_core.auth import authenticate_request
+from stationary_core.dataloaders import DataLoaderMiddleware
+from stationary_core.db_routers import use_replica
+from stationary_orders.views import clickpesa_webhook
 
-# Create a custom GraphQL view with JWT middleware
+# GraphQL view authenticating the request's JWT once per operation
 class JWTGraphQLView(GraphQLView):
     def __init__(self, **kwargs):
         super().__init__(schema=schema, **kwargs)
-        self.middleware = [SafeJSONWebTokenMiddleware()]
+        # Graphene middleware wraps every field resolution, so nothing
+        # that only needs to run once per operation belongs here
+        self.middleware = [DataLoaderMiddleware()]
+
+    # Queries that must see the primary even though they are not mutations
+    # (paymentStatus must never be older than what the status push showed)
+    primary_only_fields = {'paymentStatus'}
+
+    def _is_read_only(self, query, operation_name):
+        try:
+            operation = get_operation_ast(parse(query), operation_name)
+        except GraphQLError:
+            return False
+        if operation is None or operation.operation.value != 'query':
+            return False
+        return not any(
+            getattr(selection, 'name', None) and selection.name.value in self.primary_only_fields
+            for selection in operation.selection_set.selections
+        )
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, *args, **kwargs):
+        """
+        Bind the JWT's user to ``request.user`` (a bad token leaves the
+        operation anonymous), then run read-only operations against the
+        replica when one is configured.
+        """
+        authenticate_request(request)
+        if query and self._is_read_only(query, operation_name):
+            with use_replica():
+                return super().execute_graphql_request(request, data, query, variables, operation_name, *args, **kwargs)
+        return super().execute_graphql_request(request, data, query, variables, operation_name, *args, **kwargs)
+
+
+_graphql_executor = None
+
+
+def graphql_executor():
+    """Thread pool running GraphQL operations for ``AsyncJWTGraphQLView``."""
+    global _graphql_executor
+    if _graphql_executor is None:
+        _graphql_executor = ThreadPoolExecutor(
+            max_workers=settings.GRAPHQL_EXECUTOR_THREADS,
+            thread_name_prefix='graphql',
+        )
+    return _graphql_executor
+
+
+def _dispatch_in_pool(view, request, *args, **kwargs):
+    # Pool threads keep their database connection across requests; expire
+    # it by CONN_MAX_AGE and health checks as Django does per request
+    close_old_connections()
+    try:
+        return JWTGraphQLView.dispatch(view, request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class AsyncJWTGraphQLView(JWTGraphQLView):
+    """
+    ``JWTGraphQLView`` for the ASGI server.
+
+    The resolvers use the ORM, so each operation still runs in a thread, but
+    in a shared pool of ``GRAPHQL_EXECUTOR_THREADS`` threads instead of one
+    worker process per request. Requests waiting for a thread cost only a
+    task on the event loop, and the pool size bounds the database
+    connections GraphQL holds.
+    """
+    dispatch = View.dispatch
+
+    async def get(self, request, *args, **kwargs):
+        run = sync_to_async(_dispatch_in_pool, thread_sensitive=False, executor=graphql_executor())
+        return await run(self, request, *args, **kwargs)
+
+    post = get
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("graphql/", csrf_exempt(JWTGraphQLView.as_view(graphiql=True))),
+    path("graphql/", csrf_exempt(AsyncJWTGraphQLView.as_view(graphiql=True))),
     path("api/storage/", include('stationary_storage.urls')),
     path("api/documents/", include(document_urls)),
+    path("", include('stationary_orders.urls')),
+    # The one unauthenticated POST: payloads are only accepted with a valid
+    # checksum, so it fails closed until CLICKPESA_SECRET_KEY is set
+    path("api/payments/webhook/clickpesa/", clickpesa_webhook, name="clickpesa_webhook"),
 ]
 
 # Serve media files in development
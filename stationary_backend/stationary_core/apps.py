@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stationary_core"
+
+    def ready(self):
+        from django.db.models import CharField
+        from django.db.models.functions import Lower
+
+        # Enables field__lower=value filters, which unlike __iexact (UPPER()
+        # on PostgreSQL) can use the Lower() functional indexes
+        CharField.register_lookup(Lower)
@@ -0,0 +1,121 @@
+"""
+JWT authentication shared by every entry point.
+
+The GraphQL view, the document file views, the DRF storage API and the
+payment WebSocket all resolve the ``Authorization: JWT <token>`` (or
+``Bearer``) header through ``authenticate_request``:
+
+- the token is decoded once per request and the outcome, user or
+  anonymous, is memoised on the request;
+- the user is rebuilt from a snapshot of ``SNAPSHOT_FIELDS`` cached for
+  ``AUTH_USER_CACHE_TIMEOUT`` seconds, so a request with a valid token
+  runs no user query. The snapshot is a ``User`` instance with the other
+  fields deferred: they load on first access, one query each;
+- saving or deleting a user drops its snapshot
+  (``stationary_accounts.signals``), so deactivating an account or
+  changing its role takes effect on the next request.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.core.cache import cache
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_payload
+
+# What the resolvers and permission checks read from request.user
+SNAPSHOT_FIELDS = frozenset({
+    'id', 'email', 'role', 'subscription_tier', 'is_active', 'is_staff', 'is_superuser',
+})
+TOKEN_PREFIXES = ('jwt', 'bearer')
+
+_UNSET = object()
+
+
+def get_token(request):
+    """The token of the request's ``Authorization`` header, or ``None``."""
+    prefix, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    token = token.strip()
+    if prefix.lower() not in TOKEN_PREFIXES or not token:
+        return None
+    return token
+
+
+# ------------------------------
+# User snapshots
+# ------------------------------
+
+def _snapshot_key(username) -> str:
+    # Emails may hold characters some cache backends reject in keys
+    return f"auth_user:{hashlib.md5(username.encode()).hexdigest()}"
+
+
+def _snapshot_attnames():
+    # Field order of the model, as ``Model.from_db`` expects it
+    return [f.attname for f in get_user_model()._meta.concrete_fields if f.attname in SNAPSHOT_FIELDS]
+
+
+def get_user_snapshot(username):
+    """The user named *username* with only ``SNAPSHOT_FIELDS`` loaded, or ``None``."""
+    User = get_user_model()
+    attnames = _snapshot_attnames()
+    key = _snapshot_key(username)
+    values = cache.get(key)
+    if values is None:
+        values = (
+            User._default_manager
+            .filter(**{User.USERNAME_FIELD: username})
+            .values_list(*attnames)
+            .first()
+        )
+        # Unknown users are cached too (as an empty tuple); creating the
+        # user drops the entry
+        values = tuple(values or ())
+        cache.set(key, values, settings.AUTH_USER_CACHE_TIMEOUT)
+    if not values:
+        return None
+    return User.from_db(DEFAULT_DB_ALIAS, attnames, values)
+
+
+def invalidate_user_snapshot(*usernames):
+    """Drop the cached snapshots of *usernames* once the transaction commits."""
+    keys = [_snapshot_key(username) for username in set(usernames) if username]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# ------------------------------
+# Authentication
+# ------------------------------
+
+def user_for_token(token):
+    """The active user *token* was issued to; ``None`` if invalid or expired."""
+    try:
+        payload = get_payload(token)
+    except JSONWebTokenError:
+        return None
+    username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+    if not username:
+        return None
+    user = get_user_snapshot(username)
+    if user is None or not user.is_active:
+        return None
+    return user
+
+
+def authenticate_request(request):
+    """
+    The user named by *request*'s JWT, bound to ``request.user``; ``None``
+    (leaving ``request.user`` alone) without a valid token. Only the
+    first call per request does any work.
+    """
+    user = getattr(request, '_jwt_user', _UNSET)
+    if user is _UNSET:
+        token = get_token(request)
+        user = user_for_token(token) if token else None
+        request._jwt_user = user
+        if user is not None:
+            request.user = user
+    return user
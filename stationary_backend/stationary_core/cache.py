@@ -0,0 +1,39 @@
+import threading
+from collections import OrderedDict
+
+
+class LocalLRUCache:
+    """
+    A small thread-safe, process-local LRU map.
+
+    Used in front of the shared cache for values that are immutable once
+    built (their keys carry a version), so a hit never needs to be
+    revalidated and a bounded size is the only eviction policy required.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,233 @@
+"""
+Per-request batch loaders for foreign-key lookups.
+
+GraphQL resolves a list one row at a time, so a resolver that follows a
+foreign key (``order.shop``) naively runs one query per row. The loaders
+here coalesce those lookups: whenever rows of a known model pass through
+the schema, the keys their relations will need are queued on the matching
+loader, and the first ``load`` of any one key fetches every queued key in
+a single ``WHERE ... IN (...)`` query.
+
+Rows reach the queues from two places: ``DataLoaderMiddleware``, which
+sees every list a resolver returns (including a DTO's ``data``), and the
+loaders themselves, which queue the relations of whatever they fetched,
+so nested lists batch across all of their parents too.
+
+Resolvers use ``load_related(instance, info, 'shop')``. Relations that
+are already cached on the instance (``select_related``/``prefetch_related``
+from ``optimize_queryset``) are returned as they are without touching a
+loader.
+"""
+from functools import lru_cache
+
+from django.db.models import QuerySet
+
+
+class BatchLoader:
+    """
+    Load values by key, batching every key queued since the last fetch.
+
+    *fetch* takes a list of keys and returns ``{key: value}``; keys it
+    leaves out resolve to *default* (``None``, or ``[]`` for to-many
+    loaders). Keys are queued under a tag (the relation that needs them) so
+    a load for one relation does not drag in keys queued for another.
+    """
+
+    def __init__(self, fetch, default=None, on_fetch=None):
+        self.fetch = fetch
+        self.default = default
+        self.on_fetch = on_fetch
+        self._cache = {}
+        self._queues = {}
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+
+    def queue(self, keys, tag=None):
+        pending = self._queues.setdefault(tag, set())
+        pending.update(key for key in keys if key is not None and key not in self._cache)
+
+    def load(self, key, tag=None):
+        if key is None:
+            return self._empty()
+        if key not in self._cache:
+            self._dispatch(key, tag)
+        return self._cache[key]
+
+    def load_many(self, keys, tag=None):
+        self.queue(keys, tag)
+        return [self.load(key, tag) for key in keys]
+
+    def _empty(self):
+        return list(self.default) if isinstance(self.default, list) else self.default
+
+    def _dispatch(self, key, tag):
+        keys = self._queues.pop(tag, set())
+        keys.add(key)
+        keys = [k for k in keys if k not in self._cache]
+        found = self.fetch(keys)
+        for k in keys:
+            self._cache[k] = found.get(k, self._empty())
+        if self.on_fetch is not None:
+            self.on_fetch(found.values())
+
+
+def _by_field(model, field):
+    """Fetch function returning one ``model`` row per value of *field*."""
+    def fetch(keys):
+        rows = model._default_manager.filter(**{f'{field}__in': keys})
+        return {getattr(row, field): row for row in rows}
+    return fetch
+
+
+def _grouped_by_field(model, field):
+    """Fetch function returning every ``model`` row per value of *field*."""
+    def fetch(keys):
+        groups = {}
+        for row in model._default_manager.filter(**{f'{field}__in': keys}):
+            groups.setdefault(getattr(row, field), []).append(row)
+        return groups
+    return fetch
+
+
+class DataLoaders:
+    """
+    The loaders for one request, created lazily by ``get_loaders``.
+
+    ``relations`` maps a model to the relations resolvers may follow on
+    it: ``attribute -> (loader name, key attribute)``.
+    """
+
+    def __init__(self):
+        from stationary_accounts.models import User
+        from stationary_orders.models import GuestCustomer, Order, OrderItem, Payment
+        from stationary_shops.models import Shop, ShopPricing
+        from stationary_storage.models import Document
+
+        self.shop_by_id = self._loader(_by_field(Shop, 'id'))
+        self.user_by_id = self._loader(_by_field(User, 'id'))
+        self.guest_customer_by_id = self._loader(_by_field(GuestCustomer, 'id'))
+        self.document_by_id = self._loader(_by_field(Document, 'id'))
+        self.order_by_id = self._loader(_by_field(Order, 'id'))
+        self.payment_by_order_id = self._loader(_by_field(Payment, 'order_id'))
+        self.items_by_order_id = self._loader(_grouped_by_field(OrderItem, 'order_id'), default=[])
+        self.order_items_by_document_id = self._loader(_grouped_by_field(OrderItem, 'document_id'), default=[])
+        self.pricing_rules_by_shop_id = self._loader(_grouped_by_field(ShopPricing, 'shop_id'), default=[])
+
+        self.relations = {
+            Order: {
+                'shop': ('shop_by_id', 'shop_id'),
+                'customer': ('user_by_id', 'customer_id'),
+                'guest_customer': ('guest_customer_by_id', 'guest_customer_id'),
+                'payment': ('payment_by_order_id', 'id'),
+                'items': ('items_by_order_id', 'id'),
+            },
+            OrderItem: {
+                'order': ('order_by_id', 'order_id'),
+                'document': ('document_by_id', 'document_id'),
+            },
+            Payment: {
+                'order': ('order_by_id', 'order_id'),
+            },
+            Document: {
+                'owner': ('user_by_id', 'owner_id'),
+                'order_items': ('order_items_by_document_id', 'id'),
+            },
+            Shop: {
+                'owner': ('user_by_id', 'owner_id'),
+                'pricing_rules': ('pricing_rules_by_shop_id', 'id'),
+            },
+        }
+
+    def _loader(self, fetch, default=None):
+        return BatchLoader(fetch, default=default, on_fetch=self.queue_rows)
+
+    def queue_rows(self, rows):
+        """Queue the relation keys of freshly loaded *rows*."""
+        rows = [row for value in rows for row in (value if isinstance(value, list) else [value])]
+        if not rows:
+            return
+        relations = self.relations.get(type(rows[0]))
+        if not relations:
+            return
+        for name, (loader_name, key_attr) in relations.items():
+            loader = getattr(self, loader_name)
+            loader.queue(
+                (getattr(row, key_attr) for row in rows if not _is_cached(row, name)),
+                tag=(type(rows[0]), name),
+            )
+
+    def load_related(self, instance, name):
+        model = type(instance)
+        loader_name, key_attr = self.relations[model][name]
+        if _is_cached(instance, name):
+            return _cached_value(instance, name)
+
+        value = getattr(self, loader_name).load(getattr(instance, key_attr), tag=(model, name))
+        field = _relation_field(model, name)
+        if not _is_to_many(field):
+            # Let model properties such as Order.customer_info see it too
+            field.set_cached_value(instance, value)
+        return value
+
+
+@lru_cache(maxsize=None)
+def _relation_field(model, name):
+    """The field (or reverse relation) behind attribute *name* of *model*."""
+    for field in model._meta.get_fields():
+        if field.is_relation and not field.concrete and field.get_accessor_name() == name:
+            return field
+    return model._meta.get_field(name)
+
+
+def _is_to_many(field):
+    return field.one_to_many or field.many_to_many
+
+
+def _is_cached(instance, name):
+    field = _relation_field(type(instance), name)
+    if _is_to_many(field):
+        return name in getattr(instance, '_prefetched_objects_cache', {})
+    return field.is_cached(instance)
+
+
+def _cached_value(instance, name):
+    field = _relation_field(type(instance), name)
+    if _is_to_many(field):
+        return list(instance._prefetched_objects_cache[name])
+    return field.get_cached_value(instance)
+
+
+def get_loaders(context):
+    """Return the ``DataLoaders`` bound to this request, creating them once."""
+    loaders = getattr(context, '_dataloaders', None)
+    if loaders is None:
+        loaders = DataLoaders()
+        context._dataloaders = loaders
+    return loaders
+
+
+def load_related(instance, info, name):
+    """Resolve relation *name* of *instance* through the request's loaders."""
+    return get_loaders(info.context).load_related(instance, name)
+
+
+class DataLoaderMiddleware:
+    """
+    Graphene middleware queuing the relations of every list of model rows a
+    resolver returns, so the first relation lookup on any row of the list
+    fetches it for all of them.
+    """
+
+    def resolve(self, next, root, info, **kwargs):
+        result = next(root, info, **kwargs)
+        if isinstance(result, QuerySet):
+            result._fetch_all()
+            rows = result._result_cache
+        elif isinstance(result, list):
+            rows = result
+        else:
+            return result
+        if rows and hasattr(rows[0], '_meta'):
+            get_loaders(info.context).queue_rows(rows)
+        return result
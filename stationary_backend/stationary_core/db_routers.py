@@ -0,0 +1,163 @@
+"""
+Primary/replica routing.
+
+Reads go to the ``replica`` alias only inside a request that was marked
+replica-eligible (read-only GraphQL operations, see ``JWTGraphQLView``)
+and only while that is safe:
+
+* once anything in the request writes, every later read in the same
+  request goes to the primary, so code that writes and re-reads (e.g.
+  ``refresh_from_db``) sees its own write;
+* after a request that wrote, the client carries the primary's WAL
+  position in a cookie and is kept on the primary until the replica has
+  replayed past it (``ReplicaRoutingMiddleware``), so a user never reads
+  an older state than the one their last mutation produced.
+
+Without a ``replica`` alias in ``DATABASES`` everything uses ``default``.
+Code outside a request (Celery, management commands) always reads from
+the primary.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+_lag_lock = threading.Lock()
+_lag_sample = {'at': 0.0, 'seconds': 0.0}
+
+
+class _RoutingState:
+    __slots__ = ('replica_allowed', 'pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.replica_allowed = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def routing_scope(pinned=False):
+    """Track reads and writes of one request; yields the scope's state."""
+    token = _state.set(_RoutingState(pinned=pinned))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_replica():
+    """
+    Let reads in this block go to the replica, if the scope allows it and
+    the replica is not lagging by more than ``REPLICA_MAX_LAG_SECONDS``.
+    """
+    state = _state.get()
+    if state is None or not replica_configured() or replica_lag_seconds() > settings.REPLICA_MAX_LAG_SECONDS:
+        yield
+        return
+    previous = state.replica_allowed
+    state.replica_allowed = True
+    try:
+        yield
+    finally:
+        state.replica_allowed = previous
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is not None
+            and state.replica_allowed
+            and not state.pinned
+            and not state.wrote
+            and replica_configured()
+        ):
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+# ------------------------------
+# Replication position (PostgreSQL)
+# ------------------------------
+
+def primary_wal_position():
+    """Current WAL LSN of the primary, or ``None`` when not on PostgreSQL."""
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_current_wal_lsn()::text')
+        return cursor.fetchone()[0]
+
+
+def replica_has_replayed(lsn):
+    """Whether the replica has replayed the primary's WAL up to *lsn*."""
+    connection = connections[REPLICA_DB_ALIAS]
+    if connection.vendor != 'postgresql':
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, true)',
+                [lsn],
+            )
+            return cursor.fetchone()[0]
+    except DatabaseError:
+        # Malformed cookie or replica unavailable: stay on the primary
+        return False
+
+
+def replica_lag_seconds():
+    """
+    Replication delay of the replica in seconds, sampled at most once every
+    ``REPLICA_LAG_CHECK_INTERVAL`` seconds per process. An unreachable
+    replica counts as infinitely behind.
+    """
+    now = time.monotonic()
+    with _lag_lock:
+        if now - _lag_sample['at'] < settings.REPLICA_LAG_CHECK_INTERVAL:
+            return _lag_sample['seconds']
+
+    connection = connections[REPLICA_DB_ALIAS]
+    lag = 0.0
+    if connection.vendor == 'postgresql':
+        try:
+            with connection.cursor() as cursor:
+                # Zero when the replica has replayed everything it received
+                cursor.execute(
+                    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+                )
+                lag = float(cursor.fetchone()[0])
+        except DatabaseError:
+            lag = float('inf')
+
+    with _lag_lock:
+        _lag_sample.update(at=now, seconds=lag)
+    return lag
@@ -0,0 +1,166 @@
+import json
+import re
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+
+# "(0.002) SELECT ...; args=(...); alias=default" from the django.db.backends logger
+DJANGO_LOG_RE = re.compile(r"^\((?P<duration>[\d.]+)\) (?P<sql>.+?); args=.*$")
+# "LOG:  duration: 12.3 ms  statement: SELECT ..." from log_min_duration_statement
+POSTGRES_LOG_RE = re.compile(r"duration: (?P<duration>[\d.]+) ms\s+(?:statement|execute [^:]*): (?P<sql>.+)$")
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+FILTER_COLUMN_RE = re.compile(r"\b([a-z_][a-z0-9_]*)\)*(?:::[a-z ]+)?\s*(?:=|<>|<=|>=|<|>|~~\*?|IS\b)", re.I)
+
+
+def read_statements(path):
+    """
+    Yield ``(sql, duration_ms)`` from a captured query log.
+
+    Understands the ``django.db.backends`` debug log and PostgreSQL's
+    ``log_min_duration_statement`` output; any other file is read as plain
+    SQL statements separated by semicolons.
+    """
+    with open(path) as f:
+        text = f.read()
+
+    matched = False
+    for line in text.splitlines():
+        match = DJANGO_LOG_RE.match(line.strip())
+        if match:
+            matched = True
+            yield match.group('sql'), float(match.group('duration')) * 1000
+            continue
+        match = POSTGRES_LOG_RE.search(line)
+        if match:
+            matched = True
+            yield match.group('sql').rstrip(';'), float(match.group('duration'))
+
+    if not matched:
+        for statement in text.split(';'):
+            if statement.strip():
+                yield statement.strip(), 0.0
+
+
+def normalize(sql):
+    """Replace literals so repeats of one query shape are explained once."""
+    return LITERAL_RE.sub('?', ' '.join(sql.split()))
+
+
+class Command(BaseCommand):
+    help = 'Replays captured SQL query logs through EXPLAIN and reports scans that lack an index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'logs',
+            nargs='+',
+            help='Query log files (django.db.backends debug log, PostgreSQL duration log or plain SQL)'
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias to EXPLAIN against (default: default)'
+        )
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=1000,
+            help='Ignore sequential scans of tables estimated smaller than this (PostgreSQL only, default: 1000)'
+        )
+        parser.add_argument(
+            '--fail-on-findings',
+            action='store_true',
+            help='Exit with an error when anything is reported, for use in CI'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+
+        shapes = OrderedDict()
+        for path in options['logs']:
+            for sql, duration in read_statements(path):
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                shape = shapes.setdefault(normalize(sql), {'sql': sql, 'count': 0, 'duration': 0.0})
+                shape['count'] += 1
+                shape['duration'] += duration
+
+        if not shapes:
+            raise CommandError('No SELECT statements found in the given logs')
+
+        findings = OrderedDict()
+        skipped = 0
+        with connection.cursor() as cursor:
+            for shape in shapes.values():
+                try:
+                    if connection.vendor == 'postgresql':
+                        problems = self._explain_postgres(cursor, shape['sql'], options['min_rows'])
+                    else:
+                        problems = self._explain_sqlite(cursor, shape['sql'])
+                except DatabaseError:
+                    # Truncated or parameterised statements cannot be replayed
+                    skipped += 1
+                    continue
+                for problem in problems:
+                    finding = findings.setdefault(problem, {'sql': shape['sql'], 'count': 0, 'duration': 0.0})
+                    finding['count'] += shape['count']
+                    finding['duration'] += shape['duration']
+
+        self.stdout.write(f'Explained {len(shapes) - skipped} query shapes ({skipped} skipped)')
+        if not findings:
+            self.stdout.write(self.style.SUCCESS('No missing indexes found.'))
+            return
+
+        ranked = sorted(findings.items(), key=lambda item: (item[1]['duration'], item[1]['count']), reverse=True)
+        for (table, kind, detail), finding in ranked:
+            self.stdout.write(self.style.WARNING(f'\n{kind} on {table}: {detail}'))
+            self.stdout.write(f"  seen {finding['count']}x, {finding['duration']:.1f} ms logged")
+            self.stdout.write(f"  e.g. {finding['sql'][:300]}")
+
+        if options['fail_on_findings']:
+            raise CommandError(f'{len(findings)} query pattern(s) without a usable index')
+
+    # ------------------------------
+    # Plan inspection
+    # ------------------------------
+
+    def _explain_postgres(self, cursor, sql, min_rows):
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        problems = []
+        stack = [(plan[0]['Plan'], None)]
+        while stack:
+            node, parent = stack.pop()
+            if node['Node Type'] == 'Seq Scan' and 'Filter' in node:
+                table = node['Relation Name']
+                if self._table_rows(cursor, table) >= min_rows:
+                    columns = ', '.join(OrderedDict.fromkeys(FILTER_COLUMN_RE.findall(node['Filter'])))
+                    problems.append((table, 'Sequential scan', f"filter on ({columns}): {node['Filter']}"))
+                    if parent is not None and parent['Node Type'] in ('Sort', 'Incremental Sort'):
+                        problems.append((table, 'Sort after scan', ', '.join(parent['Sort Key'])))
+            for child in node.get('Plans', []):
+                stack.append((child, node))
+        return problems
+
+    def _table_rows(self, cursor, table):
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _explain_sqlite(self, cursor, sql):
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        problems = []
+        scanned = None
+        for row in cursor.fetchall():
+            detail = row[-1]
+            if detail.startswith('SCAN ') and 'USING' not in detail:
+                scanned = detail.split()[1]
+                if ' WHERE ' in sql.upper():
+                    problems.append((scanned, 'Full table scan', detail))
+            elif 'USE TEMP B-TREE' in detail and scanned:
+                problems.append((scanned, 'Sort after scan', detail))
+        return problems
@@ -1,23 +1,71 @@
-from graphql_jwt.middleware import JSONWebTokenMiddleware
-from graphql_jwt.exceptions import JSONWebTokenError
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from stationary_core.db_routers import (
+    primary_wal_position,
+    replica_configured,
+    replica_has_replayed,
+    routing_scope,
+)
 
-class SafeJSONWebTokenMiddleware:
+class ReplicaRoutingMiddleware:
     """
-    A wrapper around JSONWebTokenMiddleware that catches decoding errors
-    and allows the request to proceed as an AnonymousUser.
+    Django middleware scoping database routing to the request.
+
+    A client whose previous request wrote carries the primary's WAL position
+    in a cookie; until the replica has replayed up to it, the client's
+    reads stay on the primary (read-your-writes). The cookie is refreshed
+    after every request that writes and dropped once the replica catches up.
+
+    Works under both WSGI and ASGI; in the async path the replication
+    checks run in a thread.
     """
-    def __init__(self):
-        self.jwt_middleware = JSONWebTokenMiddleware()
-
-    def resolve(self, next, root, info, **kwargs):
-        try:
-            return self.jwt_middleware.resolve(next, root, info, **kwargs)
-        except JSONWebTokenError as e:
-            # If the token is malformed or signature is invalid, 
-            # we just don't authenticate the user and continue.
-            print(f"JWT Error: {e}")
-            return next(root, info, **kwargs)
-        except Exception as e:
-            # Catch any other potential JWT-related blowups
-            print(f"JWT Middleware Exception: {e}")
-            return next(root, info, **kwargs)
+    COOKIE_NAME = 'db_primary_lsn'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replica_configured():
+            return self.get_response(request)
+
+        lsn = request.COOKIES.get(self.COOKIE_NAME)
+        pinned = bool(lsn) and not replica_has_replayed(lsn)
+        with routing_scope(pinned=pinned) as state:
+            response = self.get_response(request)
+            wrote = state.wrote
+
+        position = primary_wal_position() if wrote else None
+        return self._update_cookie(response, lsn, pinned, wrote, position)
+
+    async def __acall__(self, request):
+        if not replica_configured():
+            return await self.get_response(request)
+
+        lsn = request.COOKIES.get(self.COOKIE_NAME)
+        pinned = bool(lsn) and not await sync_to_async(replica_has_replayed)(lsn)
+        with routing_scope(pinned=pinned) as state:
+            response = await self.get_response(request)
+            wrote = state.wrote
+
+        position = await sync_to_async(primary_wal_position)() if wrote else None
+        return self._update_cookie(response, lsn, pinned, wrote, position)
+
+    def _update_cookie(self, response, lsn, pinned, wrote, position):
+        if wrote:
+            if position:
+                response.set_cookie(
+                    self.COOKIE_NAME,
+                    position,
+                    max_age=settings.REPLICA_PIN_SECONDS,
+                    httponly=True,
+                    samesite='Lax',
+                )
+        elif lsn and not pinned:
+            response.delete_cookie(self.COOKIE_NAME, samesite='Lax')
+        return response
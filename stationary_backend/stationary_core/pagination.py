@@ -0,0 +1,222 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+import graphene
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from tarxemo_django_graphene_utils import PageObject, TarxemoConfig
+
+MAX_ITEMS_PER_PAGE = 100
+
+
+class CursorPageObject(PageObject):
+    """``PageObject`` plus the fields needed for keyset (cursor) paging."""
+    end_cursor = graphene.String()
+    is_count_approximate = graphene.Boolean()
+
+
+# ------------------------------
+# Cursors
+# ------------------------------
+
+def _to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (UUID, Decimal)):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    """Encode the ordering key of the last row on a page as an opaque string."""
+    raw = json.dumps([_to_json(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of ``encode_cursor``; raises ``ValueError`` on a bad cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def page_size(requested):
+    """Clamp a client-supplied page size to ``1..MAX_ITEMS_PER_PAGE``."""
+    if not requested:
+        return TarxemoConfig.get('ITEMS_PER_PAGE')
+    return max(1, min(int(requested), MAX_ITEMS_PER_PAGE))
+
+
+# ------------------------------
+# Counting
+# ------------------------------
+
+def estimate_count(qs):
+    """
+    Row estimate for *qs* from the PostgreSQL planner, which costs a plan
+    instead of a scan. Other backends fall back to an exact ``COUNT``.
+    """
+    connection = connections[qs.db]
+    if connection.vendor != 'postgresql':
+        return qs.count()
+
+    sql, params = qs.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+# ------------------------------
+# Keyset paging
+# ------------------------------
+
+def _keyset_q(ordering, values):
+    """
+    Build the "strictly after this row" predicate for *ordering*, e.g. for
+    ``('-created_at', '-id')``: ``created_at < a OR (created_at = a AND id < b)``.
+    """
+    condition = Q()
+    equal_so_far = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal_so_far & Q(**{f'{name}__{lookup}': value})
+        equal_so_far &= Q(**{name: value})
+    return condition
+
+
+def _cursor_values(qs, ordering, values):
+    """
+    *values* converted to the types of the *ordering* fields (or
+    annotations) of *qs*. A cursor issued for another ordering fails here
+    with ``ValueError`` rather than in the database.
+    """
+    converted = []
+    for field, value in zip(ordering, values):
+        output_field = qs.query.resolve_ref(field.lstrip('-')).output_field
+        try:
+            converted.append(output_field.to_python(value))
+        except Exception as e:
+            raise ValueError("Invalid cursor") from e
+    return converted
+
+
+def keyset_paginate(qs, ordering, first=None, after=None):
+    """
+    Return ``(rows, has_next_page, end_cursor)`` for the page of *qs* that
+    follows the *after* cursor.
+
+    *ordering* must end in a unique field (normally ``id``) so the cursor
+    identifies exactly one row. Each page is a single indexed range query
+    of ``first + 1`` rows no matter how deep the client has scrolled.
+    """
+    limit = page_size(first)
+    qs = qs.order_by(*ordering)
+    if after:
+        values = decode_cursor(after)
+        if len(values) != len(ordering):
+            raise ValueError("Invalid cursor")
+        qs = qs.filter(_keyset_q(ordering, _cursor_values(qs, ordering, values)))
+
+    rows = list(qs[:limit + 1])
+    has_next_page = len(rows) > limit
+    rows = rows[:limit]
+
+    end_cursor = None
+    if rows:
+        last = rows[-1]
+        end_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+    return rows, has_next_page, end_cursor
+
+
+def keyset_paginate_list(items, key, first=None, after=None, descending=False):
+    """
+    Keyset paging over an already materialised list, ordered by ``key(item)``
+    (a tuple of JSON-serialisable values ending in a unique one).
+    """
+    limit = page_size(first)
+    items = sorted(items, key=key, reverse=descending)
+    if after:
+        boundary = tuple(decode_cursor(after))
+        try:
+            if descending:
+                items = [item for item in items if key(item) < boundary]
+            else:
+                items = [item for item in items if key(item) > boundary]
+        except TypeError as e:
+            # A cursor issued for another ordering
+            raise ValueError("Invalid cursor") from e
+
+    rows = items[:limit]
+    has_next_page = len(items) > limit
+    end_cursor = encode_cursor(key(rows[-1])) if rows else None
+    return rows, has_next_page, end_cursor
+
+
+# ------------------------------
+# Offset paging
+# ------------------------------
+
+def offset_paginate(data, page_number=None, items_per_page=None, approximate_count=False):
+    """
+    Page-number paging for a queryset or list. Returns ``(rows, page)``.
+
+    With *approximate_count* the total comes from ``estimate_count`` and the
+    next-page flag from fetching one extra row, so no exact COUNT is run.
+    """
+    per_page = page_size(items_per_page)
+    number = max(int(page_number or 1), 1)
+
+    if approximate_count and not isinstance(data, list):
+        offset = (number - 1) * per_page
+        rows = list(data[offset:offset + per_page + 1])
+        has_next_page = len(rows) > per_page
+        total = estimate_count(data)
+        page = CursorPageObject(
+            number=number,
+            current_page_number=number,
+            has_next_page=has_next_page,
+            has_previous_page=number > 1,
+            next_page_number=number + 1 if has_next_page else None,
+            previous_page_number=number - 1 if number > 1 else None,
+            total_elements=total,
+            is_count_approximate=True,
+        )
+        return rows[:per_page], page
+
+    paginator = Paginator(data, per_page)
+    if number > paginator.num_pages:
+        return [], CursorPageObject(
+            number=number,
+            current_page_number=number,
+            has_next_page=False,
+            has_previous_page=paginator.num_pages > 0,
+            number_of_pages=paginator.num_pages,
+            total_elements=paginator.count,
+            is_count_approximate=False,
+        )
+
+    page_obj = paginator.page(number)
+    page = CursorPageObject(
+        number=page_obj.number,
+        current_page_number=number,
+        has_next_page=page_obj.has_next(),
+        has_previous_page=page_obj.has_previous(),
+        next_page_number=page_obj.next_page_number() if page_obj.has_next() else None,
+        previous_page_number=page_obj.previous_page_number() if page_obj.has_previous() else None,
+        number_of_pages=paginator.num_pages,
+        total_elements=paginator.count,
+        is_count_approximate=False,
+    )
+    return list(page_obj.object_list), page
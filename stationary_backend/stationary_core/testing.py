@@ -0,0 +1,29 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory
+
+from stationary_core.dataloaders import DataLoaderMiddleware
+
+
+class GraphQLTestMixin:
+    """
+    Executes operations against the schema in the test's thread (the
+    async view runs them in a pool thread, outside the test transaction)
+    with an empty cache.
+    """
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def graphql(self, query, user=None, **variables):
+        from stationary_config.schema import schema
+
+        request = RequestFactory().post('/graphql/')
+        request.user = user or AnonymousUser()
+        result = schema.execute(
+            query, variable_values=variables, context_value=request,
+            middleware=[DataLoaderMiddleware()],
+        )
+        self.assertIsNone(result.errors)
+        return result.data
@@ -1,3 +1,197 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from graphql_jwt.shortcuts import get_token
+
+from stationary_accounts.models import User
+from stationary_config.urls import JWTGraphQLView
+from stationary_core import auth, db_routers
+from stationary_core.dataloaders import BatchLoader
+from stationary_core.db_routers import PrimaryReplicaRouter, routing_scope, use_replica
+from stationary_core.middleware import ReplicaRoutingMiddleware
+
+
+class BatchLoaderTests(SimpleTestCase):
+    def setUp(self):
+        self.fetches = []
+
+        def fetch(keys):
+            self.fetches.append(sorted(keys))
+            return {key: key * 10 for key in keys if key != 4}
+
+        self.loader = BatchLoader(fetch)
+
+    def test_queued_keys_fetched_together(self):
+        self.loader.queue([1, 2, 3])
+
+        self.assertEqual([self.loader.load(key) for key in (1, 2, 3)], [10, 20, 30])
+        self.assertEqual(self.fetches, [[1, 2, 3]])
+
+    def test_loaded_keys_not_fetched_again(self):
+        self.loader.load_many([1, 2])
+        self.loader.queue([2, 3])
+
+        self.assertEqual(self.loader.load(3), 30)
+        self.assertEqual(self.fetches, [[1, 2], [3]])
+
+    def test_missing_and_null_keys_resolve_to_default(self):
+        self.assertIsNone(self.loader.load(4))
+        self.assertIsNone(self.loader.load(None))
+        self.assertEqual(self.fetches, [[4]])
+
+    def test_tags_batched_separately(self):
+        self.loader.queue([1, 2], tag='shop')
+        self.loader.queue([3], tag='owner')
+
+        self.loader.load(1, tag='shop')
+        self.loader.load(3, tag='owner')
+
+        self.assertEqual(self.fetches, [[1, 2], [3]])
+
+    def test_fetched_rows_handed_on(self):
+        fetched = []
+        loader = BatchLoader(lambda keys: {key: [key] for key in keys}, default=[], on_fetch=fetched.extend)
+
+        loader.load_many([1, 2])
+
+        self.assertCountEqual(fetched, [[1], [2]])
+        # The default list is copied, never shared between keys
+        empty = loader.load(None)
+        empty.append(1)
+        self.assertEqual(loader.load(None), [])
+
+
+@override_settings(REPLICA_MAX_LAG_SECONDS=5)
+@mock.patch.object(db_routers, 'replica_lag_seconds', return_value=0)
+@mock.patch.object(db_routers, 'replica_configured', return_value=True)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    router = PrimaryReplicaRouter()
+
+    def test_replica_read_only_inside_eligible_scope(self, *mocks):
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        with routing_scope():
+            self.assertEqual(self.router.db_for_read(None), 'default')
+            with use_replica():
+                self.assertEqual(self.router.db_for_read(None), 'replica')
+            self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_reads_pinned_to_primary_after_write(self, *mocks):
+        with routing_scope(), use_replica():
+            self.assertEqual(self.router.db_for_write(None), 'default')
+            self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_pinned_scope_reads_primary(self, *mocks):
+        with routing_scope(pinned=True), use_replica():
+            self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_lagging_replica_not_used(self, configured, lag):
+        lag.return_value = 30
+        with routing_scope(), use_replica():
+            self.assertEqual(self.router.db_for_read(None), 'default')
+
+
+@override_settings(REPLICA_MAX_LAG_SECONDS=5, REPLICA_PIN_SECONDS=30)
+@mock.patch('stationary_core.db_routers.replica_lag_seconds', return_value=0)
+@mock.patch('stationary_core.db_routers.replica_configured', return_value=True)
+@mock.patch('stationary_core.middleware.replica_configured', return_value=True)
+class ReplicaRoutingMiddlewareTests(SimpleTestCase):
+    router = PrimaryReplicaRouter()
+
+    def call(self, view, lsn=None):
+        request = RequestFactory().get('/')
+        if lsn:
+            request.COOKIES[ReplicaRoutingMiddleware.COOKIE_NAME] = lsn
+        return ReplicaRoutingMiddleware(view)(request)
+
+    def read(self, request):
+        with use_replica():
+            return HttpResponse(self.router.db_for_read(None))
+
+    def write(self, request):
+        self.router.db_for_write(None)
+        return HttpResponse()
+
+    @mock.patch('stationary_core.middleware.primary_wal_position', return_value='0/16B3748')
+    def test_write_pins_client_to_primary(self, *mocks):
+        response = self.call(self.write)
+        self.assertEqual(response.cookies[ReplicaRoutingMiddleware.COOKIE_NAME].value, '0/16B3748')
+
+        with mock.patch('stationary_core.middleware.replica_has_replayed', return_value=False):
+            self.assertEqual(self.call(self.read, lsn='0/16B3748').content, b'default')
+
+    @mock.patch('stationary_core.middleware.replica_has_replayed', return_value=True)
+    def test_pin_dropped_once_replica_caught_up(self, *mocks):
+        response = self.call(self.read, lsn='0/16B3748')
+
+        self.assertEqual(response.content, b'replica')
+        self.assertEqual(response.cookies[ReplicaRoutingMiddleware.COOKIE_NAME].value, '')
+
+
+class ReadOnlyOperationTests(SimpleTestCase):
+    view = JWTGraphQLView()
+
+    def test_plain_query_read_only(self):
+        self.assertTrue(self.view._is_read_only('query { myOrders { id } }', None))
+
+    def test_mutation_not_read_only(self):
+        query = 'query Feed { myOrders { id } } mutation Pay { cancelOrder(orderId: "x") { ok } }'
+        self.assertTrue(self.view._is_read_only(query, 'Feed'))
+        self.assertFalse(self.view._is_read_only(query, 'Pay'))
+
+    def test_payment_status_query_read_from_primary(self):
+        self.assertFalse(self.view._is_read_only('{ paymentStatus(orderId: "x") { status } }', None))
+
+    def test_unparsable_query_not_read_only(self):
+        self.assertFalse(self.view._is_read_only('query {', None))
+
+
+class GraphQLViewAuthenticationTests(TestCase):
+    query = '{ me { email } myOrders { id } }'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='a@example.com', password='x')
+
+    def execute(self, authorization=None):
+        # The synchronous view runs the operation in the test's thread
+        headers = {'HTTP_AUTHORIZATION': authorization} if authorization else {}
+        request = RequestFactory().post(
+            '/graphql/', json.dumps({'query': self.query}), content_type='application/json', **headers,
+        )
+        request.user = AnonymousUser()
+        response = JWTGraphQLView.as_view()(request)
+        body = json.loads(response.content)
+        self.assertNotIn('errors', body)
+        return request, body['data']
+
+    def test_token_user_bound_once_per_operation(self):
+        with mock.patch.object(auth, 'get_payload', wraps=auth.get_payload) as decode:
+            request, data = self.execute(f'JWT {get_token(self.user)}')
+
+        self.assertEqual(data['me']['email'], 'a@example.com')
+        self.assertEqual(request.user.pk, self.user.pk)
+        self.assertEqual(decode.call_count, 1)
+
+    def test_bearer_prefix_accepted(self):
+        _, data = self.execute(f'Bearer {get_token(self.user)}')
+
+        self.assertEqual(data['me']['email'], 'a@example.com')
+
+    def test_bad_token_leaves_operation_anonymous(self):
+        request, data = self.execute('JWT not-a-token')
+
+        self.assertIsNone(data['me'])
+        self.assertEqual(data['myOrders'], [])
+        self.assertFalse(request.user.is_authenticated)
+
+    def test_inactive_user_token_anonymous(self):
+        token = get_token(self.user)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        _, data = self.execute(f'JWT {token}')
+
+        self.assertIsNone(data['me'])
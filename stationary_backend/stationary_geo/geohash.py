@@ -0,0 +1,104 @@
+"""
+Geohash encoding and radius covering.
+
+A geohash interleaves longitude and latitude bits into a base-32 string, so
+points that share a prefix share a cell and a B-tree index over the string
+turns "everything in this cell" into one range scan. ``covering_cells`` picks
+a precision whose cell size tracks the search radius and returns the few
+cells overlapping the circle's bounding box.
+"""
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+MAX_PRECISION = 12
+
+KM_PER_DEGREE = 111.32
+MAX_COVERING_CELLS = 16
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # longitude bits come first
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """Return the (latitude, longitude) size in degrees of a cell."""
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return (min_lat, max_lat, min_lon, max_lon) enclosing the circle."""
+    lat_delta = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(latitude) + lat_delta, 89.9)))
+    lon_delta = min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    return (
+        max(latitude - lat_delta, -90.0),
+        min(latitude + lat_delta, 90.0),
+        longitude - lon_delta,
+        longitude + lon_delta,
+    )
+
+
+def covering_cells(latitude, longitude, radius_km, max_cells=MAX_COVERING_CELLS):
+    """
+    Geohash prefixes whose union contains every point within *radius_km*,
+    or ``None`` when the radius is too large to narrow the search.
+
+    Uses the finest precision at which the circle's bounding box spans at
+    most *max_cells* cells, so the area scanned stays a small constant
+    multiple of the circle whatever the radius.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    if max_lon - min_lon >= 360.0:
+        return None
+
+    for precision in range(MAX_PRECISION, 0, -1):
+        lat_deg, lon_deg = cell_size(precision)
+        rows = math.floor(max_lat / lat_deg) - math.floor(min_lat / lat_deg) + 1
+        cols = math.floor(max_lon / lon_deg) - math.floor(min_lon / lon_deg) + 1
+        if rows * cols <= max_cells:
+            break
+    else:
+        return None
+
+    cells = set()
+    for row in range(rows):
+        lat = min(min_lat + row * lat_deg, max_lat)
+        for col in range(cols):
+            lon = min(min_lon + col * lon_deg, max_lon)
+            cells.add(encode(lat, (lon + 180.0) % 360.0 - 180.0, precision))
+    return cells
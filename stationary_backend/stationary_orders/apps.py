@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class OrdersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stationary_orders"
+
+    def ready(self):
+        from stationary_orders import checks, signals  # noqa: F401
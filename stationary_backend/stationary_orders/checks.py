@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.security, deploy=True)
+def check_clickpesa_secret(app_configs, **kwargs):
+    # Without the secret every ClickPesa webhook is rejected, so payments
+    # would only ever be settled by reconcile_payments
+    if not settings.CLICKPESA_SECRET_KEY:
+        return [Error(
+            'CLICKPESA_SECRET_KEY is not set.',
+            hint='ClickPesa webhooks are verified with it and rejected without it.',
+            id='stationary_orders.E001',
+        )]
+    return []
@@ -2,10 +2,214 @@ import requests
 import hashlib
 import hmac
 import json
+import os
+import threading
+import time
 from decimal import Decimal
+from functools import partial
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .models import Payment
 from .models import Payment as PaymentModel
+from .models import WebhookEvent
+from .realtime import FINAL_STATUSES, publish_payment_status
+
+
+# ------------------------------------------------------------------
+# HTTP session
+# ------------------------------------------------------------------
+
+# Safe to repeat after the server may already have acted on the request
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session():
+    """
+    A ``requests.Session`` keeping up to ``CLICKPESA_POOL_MAXSIZE``
+    connections to ClickPesa alive, so calls reuse an open TLS connection
+    instead of handshaking every time.
+
+    Failed connection attempts are retried for any method, since nothing
+    reached ClickPesa. Read errors and 429/5xx responses are retried only
+    for idempotent methods. Retries are bounded by ``CLICKPESA_HTTP_RETRIES``
+    and back off exponentially with jitter, honouring ``Retry-After``.
+    Payment initiation has its own retries in the ``initiate_payment`` task.
+    """
+    retry = Retry(
+        total=getattr(settings, 'CLICKPESA_HTTP_RETRIES', 2),
+        allowed_methods=IDEMPOTENT_METHODS,
+        status_forcelist=(429, 500, 502, 503, 504),
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        backoff_max=5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=getattr(settings, 'CLICKPESA_POOL_MAXSIZE', 10),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+    The process-wide session, rebuilt after a fork so worker processes
+    never share sockets with their parent.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def request_timeout():
+    """``(connect, read)`` timeout for ClickPesa calls, in seconds."""
+    return (
+        getattr(settings, 'CLICKPESA_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'CLICKPESA_READ_TIMEOUT', 30),
+    )
+
+
+def pool_stats() -> dict:
+    """
+    Connection pool counters of this process, for monitoring.
+
+    ``connections_opened`` vs ``requests`` shows how well keep-alive works:
+    with a warm pool it stays flat while requests keep growing.
+    """
+    pools = []
+    if _session is not None and _session_pid == os.getpid():
+        adapter = _session.get_adapter(ClickPesaService.BASE_URL)
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None or pool.pool is None:
+                # Evicted or closed since we listed the keys
+                continue
+            pools.append({
+                'host': f"{key.key_scheme}://{key.key_host}:{key.key_port}",
+                'maxsize': pool.pool.maxsize,
+                # The queue holds open idle connections, and None for free slots
+                'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None),
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+            })
+    return {'pid': os.getpid(), 'pools': pools}
+
+
+# ------------------------------------------------------------------
+# Token cache
+# ------------------------------------------------------------------
+
+TOKEN_CACHE_KEY = "clickpesa:token"
+TOKEN_LOCK_KEY = "clickpesa:token:lock"
+
+
+class TokenManager:
+    """
+    Process-wide holder of the ClickPesa bearer token.
+
+    The token and its expiry live in the shared cache, so every web and
+    Celery process reuses one token until it is within
+    ``CLICKPESA_TOKEN_REFRESH_MARGIN`` seconds of expiring. Refreshing is
+    single-flight: one thread per process, and across processes whoever
+    takes the cache lock mints the token while the others keep using the
+    current one (or, if it has already expired, wait briefly for the new
+    one).
+    """
+
+    LOCK_TIMEOUT = 30
+    WAIT_TIMEOUT = 10
+    POLL_INTERVAL = 0.1
+
+    def __init__(self):
+        self._local = None  # (token, expires_at)
+        self._mutex = threading.Lock()
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'CLICKPESA_TOKEN_TTL', 60 * 60)
+
+    @property
+    def refresh_margin(self):
+        return getattr(settings, 'CLICKPESA_TOKEN_REFRESH_MARGIN', 5 * 60)
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() < entry[1] - self.refresh_margin
+
+    def _valid(self, entry):
+        return entry is not None and time.time() < entry[1]
+
+    def get_token(self, mint):
+        """Return a usable token, calling *mint()* only when a refresh is due."""
+        entry = self._local
+        if self._fresh(entry):
+            return entry[0]
+
+        with self._mutex:
+            shared = self._local if self._fresh(self._local) else cache.get(TOKEN_CACHE_KEY)
+            if self._fresh(shared):
+                self._local = shared
+                return shared[0]
+
+            deadline = time.monotonic() + self.WAIT_TIMEOUT
+            while True:
+                if cache.add(TOKEN_LOCK_KEY, 1, timeout=self.LOCK_TIMEOUT):
+                    try:
+                        # Another process may have refreshed just before us
+                        shared = cache.get(TOKEN_CACHE_KEY)
+                        if self._fresh(shared):
+                            self._local = shared
+                            return shared[0]
+                        return self._store(mint())
+                    finally:
+                        cache.delete(TOKEN_LOCK_KEY)
+
+                # Someone else is refreshing; an unexpired token still works
+                if self._valid(shared):
+                    return shared[0]
+                if time.monotonic() > deadline:
+                    # Lock holder died or stalled; don't hold payments up on it
+                    return self._store(mint())
+                time.sleep(self.POLL_INTERVAL)
+                shared = cache.get(TOKEN_CACHE_KEY)
+                if self._fresh(shared):
+                    self._local = shared
+                    return shared[0]
+
+    def _store(self, token):
+        entry = (token, time.time() + self.ttl)
+        cache.set(TOKEN_CACHE_KEY, entry, timeout=self.ttl)
+        self._local = entry
+        return token
+
+    def invalidate(self, token):
+        """Forget *token* (rejected with a 401) so the next call mints anew."""
+        with self._mutex:
+            if self._local is not None and self._local[0] == token:
+                self._local = None
+            shared = cache.get(TOKEN_CACHE_KEY)
+            if shared is not None and shared[0] == token:
+                cache.delete(TOKEN_CACHE_KEY)
+
+
+token_manager = TokenManager()
 
 
 class ClickPesaService:
@@ -16,6 +220,9 @@ class ClickPesaService:
       1. POST /generate-token  →  receive JWT (already prefixed with "Bearer ")
       2. Use that JWT in Authorization header for all subsequent calls
 
+    The JWT is shared through ``token_manager`` rather than generated per
+    call; API methods take ``token=None`` to use it.
+
     Payment flow:
       1. POST /payments/preview-ussd-push-request  →  validate details & check active channels
       2. POST /payments/initiate-ussd-push-request →  send USSD push to customer's phone
@@ -56,7 +263,7 @@ class ClickPesaService:
             'Content-Type': 'application/json',
         }
 
-        response = requests.post(url, headers=headers, timeout=30)
+        response = get_session().post(url, headers=headers, timeout=request_timeout())
         response.raise_for_status()
 
         data = response.json()
@@ -67,6 +274,31 @@ class ClickPesaService:
         # 'token' already includes the "Bearer " prefix per the docs
         return data['token']
 
+    def get_token(self):
+        """Shared token from ``token_manager``, generated only when due."""
+        return token_manager.get_token(self.generate_token)
+
+    def _send(self, method: str, url: str, token: str | None = None, **kwargs) -> dict:
+        """
+        Make an authenticated request and return the decoded JSON body.
+
+        Without an explicit *token* the shared one is used, and a 401 (token
+        revoked or expired early) is retried once with a fresh one.
+        """
+        managed = token is None
+        if managed:
+            token = self.get_token()
+
+        session = get_session()
+        response = session.request(method, url, headers=self._get_auth_headers(token), timeout=request_timeout(), **kwargs)
+        if response.status_code == 401 and managed:
+            token_manager.invalidate(token)
+            token = self.get_token()
+            response = session.request(method, url, headers=self._get_auth_headers(token), timeout=request_timeout(), **kwargs)
+
+        response.raise_for_status()
+        return response.json()
+
     def _get_auth_headers(self, token):
         """
         Build request headers using the provided JWT token.
@@ -106,7 +338,7 @@ class ClickPesaService:
     # Payment: Step 1 – Preview USSD push
     # ------------------------------------------------------------------
 
-    def preview_ussd_push(self, token: str, amount: str, phone_number: str,
+    def preview_ussd_push(self, token: str | None, amount: str, phone_number: str,
                           order_reference: str, fetch_sender_details: bool = False) -> dict:
         """
         Validate push details and verify payment channel availability.
@@ -139,20 +371,13 @@ class ClickPesaService:
         if checksum:
             payload['checksum'] = checksum
 
-        response = requests.post(
-            url,
-            headers=self._get_auth_headers(token),
-            json=payload,
-            timeout=30,
-        )
-        response.raise_for_status()
-        return response.json()
+        return self._send('POST', url, token=token, json=payload)
 
     # ------------------------------------------------------------------
     # Payment: Step 2 – Initiate USSD push
     # ------------------------------------------------------------------
 
-    def initiate_ussd_push(self, token: str, amount: str, phone_number: str,
+    def initiate_ussd_push(self, token: str | None, amount: str, phone_number: str,
                            order_reference: str) -> dict:
         """
         Send the USSD push request to the customer's mobile device.
@@ -189,14 +414,7 @@ class ClickPesaService:
         if checksum:
             payload['checksum'] = checksum
 
-        response = requests.post(
-            url,
-            headers=self._get_auth_headers(token),
-            json=payload,
-            timeout=30,
-        )
-        response.raise_for_status()
-        return response.json()
+        return self._send('POST', url, token=token, json=payload)
 
     # ------------------------------------------------------------------
     # High-level: initiate mobile money payment
@@ -205,7 +423,7 @@ class ClickPesaService:
     def initiate_mobile_money_payment(self, payment, phone_number: str, payment_method: str) -> dict:
         """
         Full payment initiation flow:
-          1. Generate JWT token
+          1. Get the shared JWT token
           2. Preview USSD push (validate + check active channels)
           3. Initiate USSD push (send prompt to customer's phone)
           4. Update Payment model with response data
@@ -222,77 +440,151 @@ class ClickPesaService:
             dict: { success: bool, data?: dict, error?: str, payment_id: uuid }
         """
         try:
-            # Step 1: Authenticate
-            token = self.generate_token()
-
-            amount = str(payment.amount)
-            # Create order reference max 20 chars: ORDER + last 15 chars of ID
-            order_id_str = str(payment.order.id).replace('-', '')
-            order_reference = f"ORDER{order_id_str[-15:]}"
-
-            # Step 2: Preview – validate details & confirm channel availability
-            preview_data = self.preview_ussd_push(
-                token=token,
-                amount=amount,
-                phone_number=phone_number,
-                order_reference=order_reference,
-            )
-
-            active_methods = preview_data.get('activeMethods', [])
-            if not active_methods:
-                payment.status = PaymentModel.Status.FAILED
-                payment.failure_reason = 'No active payment channels available for this phone number'
-                payment.save()
-                return {
-                    'success': False,
-                    'error': 'No active payment channels available for this phone number',
-                    'payment_id': payment.id,
-                }
-
-            # Step 3: Initiate – send USSD push to customer
-            result = self.initiate_ussd_push(
-                token=token,
-                amount=amount,
-                phone_number=phone_number,
-                order_reference=order_reference,
-            )
-
-            # Step 4: Persist ClickPesa response to our Payment record
-            payment.clickpesa_payment_id = result.get('id')
-            payment.reference_number = result.get('orderReference')
-            payment.phone_number = phone_number
-            payment.status = PaymentModel.Status.PROCESSING
-            payment.save()
-
-            # Reflect pending payment on the order
-            payment.order.payment_status = payment.order.PaymentStatus.PENDING_PAYMENT
-            payment.order.save()
-
+            return self.start_ussd_push(payment, phone_number)
+        except requests.exceptions.RequestException as e:
+            error_msg = self.error_message(e)
+            self.mark_failed(payment, error_msg)
             return {
-                'success': True,
-                'data': result,
+                'success': False,
+                'error': error_msg,
                 'payment_id': payment.id,
             }
 
-        except requests.exceptions.RequestException as e:
-            error_msg = str(e)
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_data = e.response.json()
-                    error_msg = error_data.get('message', error_msg)
-                except Exception:
-                    pass
-
-            payment.status = PaymentModel.Status.FAILED
-            payment.failure_reason = error_msg
-            payment.save()
+    def start_ussd_push(self, payment, phone_number: str) -> dict:
+        """
+        Steps 1-4 of ``initiate_mobile_money_payment`` without the error
+        handling: network and HTTP errors propagate as
+        ``requests.exceptions.RequestException`` so a caller (the
+        ``initiate_payment`` Celery task) can decide whether to retry.
+        """
+        # Step 1: Authenticate – left to ``_send``, which attaches the shared
+        # token and re-authenticates once if ClickPesa rejects it
+        token = None
+
+        amount = str(payment.amount)
+        order_reference = self.order_reference_for(payment)
+
+        # Step 2: Preview – validate details & confirm channel availability
+        preview_data = self.preview_ussd_push(
+            token=token,
+            amount=amount,
+            phone_number=phone_number,
+            order_reference=order_reference,
+        )
 
+        active_methods = preview_data.get('activeMethods', [])
+        if not active_methods:
+            error_msg = 'No active payment channels available for this phone number'
+            self.mark_failed(payment, error_msg)
             return {
                 'success': False,
                 'error': error_msg,
                 'payment_id': payment.id,
             }
 
+        # Step 3: Initiate – send USSD push to customer. The attempt is
+        # recorded first, so whoever retries (or redelivers) this payment
+        # looks ClickPesa up before pushing again
+        self._count_push_attempt(payment)
+        result = self.initiate_ussd_push(
+            token=token,
+            amount=amount,
+            phone_number=phone_number,
+            order_reference=order_reference,
+        )
+
+        # Step 4: Persist ClickPesa response to our Payment record
+        self._record_push(payment, phone_number, result)
+
+        return {
+            'success': True,
+            'data': result,
+            'payment_id': payment.id,
+        }
+
+    @staticmethod
+    def _count_push_attempt(payment):
+        PaymentModel.objects.filter(id=payment.id).update(push_attempts=F('push_attempts') + 1)
+        payment.push_attempts += 1
+
+    def _record_push(self, payment, phone_number, result: dict):
+        """Store the ClickPesa transaction of *payment*'s USSD push."""
+        payment.clickpesa_payment_id = result.get('id')
+        payment.reference_number = result.get('orderReference')
+        payment.phone_number = phone_number
+        payment.status = PaymentModel.Status.PROCESSING
+
+        # Reflect pending payment on the order
+        payment.order.payment_status = payment.order.PaymentStatus.PENDING_PAYMENT
+
+        # A push found after the fact (adopt_existing_push) may already be
+        # paid or failed
+        self.apply_clickpesa_status(payment, result)
+
+        payment.save()
+        payment.order.save()
+        publish_payment_status(payment)
+
+    def find_payment_by_reference(self, order_reference: str) -> dict | None:
+        """
+        The ClickPesa transaction created for *order_reference*, or ``None``
+        if ClickPesa has none. Raises ``requests.exceptions.RequestException``.
+        """
+        try:
+            data = self._send('GET', f"{self.BASE_URL}/payments/{order_reference}")
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        # The transactions of the reference; there is at most one per order
+        if isinstance(data, list):
+            data = data[0] if data else None
+        return data or None
+
+    def adopt_existing_push(self, payment) -> bool:
+        """
+        Record the USSD push ClickPesa already has for *payment*'s order
+        reference, if any, and return whether there was one. Used before
+        sending a push again after an attempt whose outcome is unknown.
+        """
+        result = self.find_payment_by_reference(self.order_reference_for(payment))
+        if not result or not result.get('id'):
+            return False
+        self._record_push(payment, payment.phone_number, result)
+        return True
+
+    @staticmethod
+    def order_reference_for(payment) -> str:
+        """
+        Order reference sent to ClickPesa, max 20 chars: ORDER + last 15
+        chars of the order id. Deterministic, so a retried initiation
+        carries the same reference as the first attempt.
+        """
+        order_id_str = str(payment.order_id).replace('-', '')
+        return f"ORDER{order_id_str[-15:]}"
+
+    @staticmethod
+    def error_message(exc) -> str:
+        """Best human-readable message for a failed ClickPesa request."""
+        error_msg = str(exc)
+        if getattr(exc, 'response', None) is not None:
+            try:
+                error_data = exc.response.json()
+                error_msg = error_data.get('message', error_msg)
+            except Exception:
+                pass
+        return error_msg
+
+    def mark_failed(self, payment, reason: str):
+        """Record a failed initiation on the payment and its order."""
+        payment.status = PaymentModel.Status.FAILED
+        payment.failure_reason = reason
+        payment.save()
+
+        payment.order.payment_status = payment.order.PaymentStatus.PAYMENT_FAILED
+        payment.order.save()
+        publish_payment_status(payment)
+
     # ------------------------------------------------------------------
     # Check payment status
     # ------------------------------------------------------------------
@@ -311,16 +603,7 @@ class ClickPesaService:
             return {'success': False, 'error': 'No ClickPesa payment ID on this record'}
 
         try:
-            token = self.generate_token()
-
-            response = requests.get(
-                f"{self.BASE_URL}/payments/{payment.clickpesa_payment_id}",
-                headers=self._get_auth_headers(token),
-                timeout=30,
-            )
-            response.raise_for_status()
-
-            response_data = response.json()
+            response_data = self.fetch_payment_status(payment)
             self._update_payment_status(payment, response_data)
 
             return {'success': True, 'data': response_data}
@@ -328,14 +611,34 @@ class ClickPesaService:
         except requests.exceptions.RequestException as e:
             return {'success': False, 'error': str(e)}
 
+    def fetch_payment_status(self, payment) -> dict:
+        """
+        Raw ClickPesa transaction for *payment*, without touching the
+        database. Raises ``requests.exceptions.RequestException``.
+        """
+        return self._send('GET', f"{self.BASE_URL}/payments/{payment.clickpesa_payment_id}")
+
     # ------------------------------------------------------------------
     # Update payment status from ClickPesa response
     # ------------------------------------------------------------------
 
     def _update_payment_status(self, payment, clickpesa_data: dict):
+        """Apply a ClickPesa transaction to *payment* and its order, and save both."""
+        if not self.apply_clickpesa_status(payment, clickpesa_data):
+            return
+
+        payment.save()
+        payment.order.save()
+
+        # Push to clients waiting on this payment (PaymentStatusConsumer)
+        publish_payment_status(payment)
+
+    def apply_clickpesa_status(self, payment, clickpesa_data: dict) -> bool:
         """
         Map ClickPesa transaction status to our internal Payment status and
-        persist the changes, updating the related Order as well.
+        set it on *payment* and its Order, without saving.
+
+        Returns False when the status is unknown and nothing was changed.
 
         ClickPesa statuses (from docs):
           PROCESSING  – push sent, awaiting customer approval
@@ -357,9 +660,14 @@ class ClickPesaService:
 
         if clickpesa_status not in status_mapping:
             # Unknown status – log but don't crash
-            return
+            return False
+
+        new_status = status_mapping[clickpesa_status]
+        if payment.status in FINAL_STATUSES and new_status == PaymentModel.Status.PROCESSING:
+            # A late or replayed PROCESSING event must not reopen a payment
+            return False
 
-        payment.status = status_mapping[clickpesa_status]
+        payment.status = new_status
 
         # Sync orderReference if returned
         if clickpesa_data.get('orderReference'):
@@ -373,64 +681,61 @@ class ClickPesaService:
         if clickpesa_status == 'FAILED':
             payment.failure_reason = clickpesa_data.get('failure_reason', 'Payment failed')
 
-        payment.save()
-
         # Mirror status on the Order
         if payment.status == PaymentModel.Status.COMPLETED:
             payment.order.payment_status = payment.order.PaymentStatus.PAID
         elif payment.status == PaymentModel.Status.FAILED:
             payment.order.payment_status = payment.order.PaymentStatus.PAYMENT_FAILED
 
-        payment.order.save()
+        return True
 
     # ------------------------------------------------------------------
     # Webhook handler
     # ------------------------------------------------------------------
 
-    def process_webhook(self, webhook_data: dict) -> dict:
+    def verify_webhook_checksum(self, webhook_data: dict) -> bool:
         """
-        Process a webhook notification pushed by ClickPesa after a transaction
-        status change.
-
-        ClickPesa sends the same fields as the initiate response:
-          id, status, orderReference, collectedAmount, collectedCurrency,
-          channel, createdAt, clientId
-
-        Args:
-            webhook_data: Parsed JSON payload from the webhook POST body
-
-        Returns:
-            dict: { success: bool, payment_id?: uuid, status?: str, error?: str }
+        Check the ``checksum`` ClickPesa signs webhook payloads with: the
+        HMAC of every other field, computed like ``_generate_checksum``.
+        Without ``CLICKPESA_SECRET_KEY`` nothing can be checked, so every
+        payload is rejected.
         """
-        try:
-            # ClickPesa uses 'id' for the transaction identifier in webhook payloads
-            clickpesa_id = webhook_data.get('id')
-            if not clickpesa_id:
-                return {'success': False, 'error': 'No transaction id in webhook payload'}
-
-            payment = Payment.objects.filter(clickpesa_payment_id=clickpesa_id).first()
-            if not payment:
-                return {
-                    'success': False,
-                    'error': f'No payment found for ClickPesa transaction id: {clickpesa_id}',
-                }
-
-            self._update_payment_status(payment, webhook_data)
+        expected = self._generate_checksum({k: v for k, v in webhook_data.items() if k != 'checksum'})
+        if expected is None:
+            return False
+        received = webhook_data.get('checksum')
+        return isinstance(received, str) and hmac.compare_digest(expected, received)
 
-            return {
-                'success': True,
-                'payment_id': payment.id,
-                'status': payment.status,
-            }
+    def record_webhook(self, webhook_data: dict):
+        """
+        Store a verified webhook in the ``WebhookEvent`` inbox and queue
+        ``apply_webhook_events`` for its payment once committed. This is a
+        single INSERT, so the endpoint can acknowledge a burst of callbacks
+        straight away.
 
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+        A redelivered event hits the unique ``event_hash`` and is not stored
+        again; the task it queues finds nothing new and does nothing.
+        """
+        from .tasks import apply_webhook_events
+
+        clickpesa_id = str(webhook_data['id'])
+        canonical = json.dumps(webhook_data, sort_keys=True, separators=(',', ':'))
+        WebhookEvent.objects.bulk_create(
+            [WebhookEvent(
+                event_hash=hashlib.sha256(canonical.encode('utf-8')).hexdigest(),
+                clickpesa_payment_id=clickpesa_id,
+                status=str(webhook_data.get('status', ''))[:20],
+                payload=webhook_data,
+            )],
+            ignore_conflicts=True,
+        )
+        transaction.on_commit(partial(apply_webhook_events.delay, clickpesa_id))
 
     # ------------------------------------------------------------------
     # Payout: Preview mobile money payout
     # ------------------------------------------------------------------
 
-    def preview_mobile_money_payout(self, token: str, amount: float, phone_number: str,
+    def preview_mobile_money_payout(self, token: str | None, amount: float, phone_number: str,
                                     order_reference: str, currency: str = 'TZS') -> dict:
         """
         Validate payout details and retrieve fee/balance information before
@@ -469,11 +774,4 @@ class ClickPesaService:
         if checksum:
             payload['checksum'] = checksum
 
-        response = requests.post(
-            url,
-            headers=self._get_auth_headers(token),
-            json=payload,
-            timeout=30,
-        )
-        response.raise_for_status()
-        return response.json()
\ No newline at end of file
+        return self._send('POST', url, token=token, json=payload)
@@ -0,0 +1,63 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.contrib.auth.models import AnonymousUser
+from stationary_core.auth import user_for_token
+
+from .models import Payment
+from .realtime import FINAL_STATUSES, group_name, payment_status_payload, user_can_view_payment
+
+
+class PaymentStatusConsumer(AsyncJsonWebsocketConsumer):
+    """
+    WebSocket pushing the status of one payment.
+
+    ``ws/payments/<payment_id>/?token=<jwt>`` (the token is omitted for
+    guest orders). The current status is sent right after connecting, then
+    every change published by ``publish_payment_status``. The socket is
+    closed by the server once the payment reaches a final status.
+    """
+
+    async def connect(self):
+        self.group = None
+        payment_id = self.scope['url_route']['kwargs']['payment_id']
+        token = parse_qs(self.scope.get('query_string', b'').decode()).get('token', [None])[0]
+
+        user = await self._user_for(token)
+        if user is None or not await self._can_view(user, payment_id):
+            await self.close(code=4403)
+            return
+
+        # Join before reading the status so no update can slip in between
+        self.group = group_name(payment_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+        payload = await self._current_status(payment_id)
+        await self.payment_status({'payment': payload})
+
+    async def disconnect(self, code):
+        if self.group:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def payment_status(self, event):
+        await self.send_json(event['payment'])
+        if event['payment']['status'] in FINAL_STATUSES:
+            await self.close()
+
+    @database_sync_to_async
+    def _user_for(self, token):
+        """The token's user, anonymous without a token, ``None`` if invalid."""
+        if not token:
+            return AnonymousUser()
+        return user_for_token(token)
+
+    @database_sync_to_async
+    def _can_view(self, user, payment_id):
+        payment = Payment.objects.select_related('order').filter(id=payment_id).first()
+        return payment is not None and user_can_view_payment(user, payment)
+
+    @database_sync_to_async
+    def _current_status(self, payment_id):
+        return payment_status_payload(Payment.objects.select_related('order').get(id=payment_id))
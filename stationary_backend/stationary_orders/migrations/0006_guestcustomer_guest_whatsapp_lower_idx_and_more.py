@@ -0,0 +1,30 @@
+# Generated by Django 4.2.28 on 2026-10-18 01:35
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_orders', '0005_order_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='guestcustomer',
+            index=models.Index(django.db.models.functions.text.Lower('whatsapp_number'), name='guest_whatsapp_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guestcustomer',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='guest_email_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['guest_customer', 'created_at'], name='order_guest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['clickpesa_payment_id'], name='payment_clickpesa_id_idx'),
+        ),
+    ]
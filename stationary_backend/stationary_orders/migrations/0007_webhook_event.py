@@ -0,0 +1,31 @@
+# Generated by Django 4.2.28 on 2026-10-18 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_orders', '0006_guestcustomer_guest_whatsapp_lower_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_hash', models.CharField(max_length=64, unique=True)),
+                ('clickpesa_payment_id', models.CharField(max_length=100)),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['clickpesa_payment_id', 'id'], name='webhook_pending_idx')],
+            },
+        ),
+    ]
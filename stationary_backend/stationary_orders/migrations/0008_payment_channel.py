@@ -0,0 +1,18 @@
+# Generated by Django 4.2.28 on 2026-10-18 02:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_orders', '0007_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='channel',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.28 on 2026-10-18 02:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_orders', '0008_payment_channel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='push_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
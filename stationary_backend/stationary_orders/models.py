@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.conf import settings
 from stationary_core.models import BaseModel
 from stationary_shops.models import Shop
@@ -28,10 +29,52 @@ class Payment(BaseModel):
     reference_number = models.CharField(max_length=100, null=True, blank=True)
     clickpesa_payment_id = models.CharField(max_length=100, null=True, blank=True)
     phone_number = models.CharField(max_length=20, null=True, blank=True)
+    # Mobile money network ClickPesa routed the push to, e.g. TIGO-PESA
+    channel = models.CharField(max_length=50, null=True, blank=True)
     failure_reason = models.TextField(null=True, blank=True)
+    # USSD pushes sent (or possibly sent) to ClickPesa for this payment
+    push_attempts = models.PositiveSmallIntegerField(default=0)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Webhooks look payments up by the gateway's id
+            models.Index(fields=['clickpesa_payment_id'], name='payment_clickpesa_id_idx'),
+        ]
+
+
+class WebhookEvent(models.Model):
+    """
+    A ClickPesa webhook delivery, stored as received before it is acted on.
+
+    The webhook endpoint only inserts the event, so it can acknowledge at
+    once. ``apply_webhook_events`` then applies the pending events of a
+    payment in arrival order (the auto-increment id). Redeliveries of an
+    event hash to the same ``event_hash`` and are dropped on insert.
+    """
+    id = models.BigAutoField(primary_key=True)
+    event_hash = models.CharField(max_length=64, unique=True)
+    clickpesa_payment_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, blank=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Pending events of one payment, in arrival order
+            models.Index(
+                fields=['clickpesa_payment_id', 'id'],
+                name='webhook_pending_idx',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.clickpesa_payment_id} {self.status} ({self.received_at})"
 
 class GuestCustomer(BaseModel):
     """Temporary customer information for guest checkout"""
@@ -44,6 +87,13 @@ class GuestCustomer(BaseModel):
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True, null=True)
     
+    class Meta:
+        indexes = [
+            # Guest order lookup matches contact details case-insensitively
+            models.Index(Lower('whatsapp_number'), name='guest_whatsapp_lower_idx'),
+            models.Index(Lower('email'), name='guest_email_lower_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.whatsapp_number})"
 
@@ -96,7 +146,24 @@ class Order(BaseModel):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Order feeds page newest first on (created_at, id) within a
+            # shop (optionally one status) or a customer
+            models.Index(fields=['shop', 'status', 'created_at'], name='order_shop_status_created_idx'),
+            models.Index(fields=['shop', 'created_at'], name='order_shop_created_idx'),
+            models.Index(fields=['customer', 'created_at'], name='order_customer_created_idx'),
+            models.Index(fields=['guest_customer', 'created_at'], name='order_guest_created_idx'),
+        ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Who the order belonged to as loaded; a change on save drops
+        # cached document access decisions (stationary_orders.signals)
+        if 'customer_id' in instance.__dict__ and 'shop_id' in instance.__dict__:
+            instance._loaded_parties = (instance.customer_id, instance.shop_id)
+        return instance
+
     @property
     def customer_info(self):
         """Returns customer information regardless of user type"""
@@ -0,0 +1,81 @@
+"""
+Payment status push.
+
+Whenever a payment changes state (ClickPesa webhook, status check, failed
+initiation) its new status is published to the payment's group on the
+channel layer (Redis pub/sub when ``REDIS_URL`` is set). Clients
+subscribed through ``PaymentStatusConsumer`` receive it the moment it
+happens instead of polling the ``paymentStatus`` query.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which nothing more will be pushed for a payment
+FINAL_STATUSES = {
+    Payment.Status.COMPLETED.value,
+    Payment.Status.FAILED.value,
+    Payment.Status.CANCELLED.value,
+}
+
+
+def group_name(payment_id) -> str:
+    return f"payment_{payment_id}"
+
+
+def user_can_view_payment(user, payment) -> bool:
+    """
+    Same rule as the ``paymentStatus`` query: a signed-in user sees the
+    payments of their own orders; anyone holding the id of a guest order's
+    payment may see that payment.
+    """
+    if user is not None and user.is_authenticated:
+        return payment.order.customer_id == user.id
+    return payment.order.guest_customer_id is not None
+
+
+def payment_status_payload(payment) -> dict:
+    """The fields of the ``paymentStatus`` query, as sent to subscribers."""
+    order = payment.order
+    return {
+        'id': str(payment.id),
+        'status': payment.status,
+        'paymentMethod': payment.payment_method,
+        'amount': float(payment.amount),
+        'referenceNumber': payment.reference_number,
+        'transactionId': payment.transaction_id,
+        'failureReason': payment.failure_reason,
+        'createdAt': payment.created_at.isoformat() if payment.created_at else None,
+        'updatedAt': payment.updated_at.isoformat() if payment.updated_at else None,
+        'order': {
+            'id': str(order.id),
+            'paymentStatus': order.payment_status,
+            'status': order.status,
+        },
+    }
+
+
+def publish_payment_status(payment):
+    """Push *payment*'s current status to its subscribers once committed."""
+    payload = payment_status_payload(payment)
+    transaction.on_commit(lambda: _send(payment.id, payload))
+
+
+def _send(payment_id, payload):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            group_name(payment_id),
+            {'type': 'payment.status', 'payment': payload},
+        )
+    except Exception:
+        # Subscribers fall back to polling; never fail the status update
+        logger.exception("Failed to publish status of payment %s", payment_id)
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/payments/<uuid:payment_id>/', consumers.PaymentStatusConsumer.as_asgi()),
+]
@@ -2,8 +2,17 @@ import graphene
 from graphene_django import DjangoObjectType
 from graphene.types import JSONString
 from stationary_orders.models import Payment, Order, OrderItem, GuestCustomer
-from stationary_shops.models import Shop, ShopPricing, PageRangeDiscount, ServiceType
+from stationary_shops.models import Shop
+from stationary_shops.pricing import PricingEngine, CartProfile, PricedItem
+from stationary_shops.price_cache import get_price_sheets
+from stationary_shops.schema import ShopType
+from stationary_shops.spatial import clamp_radius, shops_by_distance
+from stationary_geo.utils import haversine
+from stationary_core.optimization import optimize_queryset
+from stationary_core.dataloaders import load_related
+from stationary_core.pagination import CursorPageObject, keyset_paginate, page_size
 from stationary_storage.models import Document
+from stationary_storage.access import invalidate_document_access
 from stationary_accounts.models import User
 from tarxemo_django_graphene_utils import (
     BaseResponseDTO,
@@ -13,10 +22,12 @@ from tarxemo_django_graphene_utils import (
 )
 from decimal import Decimal
 import json
-from django.db import transaction, models
+from django.db import transaction
 from django.db.models import Q
 import re
-from .clickpesa_service import ClickPesaService
+from functools import partial
+from .realtime import user_can_view_payment
+from .tasks import initiate_payment
 
 # ------------------------------
 # Types
@@ -32,6 +43,9 @@ class PaymentType(DjangoObjectType):
         model = Payment
         fields = "__all__"
 
+    def resolve_order(self, info):
+        return load_related(self, info, 'order')
+
 class OrderType(DjangoObjectType):
     class Meta:
         model = Order
@@ -39,24 +53,66 @@ class OrderType(DjangoObjectType):
     
     customer_info = JSONString()
     is_guest_order = graphene.Boolean()
+
+    # Relations read by the computed fields, for optimize_queryset
+    related_fields = {
+        'customer_info': ('customer', 'guest_customer'),
+    }
+
+    def resolve_shop(self, info):
+        return load_related(self, info, 'shop')
+
+    def resolve_customer(self, info):
+        return load_related(self, info, 'customer')
+
+    def resolve_guest_customer(self, info):
+        return load_related(self, info, 'guest_customer')
+
+    def resolve_payment(self, info):
+        return load_related(self, info, 'payment')
+
+    def resolve_items(self, info):
+        return load_related(self, info, 'items')
     
     def resolve_customer_info(self, info):
+        # Batch-load both sides so the model property reads cached relations
+        load_related(self, info, 'customer')
+        load_related(self, info, 'guest_customer')
         return self.customer_info
     
     def resolve_is_guest_order(self, info):
-        return self.is_guest_order
+        return self.guest_customer_id is not None
 
 class OrderItemType(DjangoObjectType):
     class Meta:
         model = OrderItem
         fields = "__all__"
 
+    def resolve_order(self, info):
+        return load_related(self, info, 'order')
+
+    def resolve_document(self, info):
+        return load_related(self, info, 'document')
+
 class OrderResponseDTO(BaseResponseDTO):
     data = graphene.List(OrderType)
 
 class SingleOrderResponseDTO(BaseResponseDTO):
     data = graphene.Field(OrderType)
 
+class OrderFeedResponseDTO(BaseResponseDTO):
+    data = graphene.List(OrderType)
+    page = graphene.Field(CursorPageObject)
+
+class ShopQuoteType(graphene.ObjectType):
+    shop = graphene.Field(ShopType)
+    total_price = graphene.Float()
+    commission_fee = graphene.Float()
+    distance = graphene.Float()
+
+class CartQuoteResponseDTO(BaseResponseDTO):
+    data = graphene.List(ShopQuoteType)
+
 class OrderItemInput(graphene.InputObjectType):
     document_id = graphene.UUID(required=True)
     page_count = graphene.Int(required=True)
@@ -74,6 +130,15 @@ class GuestContactInput(graphene.InputObjectType):
     email = graphene.String(required=False, help_text="Email address for order lookup")
     whatsapp_number = graphene.String(required=False, help_text="WhatsApp number for order lookup")
 
+class OrderFeedFilterInput(graphene.InputObjectType):
+    status = graphene.String()
+    payment_status = graphene.String()
+    created_after = graphene.DateTime()
+    created_before = graphene.DateTime()
+    shop_id = graphene.UUID()
+    first = graphene.Int(description="Page size (max 100)")
+    after = graphene.String(description="end_cursor of the previous page")
+
 class PaymentInput(graphene.InputObjectType):
     payment_method = graphene.String(required=True)
     phone_number = graphene.String(required=True)
@@ -84,72 +149,11 @@ class PaymentInput(graphene.InputObjectType):
 def calculate_item_price(shop, item_input, user=None):
     """
     Calculates price for a single item.
-    """
-    is_color = item_input.is_color
-    pages = item_input.page_count
-    size = item_input.paper_size
-    
-    # 1. Base Price
-    service_type = ServiceType.PRINTING_COLOR if is_color else ServiceType.PRINTING_BW
-    try:
-        pricing_rule = ShopPricing.objects.get(shop=shop, service_type=service_type)
-        base_rate = pricing_rule.base_price
-        modifiers = pricing_rule.modifiers
-    except ShopPricing.DoesNotExist:
-        base_rate = Decimal("100.00")  # Standard rate of TSh 100 per page for all printing
-        modifiers = {}
-
-    size_mod = Decimal(str(modifiers.get(size, "1.0")))
-    raw_cost = (Decimal(pages) * base_rate) * size_mod
-    
-    # 2. Tier Discount
-    tier = PageRangeDiscount.objects.filter(
-        shop=shop,
-        min_pages__lte=pages
-    ).filter(
-        models.Q(max_pages__gte=pages) | models.Q(max_pages__isnull=True)
-    ).first()
-    
-    if not tier:
-         tier = PageRangeDiscount.objects.filter(
-            shop__isnull=True,
-            min_pages__lte=pages
-        ).filter(
-             models.Q(max_pages__gte=pages) | models.Q(max_pages__isnull=True)
-        ).first()
-
-    if tier:
-        discount = raw_cost * (tier.discount_percent / Decimal("100.0"))
-        raw_cost -= discount
-
-    # 3. Extras
-    extras_cost = Decimal("0.00")
-    if item_input.is_binding:
-        try:
-            b_rule = ShopPricing.objects.get(shop=shop, service_type=ServiceType.BINDING)
-            extras_cost += b_rule.base_price
-        except:
-             extras_cost += Decimal("1000.00")
-             
-    if item_input.is_lamination:
-        try:
-             l_rule = ShopPricing.objects.get(shop=shop, service_type=ServiceType.LAMINATION)
-             extras_cost += l_rule.base_price
-        except:
-             extras_cost += Decimal("1000.00")
-
-    # 4. Customer Subscription Discount
-    if user:
-        sub_discount = Decimal("0.00")
-        if user.subscription_tier == User.Subscription.STUDENT:
-            sub_discount = Decimal("0.10")
-        elif user.subscription_tier == User.Subscription.BUSINESS:
-            sub_discount = Decimal("0.20")
-        
-        # Apply discount to total cost of this item
-        return (raw_cost + extras_cost) * (Decimal("1.0") - sub_discount)
 
-    return raw_cost + extras_cost
+    Prefer building one ``PricingEngine`` per shop when pricing several
+    items; this helper loads the shop's rules on every call.
+    """
+    return PricingEngine.for_shop(shop).price_item(item_input, user=user)
 
 # ------------------------------
 # Mutations
@@ -218,15 +222,21 @@ class CreateGuestOrderMutation(graphene.Mutation):
             order_items_data = []
             total_order_price = Decimal("0.00")
             
+            # Load the shop's pricing rules and every referenced document up
+            # front so the loop below runs without further queries.
+            pricing = PricingEngine.for_shop(shop)
+            documents = Document.objects.filter(is_uploaded=True).in_bulk([item.document_id for item in items])
+
             # Pre-calculation loop (no user discounts for guests)
             for item in items:
-                price = calculate_item_price(shop, item, user=None)
-                total_order_price += price
-                
-                try:
-                    doc = Document.objects.get(id=item.document_id)
-                except Document.DoesNotExist:
+                doc = documents.get(item.document_id)
+                if doc is None:
                     return CreateGuestOrderMutation(response=build_error(f"Document with ID {item.document_id} not found"))
+
+                # Page count and colour come from the document once extracted
+                item = PricedItem(item, doc)
+                price = pricing.price_item(item, user=None)
+                total_order_price += price
                 
                 order_items_data.append({
                     "document": doc,
@@ -242,7 +252,7 @@ class CreateGuestOrderMutation(graphene.Mutation):
 
             # Atomic Order Creation
             with transaction.atomic():
-                commission = total_order_price * Decimal("0.05")
+                commission = pricing.commission_for(total_order_price)
                 
                 # Validate payment option
                 valid_payment_options = [choice[0] for choice in Order.PaymentOption.choices]
@@ -272,31 +282,32 @@ class CreateGuestOrderMutation(graphene.Mutation):
                         payment_method=payment.payment_method,
                         amount=total_order_price,
                         phone_number=payment.phone_number,
-                        status=Payment.Status.PENDING
+                        status=Payment.Status.PENDING.value
                     )
-                    
-                    # Initiate payment with ClickPesa
-                    clickpesa_service = ClickPesaService()
-                    payment_result = clickpesa_service.initiate_mobile_money_payment(
-                        payment_obj, payment.phone_number, payment.payment_method
-                    )
-                    
-                    if not payment_result['success']:
-                        # If payment initiation fails, delete order and return error
-                        order.delete()
-                        return CreateGuestOrderMutation(response=build_error(f"Payment initiation failed: {payment_result['error']}"))
+
+                    # The USSD push is sent by a Celery task once the order
+                    # has committed; the client follows the payment status
+                    transaction.on_commit(partial(initiate_payment.delay, payment_obj.id))
                 
-                for data in order_items_data:
-                    OrderItem.objects.create(
+                OrderItem.objects.bulk_create([
+                    OrderItem(
                         order=order,
                         document=data["document"],
                         price=data["price"],
                         page_count=data["page_count"],
                         config_snapshot=data["config_snapshot"]
                     )
+                    for data in order_items_data
+                ])
+
+                # The customer and the shop owner may now open these files
+                invalidate_document_access(
+                    [order.customer_id, shop.owner_id],
+                    [data["document"].id for data in order_items_data]
+                )
 
             return CreateGuestOrderMutation(
-                response=build_success_response("Guest order placed successfully" + (" and payment initiated" if payment else "")),
+                response=build_success_response("Guest order placed successfully" + (" and payment requested" if payment else "")),
                 order=order,
                 payment=payment_obj
             )
@@ -350,15 +361,21 @@ class CreateOrderMutation(graphene.Mutation):
             order_items_data = []
             total_order_price = Decimal("0.00")
             
+            # Load the shop's pricing rules and every referenced document up
+            # front so the loop below runs without further queries.
+            pricing = PricingEngine.for_shop(shop)
+            documents = Document.objects.filter(is_uploaded=True).in_bulk([item.document_id for item in items])
+
             # Pre-calculation loop
             for item in items:
-                price = calculate_item_price(shop, item, user=user if user.is_authenticated else None)
-                total_order_price += price
-                
-                try:
-                    doc = Document.objects.get(id=item.document_id)
-                except Document.DoesNotExist:
+                doc = documents.get(item.document_id)
+                if doc is None:
                     return CreateOrderMutation(response=build_error(f"Document with ID {item.document_id} not found. Please upload a new document or select from your documents."))
+
+                # Page count and colour come from the document once extracted
+                item = PricedItem(item, doc)
+                price = pricing.price_item(item, user=user if user.is_authenticated else None)
+                total_order_price += price
                 
                 # For testing, allow any user to use any document
                 # In production, you might want to enforce ownership: if doc.owner != user:
@@ -378,7 +395,7 @@ class CreateOrderMutation(graphene.Mutation):
 
             # Atomic Order Creation
             with transaction.atomic():
-                commission = total_order_price * Decimal("0.05")
+                commission = pricing.commission_for(total_order_price)
                 
                 order = Order.objects.create(
                     customer=user if user.is_authenticated else None,
@@ -395,31 +412,33 @@ class CreateOrderMutation(graphene.Mutation):
                     payment_method=payment.payment_method,
                     amount=total_order_price,
                     phone_number=payment.phone_number,
-                    status=Payment.Status.PENDING
-                )
-                
-                # Initiate payment with ClickPesa
-                clickpesa_service = ClickPesaService()
-                payment_result = clickpesa_service.initiate_mobile_money_payment(
-                    payment_obj, payment.phone_number, payment.payment_method
+                    status=Payment.Status.PENDING.value
                 )
+
+
+                # The USSD push is sent by a Celery task once the order
+                # has committed; the client follows the payment status
+                transaction.on_commit(partial(initiate_payment.delay, payment_obj.id))
                 
-                if not payment_result['success']:
-                    # If payment initiation fails, delete order and return error
-                    order.delete()
-                    return CreateOrderMutation(response=build_error(f"Payment initiation failed: {payment_result['error']}"))
-                
-                for data in order_items_data:
-                    OrderItem.objects.create(
+                OrderItem.objects.bulk_create([
+                    OrderItem(
                         order=order,
                         document=data["document"],
                         price=data["price"],
                         page_count=data["page_count"],
                         config_snapshot=data["config_snapshot"]
                     )
+                    for data in order_items_data
+                ])
+
+                # The customer and the shop owner may now open these files
+                invalidate_document_access(
+                    [order.customer_id, shop.owner_id],
+                    [data["document"].id for data in order_items_data]
+                )
 
             return CreateOrderMutation(
-                response=build_success_response("Order placed successfully and payment initiated"),
+                response=build_success_response("Order placed successfully and payment requested"),
                 order=order,
                 payment=payment_obj
             )
@@ -435,6 +454,10 @@ class CreateOrderMutation(graphene.Mutation):
 # Query
 # ------------------------------
 
+# Shops a single quoteCart prices at most
+MAX_QUOTED_SHOPS = 200
+
+
 class Query(graphene.ObjectType):
     my_orders = graphene.List(OrderType)
     shop_orders = graphene.List(OrderType, shop_id=graphene.UUID(required=True))
@@ -442,6 +465,72 @@ class Query(graphene.ObjectType):
     orders = graphene.Field(OrderResponseDTO)
     guest_orders = graphene.List(OrderType, contact_info=graphene.Argument(GuestContactInput, required=True))
     payment_status = graphene.Field(PaymentType, payment_id=graphene.UUID(required=True))
+    my_order_feed = graphene.Field(OrderFeedResponseDTO, filter_input=OrderFeedFilterInput())
+    shop_order_feed = graphene.Field(OrderFeedResponseDTO, filter_input=OrderFeedFilterInput())
+    admin_order_feed = graphene.Field(OrderFeedResponseDTO, filter_input=OrderFeedFilterInput())
+    quote_cart = graphene.Field(
+        CartQuoteResponseDTO,
+        items=graphene.List(OrderItemInput, required=True),
+        shop_ids=graphene.List(graphene.UUID),
+        latitude=graphene.Float(),
+        longitude=graphene.Float(),
+        radius_km=graphene.Float(),
+        limit=graphene.Int(),
+    )
+
+    def resolve_quote_cart(self, info, items, shop_ids=None, latitude=None, longitude=None, radius_km=None, limit=None):
+        """
+        Price one cart at many shops and rank them cheapest first.
+
+        Candidate shops come from ``shop_ids`` or from a radius search
+        (at most ``MAX_QUOTED_SHOPS``, nearest first). Their price sheets are fetched in bulk (cache, then a single
+        compile for any misses) and the cart is reduced to a
+        ``CartProfile`` once, so each shop costs a handful of arithmetic
+        operations rather than a pass over every item.
+        """
+        user = info.context.user
+        if not items:
+            return CartQuoteResponseDTO(response=build_error("Cart is empty"), data=[])
+
+        has_location = latitude is not None and longitude is not None
+        qs = Shop.objects.filter(is_accepting_orders=True)
+        if shop_ids:
+            if len(shop_ids) > MAX_QUOTED_SHOPS:
+                return CartQuoteResponseDTO(
+                    response=build_error(f"At most {MAX_QUOTED_SHOPS} shops can be quoted at once"),
+                    data=[]
+                )
+            shops = list(qs.filter(id__in=shop_ids))
+            if has_location:
+                for shop in shops:
+                    shop.distance = haversine(latitude, longitude, shop.latitude, shop.longitude)
+        elif has_location and radius_km is not None:
+            shops = list(shops_by_distance(qs, latitude, longitude, clamp_radius(radius_km))[:MAX_QUOTED_SHOPS])
+        else:
+            return CartQuoteResponseDTO(
+                response=build_error("Provide shop_ids or latitude, longitude and radius_km"),
+                data=[]
+            )
+
+        profile = CartProfile(PricedItem.for_items(items, user))
+        sheets = get_price_sheets(shops)
+        customer = user if user.is_authenticated else None
+
+        quotes = []
+        for shop in shops:
+            pricing = PricingEngine(sheets[shop.id])
+            total_price = pricing.price_cart(profile, user=customer)
+            quotes.append(ShopQuoteType(
+                shop=shop,
+                total_price=float(total_price),
+                commission_fee=float(pricing.commission_for(total_price)),
+                distance=getattr(shop, 'distance', None),
+            ))
+
+        quotes.sort(key=lambda q: (q.total_price, q.distance if q.distance is not None else float('inf')))
+        quotes = quotes[:page_size(limit)]
+
+        return CartQuoteResponseDTO(response=build_success_response(), data=quotes)
 
     def resolve_payment_status(self, info, payment_id):
         user = info.context.user
@@ -451,23 +540,11 @@ class Query(graphene.ObjectType):
             payment = Payment.objects.get(id=payment_id)
             
             # Additional security: only allow if user owns the order or is guest
-            if user.is_authenticated:
-                if payment.order.customer != user:
-                    return None
-            else:
-                # For unauthenticated users, check if it's a guest order
-                if not payment.order.guest_customer:
-                    return None
+            if not user_can_view_payment(user, payment):
+                return None
                     
-            # Actively poll ClickPesa for latest status if it is still processing
-            if payment.status in [Payment.Status.PENDING, Payment.Status.PROCESSING]:
-                try:
-                    clickpesa_service = ClickPesaService()
-                    clickpesa_service.check_payment_status(payment)
-                    payment.refresh_from_db()
-                except Exception as e:
-                    print(f"Failed to check payment status from ClickPesa: {e}")
-            
+            # Served from our database only: webhooks and the reconcile_payments
+            # beat task keep it current, however many clients are watching
             return payment
             
         except Payment.DoesNotExist:
@@ -482,16 +559,13 @@ class Query(graphene.ObjectType):
             print('Debug - my_orders resolver: returning [] (not authenticated)')
             return []
         
-        orders = Order.objects.filter(customer=user)
-        print(f'Debug - my_orders resolver - found {orders.count()} orders for user')
-        
-        return orders
+        return optimize_queryset(Order.objects.filter(customer=user), info)
 
     def resolve_all_my_shop_orders(self, info):
         user = info.context.user
         if not user.is_authenticated: return []
         # Return all orders for all shops owned by this user
-        return Order.objects.filter(shop__owner=user)
+        return optimize_queryset(Order.objects.filter(shop__owner=user), info)
 
     def resolve_shop_orders(self, info, shop_id):
         user = info.context.user
@@ -499,7 +573,7 @@ class Query(graphene.ObjectType):
         try:
             shop = Shop.objects.get(id=shop_id)
             if shop.owner != user: return []
-            return Order.objects.filter(shop=shop)
+            return optimize_queryset(Order.objects.filter(shop=shop), info)
         except Shop.DoesNotExist:
             return []
 
@@ -510,7 +584,7 @@ class Query(graphene.ObjectType):
             return {"response": build_error("Permission denied"), "data": []}
         
         try:
-            orders = Order.objects.all()
+            orders = optimize_queryset(Order.objects.all(), info)
             return {
                 "response": build_success_response("Orders retrieved successfully"),
                 "data": orders
@@ -521,6 +595,65 @@ class Query(graphene.ObjectType):
                 "data": []
             }
 
+    # ------------------------------
+    # Order feeds
+    # ------------------------------
+
+    @staticmethod
+    def _order_feed(info, qs, filter_input):
+        """
+        Filter *qs* and return one keyset page of it, newest first.
+
+        Pages are cut on (created_at, id) so each one is a single range
+        scan of the feed indexes on Order, however deep the client pages.
+        """
+        if filter_input:
+            if filter_input.status:
+                qs = qs.filter(status=filter_input.status)
+            if filter_input.payment_status:
+                qs = qs.filter(payment_status=filter_input.payment_status)
+            if filter_input.created_after:
+                qs = qs.filter(created_at__gte=filter_input.created_after)
+            if filter_input.created_before:
+                qs = qs.filter(created_at__lt=filter_input.created_before)
+            if filter_input.shop_id:
+                qs = qs.filter(shop_id=filter_input.shop_id)
+
+        try:
+            rows, has_next_page, end_cursor = keyset_paginate(
+                optimize_queryset(qs, info),
+                ('-created_at', '-id'),
+                first=getattr(filter_input, 'first', None),
+                after=getattr(filter_input, 'after', None),
+            )
+        except ValueError as e:
+            return {"response": build_error(str(e)), "data": [], "page": None}
+
+        return {
+            "response": build_success_response(),
+            "data": rows,
+            "page": CursorPageObject(has_next_page=has_next_page, end_cursor=end_cursor),
+        }
+
+    def resolve_my_order_feed(self, info, filter_input=None):
+        user = info.context.user
+        if not user.is_authenticated:
+            return {"response": build_error("Authentication required"), "data": []}
+        return Query._order_feed(info, Order.objects.filter(customer=user), filter_input)
+
+    def resolve_shop_order_feed(self, info, filter_input=None):
+        """Orders of every shop the user owns; narrow to one with shop_id."""
+        user = info.context.user
+        if not user.is_authenticated:
+            return {"response": build_error("Authentication required"), "data": []}
+        return Query._order_feed(info, Order.objects.filter(shop__owner=user), filter_input)
+
+    def resolve_admin_order_feed(self, info, filter_input=None):
+        user = info.context.user
+        if not user.is_authenticated or user.role != User.Role.ADMIN:
+            return {"response": build_error("Permission denied"), "data": []}
+        return Query._order_feed(info, Order.objects.all(), filter_input)
+
     def resolve_guest_orders(self, info, contact_info):
         """
         Resolve guest orders based on contact information (email or WhatsApp number)
@@ -534,23 +667,19 @@ class Query(graphene.ObjectType):
         # Build query filters - use guest_customer field instead of is_guest_order property
         filters = Q(guest_customer__isnull=False)
 
+        # Case-insensitive via __lower so the Lower() indexes apply
         if email:
-            filters &= Q(guest_customer__email__iexact=email)
+            filters &= Q(guest_customer__email__lower=email.lower())
         
         if whatsapp_number:
-            filters &= Q(guest_customer__whatsapp_number__iexact=whatsapp_number)
+            filters &= Q(guest_customer__whatsapp_number__lower=whatsapp_number.lower())
 
         # If neither email nor whatsapp provided, return empty
         if not email and not whatsapp_number:
             return Order.objects.none()
 
         # Query orders matching the contact information
-        orders = Order.objects.filter(filters).select_related(
-            'shop', 'guest_customer'
-        ).prefetch_related('items').order_by('-created_at')
-
-        print(f'Debug - guest_orders resolver - found {orders.count()} orders for contact: {contact_info}')
-        return orders
+        return optimize_queryset(Order.objects.filter(filters), info).order_by('-created_at')
 
 class UpdateOrderStatusMutation(graphene.Mutation):
     class Arguments:
@@ -0,0 +1,49 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from stationary_orders.models import Order, OrderItem
+from stationary_shops.models import Shop
+from stationary_storage.access import invalidate_document_access
+
+# Document access (stationary_storage.access) follows an order's customer
+# and its shop's owner. The order mutations bulk-create items, which
+# sends no signals, and invalidate themselves; these receivers cover the
+# later changes: reassigning an order, deleting it, and items added or
+# removed one at a time (admin).
+
+
+def _parties(*pairs):
+    """Customers and shop owners of ``(customer_id, shop_id)`` pairs."""
+    shop_ids = {shop_id for _customer_id, shop_id in pairs if shop_id is not None}
+    owner_ids = Shop.objects.filter(id__in=shop_ids).values_list('owner_id', flat=True)
+    return [customer_id for customer_id, _shop_id in pairs] + list(owner_ids)
+
+
+def _document_ids(order):
+    return list(order.items.values_list('document_id', flat=True))
+
+
+@receiver(post_save, sender=Order)
+def invalidate_reassigned_order(sender, instance, created, **kwargs):
+    current = (instance.customer_id, instance.shop_id)
+    loaded = getattr(instance, '_loaded_parties', None)
+    instance._loaded_parties = current
+    if created or loaded is None or loaded == current:
+        return
+    invalidate_document_access(_parties(loaded, current), _document_ids(instance))
+
+
+@receiver(pre_delete, sender=Order)
+def invalidate_deleted_order(sender, instance, **kwargs):
+    # Items are still there before the cascade runs
+    invalidate_document_access(
+        _parties((instance.customer_id, instance.shop_id)), _document_ids(instance)
+    )
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def invalidate_order_item(sender, instance, **kwargs):
+    order = Order.objects.filter(id=instance.order_id).values_list('customer_id', 'shop_id').first()
+    if order is not None:
+        invalidate_document_access(_parties(order), [instance.document_id])
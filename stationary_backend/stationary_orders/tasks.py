@@ -0,0 +1,276 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .clickpesa_service import ClickPesaService
+from .models import Order, Payment, WebhookEvent
+from .realtime import publish_payment_status
+
+logger = logging.getLogger(__name__)
+
+# Backoff for retrying a payment initiation: 2, 4, 8, 16, 32 seconds
+# (capped at 60) with full jitter, so a ClickPesa outage is retried for
+# about a minute before the payment is marked failed.
+INITIATE_MAX_RETRIES = 5
+INITIATE_BACKOFF_BASE = 2
+INITIATE_BACKOFF_MAX = 60
+
+
+def is_transient(exc):
+    """
+    Connection errors, 429 and 5xx are worth retrying. A read timeout is
+    not on its own: ClickPesa may have accepted the request before its
+    answer was lost.
+    """
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return isinstance(exc, requests.exceptions.ConnectionError)
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def backoff(retries):
+    delay = min(INITIATE_BACKOFF_BASE * (2 ** retries), INITIATE_BACKOFF_MAX)
+    return random.uniform(0, delay)
+
+
+@shared_task(bind=True, max_retries=INITIATE_MAX_RETRIES, acks_late=True)
+def initiate_payment(self, payment_id):
+    """
+    Send the ClickPesa USSD push for a newly created payment.
+
+    Queued by the order mutations once the order has committed, so the
+    request never waits on the gateway. The payment moves from PENDING to
+    PROCESSING on success, or to FAILED (with the order marked
+    PAYMENT_FAILED) once the error is permanent or retries are exhausted.
+    """
+    payment = Payment.objects.select_related('order').filter(id=payment_id).first()
+    if payment is None or payment.status != Payment.Status.PENDING:
+        # Deleted, or already handled by an earlier delivery of this task
+        return
+
+    service = ClickPesaService()
+    try:
+        # An earlier attempt may have gone through all the same (a 5xx
+        # after ClickPesa had accepted it, or a worker lost mid-push and
+        # this task redelivered, with retries back at 0); pick its push up
+        # rather than sending the customer a second one
+        if payment.push_attempts and service.adopt_existing_push(payment):
+            return
+        service.start_ussd_push(payment, payment.phone_number)
+    except requests.exceptions.RequestException as e:
+        retryable = is_transient(e)
+        if isinstance(e, requests.exceptions.ReadTimeout):
+            # Ask ClickPesa whether the push went out before sending it again
+            try:
+                if service.adopt_existing_push(payment):
+                    return
+                retryable = True
+            except requests.exceptions.RequestException as lookup_error:
+                retryable = is_transient(lookup_error)
+        if retryable and self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=backoff(self.request.retries))
+        service.mark_failed(payment, service.error_message(e))
+
+
+# ------------------------------
+# Status reconciliation
+# ------------------------------
+
+RECONCILE_LOCK_KEY = 'payments:reconcile:lock'
+# Payment fields a ClickPesa status can change
+RECONCILED_FIELDS = ('status', 'reference_number', 'channel', 'failure_reason')
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+@shared_task
+def reconcile_payments():
+    """
+    Bring open payments up to date with ClickPesa, for when a webhook is
+    late or lost.
+
+    Run by Celery beat every ``PAYMENT_RECONCILE_INTERVAL`` seconds. Looks
+    up every PENDING/PROCESSING payment sent to ClickPesa between
+    ``PAYMENT_RECONCILE_MIN_AGE`` and ``PAYMENT_RECONCILE_MAX_AGE`` seconds
+    ago, newest first, at most
+    ``PAYMENT_RECONCILE_CONCURRENCY`` at a time and ``PAYMENT_RECONCILE_RATE``
+    per second. Only one run happens at a time, so that is also the limit for
+    the whole deployment. Changed rows are written with one bulk update per
+    table, and the new status is pushed to waiting clients.
+    """
+    interval = settings.PAYMENT_RECONCILE_INTERVAL
+    if not cache.add(RECONCILE_LOCK_KEY, 1, timeout=interval * 10):
+        # The previous run is still going
+        return 0
+    try:
+        return _reconcile_open_payments()
+    finally:
+        cache.delete(RECONCILE_LOCK_KEY)
+
+
+def _reconcile_open_payments():
+    now = timezone.now()
+    newest = now - timedelta(seconds=settings.PAYMENT_RECONCILE_MIN_AGE)
+    oldest = now - timedelta(seconds=settings.PAYMENT_RECONCILE_MAX_AGE)
+    payments = list(
+        Payment.objects
+        .select_related('order')
+        .filter(
+            status__in=[Payment.Status.PENDING, Payment.Status.PROCESSING],
+            clickpesa_payment_id__isnull=False,
+            created_at__range=(oldest, newest),
+        )
+        .order_by('-created_at')[:settings.PAYMENT_RECONCILE_BATCH_SIZE]
+    )
+    if not payments:
+        return 0
+
+    service = ClickPesaService()
+    limiter = RateLimiter(settings.PAYMENT_RECONCILE_RATE)
+
+    def fetch(payment):
+        limiter.wait()
+        try:
+            return service.fetch_payment_status(payment)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Status check of payment %s failed: %s", payment.id, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=settings.PAYMENT_RECONCILE_CONCURRENCY) as pool:
+        results = list(pool.map(fetch, payments))
+
+    statuses = {payment.id: data for payment, data in zip(payments, results) if data is not None}
+    changed = []
+    if statuses:
+        with transaction.atomic():
+            # The lookups took a while; a webhook may have settled some of
+            # these payments since. Re-read them locked (as
+            # apply_webhook_events does) and only touch those still open.
+            fresh = (
+                Payment.objects
+                .select_for_update(of=('self',))
+                .select_related('order')
+                .filter(id__in=statuses, status__in=[Payment.Status.PENDING, Payment.Status.PROCESSING])
+            )
+            now = timezone.now()
+            for payment in fresh:
+                before = [getattr(payment, field) for field in RECONCILED_FIELDS] + [payment.order.payment_status]
+                if not service.apply_clickpesa_status(payment, statuses[payment.id]):
+                    continue
+                after = [getattr(payment, field) for field in RECONCILED_FIELDS] + [payment.order.payment_status]
+                if after != before:
+                    # bulk_update() skips auto_now
+                    payment.updated_at = payment.order.updated_at = now
+                    changed.append(payment)
+
+            if changed:
+                Payment.objects.bulk_update(changed, [*RECONCILED_FIELDS, 'updated_at'])
+                Order.objects.bulk_update([p.order for p in changed], ['payment_status', 'updated_at'])
+                for payment in changed:
+                    publish_payment_status(payment)
+
+    logger.info("Reconciled %d open payments, %d changed", len(payments), len(changed))
+    return len(changed)
+
+
+# ------------------------------
+# Webhook inbox
+# ------------------------------
+
+# A webhook can arrive before initiate_payment has stored the ClickPesa id;
+# its events wait in the inbox while the task retries with the same
+# jittered backoff as initiation (a few minutes in total)
+WEBHOOK_MAX_RETRIES = 8
+
+
+@shared_task(bind=True, max_retries=WEBHOOK_MAX_RETRIES, acks_late=True)
+def apply_webhook_events(self, clickpesa_payment_id):
+    """
+    Apply the pending ``WebhookEvent``s of one ClickPesa transaction.
+
+    The payment row is locked for the duration, so concurrent tasks for the
+    same payment run one after another. Each run applies every pending event
+    in arrival order and marks them processed in the same transaction. An
+    event is therefore applied exactly once, however often it was delivered
+    or queued.
+    """
+    service = ClickPesaService()
+    with transaction.atomic():
+        payment = (
+            Payment.objects
+            .select_for_update(of=('self',))
+            .select_related('order')
+            .filter(clickpesa_payment_id=clickpesa_payment_id)
+            .first()
+        )
+        pending = WebhookEvent.objects.filter(
+            clickpesa_payment_id=clickpesa_payment_id,
+            processed_at__isnull=True,
+        )
+        if payment is None:
+            if self.request.retries < self.max_retries:
+                raise self.retry(countdown=backoff(self.request.retries))
+            pending.update(attempts=F('attempts') + 1, last_error='No payment with this ClickPesa id')
+            return 0
+
+        events = list(pending.order_by('id'))
+        changed = False
+        for event in events:
+            changed = service.apply_clickpesa_status(payment, event.payload) or changed
+
+        if changed:
+            payment.save()
+            payment.order.save()
+            publish_payment_status(payment)
+        WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(
+            processed_at=timezone.now(),
+            attempts=F('attempts') + 1,
+            last_error='',
+        )
+    return len(events)
+
+
+@shared_task
+def requeue_webhook_events():
+    """
+    Queue ``apply_webhook_events`` again for events still pending after
+    ``WEBHOOK_REQUEUE_AFTER`` seconds (lost task, worker crash), so
+    nothing recorded in the inbox is ever left unapplied.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.WEBHOOK_REQUEUE_AFTER)
+    payment_ids = list(
+        WebhookEvent.objects
+        .filter(processed_at__isnull=True, received_at__lte=cutoff, last_error='')
+        .order_by()
+        .values_list('clickpesa_payment_id', flat=True)
+        .distinct()[:500]
+    )
+    for clickpesa_payment_id in payment_ids:
+        apply_webhook_events.delay(clickpesa_payment_id)
+    return len(payment_ids)
@@ -1,3 +1,401 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from stationary_accounts.models import User
+from stationary_core.pagination import MAX_ITEMS_PER_PAGE
+from stationary_core.testing import GraphQLTestMixin
+from stationary_shops.models import Shop
+from stationary_storage.models import Document
+
+from . import tasks
+from .clickpesa_service import TOKEN_CACHE_KEY, TOKEN_LOCK_KEY, ClickPesaService, TokenManager
+from .models import Order, OrderItem, Payment, WebhookEvent
+from .schema import MAX_QUOTED_SHOPS
+
+WEBHOOK_URL = '/api/payments/webhook/clickpesa/'
+PUSHED = {'id': 'CP1', 'status': 'PROCESSING', 'orderReference': 'REF1'}
+
+
+def sign(payload, secret):
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class ClickPesaWebhookTests(TestCase):
+    payload = {'id': 'x1', 'status': 'SUCCESS', 'orderReference': 'REF1'}
+
+    def post(self, payload):
+        return self.client.post(WEBHOOK_URL, json.dumps(payload), content_type='application/json')
+
+    @override_settings(CLICKPESA_SECRET_KEY='')
+    def test_unsigned_payload_rejected_without_secret(self):
+        response = self.post(self.payload)
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    @override_settings(CLICKPESA_SECRET_KEY='s3cret')
+    def test_unsigned_payload_rejected(self):
+        response = self.post(self.payload)
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    @override_settings(CLICKPESA_SECRET_KEY='s3cret')
+    def test_wrong_checksum_rejected(self):
+        response = self.post({**self.payload, 'checksum': sign(self.payload, 'other')})
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    @override_settings(CLICKPESA_SECRET_KEY='s3cret')
+    def test_signed_payload_recorded(self):
+        response = self.post({**self.payload, 'checksum': sign(self.payload, 's3cret')})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.get().clickpesa_payment_id, 'x1')
+
+
+class InlineExecutor:
+    """ThreadPoolExecutor stand-in running the calls in the test's thread."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, fn, *iterables):
+        return list(map(fn, *iterables))
+
+
+@mock.patch.object(tasks, 'publish_payment_status')
+@mock.patch.object(tasks, 'ThreadPoolExecutor', InlineExecutor)
+class ReconcilePaymentsTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user(email='c@example.com', password='x')
+        shop = Shop.objects.create(owner=customer, name='s', address='a', latitude=-6.1, longitude=35.7)
+        order = Order.objects.create(customer=customer, shop=shop, total_price=Decimal('1000'))
+        self.payment = Payment.objects.create(
+            order=order, payment_method='MPESA', amount=Decimal('1000'),
+            status=Payment.Status.PROCESSING, clickpesa_payment_id='CP1',
+        )
+        Payment.objects.filter(id=self.payment.id).update(created_at=timezone.now() - timedelta(minutes=5))
+
+    def test_open_payment_updated(self, publish):
+        with mock.patch.object(ClickPesaService, 'fetch_payment_status', return_value={'status': 'SUCCESS'}):
+            self.assertEqual(tasks._reconcile_open_payments(), 1)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.Status.COMPLETED)
+        self.assertEqual(self.payment.order.payment_status, Order.PaymentStatus.PAID)
+        publish.assert_called_once()
+
+    def test_channel_learned_from_status_saved(self, publish):
+        data = {'status': 'PROCESSING', 'channel': 'TIGO-PESA'}
+        with mock.patch.object(ClickPesaService, 'fetch_payment_status', return_value=data):
+            self.assertEqual(tasks._reconcile_open_payments(), 1)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.channel, 'TIGO-PESA')
+
+    def test_webhook_during_lookup_not_overwritten(self, publish):
+        Payment.objects.filter(id=self.payment.id).update(status=Payment.Status.PENDING)
+
+        def settled_meanwhile(service, payment):
+            # A webhook settles the payment while ClickPesa is being asked
+            Payment.objects.filter(id=payment.id).update(status=Payment.Status.COMPLETED)
+            Order.objects.filter(id=payment.order_id).update(payment_status=Order.PaymentStatus.PAID)
+            return {'status': 'PROCESSING'}
+
+        with mock.patch.object(ClickPesaService, 'fetch_payment_status', settled_meanwhile):
+            self.assertEqual(tasks._reconcile_open_payments(), 0)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.Status.COMPLETED)
+        self.assertEqual(self.payment.order.payment_status, Order.PaymentStatus.PAID)
+        publish.assert_not_called()
+
+
+@mock.patch.object(tasks, 'backoff', lambda retries: 0)
+@mock.patch('stationary_orders.clickpesa_service.publish_payment_status')
+class InitiatePaymentTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user(email='c@example.com', password='x')
+        shop = Shop.objects.create(owner=customer, name='s', address='a', latitude=-6.1, longitude=35.7)
+        order = Order.objects.create(customer=customer, shop=shop, total_price=Decimal('1000'))
+        self.payment = Payment.objects.create(
+            order=order, payment_method='MPESA', amount=Decimal('1000'), phone_number='255700000000',
+        )
+
+    def run_task(self, push_effects, lookups):
+        preview = {'activeMethods': [{'name': 'M-PESA', 'status': 'AVAILABLE'}]}
+        with mock.patch.object(ClickPesaService, 'preview_ussd_push', return_value=preview), \
+                mock.patch.object(ClickPesaService, 'initiate_ussd_push', side_effect=push_effects) as push, \
+                mock.patch.object(ClickPesaService, 'find_payment_by_reference', side_effect=lookups) as lookup:
+            tasks.initiate_payment.apply(args=[str(self.payment.id)])
+        self.payment.refresh_from_db()
+        return push, lookup
+
+    def test_read_timeout_adopts_accepted_push(self, publish):
+        push, lookup = self.run_task(
+            [requests.exceptions.ReadTimeout('slow')],
+            [{'id': 'CP9', 'status': 'PROCESSING', 'orderReference': 'REF9'}],
+        )
+        self.assertEqual(push.call_count, 1)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(self.payment.status, Payment.Status.PROCESSING)
+        self.assertEqual(self.payment.clickpesa_payment_id, 'CP9')
+        self.assertEqual(self.payment.order.payment_status, Order.PaymentStatus.PENDING_PAYMENT)
+
+    def test_read_timeout_retried_when_clickpesa_has_no_push(self, publish):
+        push, lookup = self.run_task(
+            [requests.exceptions.ReadTimeout('slow'), PUSHED],
+            [None, None],
+        )
+        # Looked up after the timeout and again before the second push
+        self.assertEqual(push.call_count, 2)
+        self.assertEqual(lookup.call_count, 2)
+
+    def test_read_timeout_with_unknown_outcome_not_failed_blindly(self, publish):
+        push, lookup = self.run_task(
+            [requests.exceptions.ReadTimeout('slow')],
+            [requests.exceptions.ConnectionError('down'), {'id': 'CP9', 'status': 'SUCCESS'}],
+        )
+        self.assertEqual(push.call_count, 1)
+        self.assertEqual(self.payment.status, Payment.Status.COMPLETED)
+        self.assertEqual(self.payment.order.payment_status, Order.PaymentStatus.PAID)
+
+    def test_redelivered_task_adopts_push_of_lost_worker(self, publish):
+        # The worker died after sending the push; acks_late redelivers the
+        # task with retries at 0
+        Payment.objects.filter(id=self.payment.id).update(push_attempts=1)
+        push, lookup = self.run_task([PUSHED], [{'id': 'CP9', 'status': 'PROCESSING'}])
+        self.assertEqual(push.call_count, 0)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(self.payment.clickpesa_payment_id, 'CP9')
+        self.assertEqual(self.payment.push_attempts, 1)
+
+    def test_redelivered_task_pushes_when_clickpesa_has_none(self, publish):
+        Payment.objects.filter(id=self.payment.id).update(push_attempts=1)
+        push, lookup = self.run_task([PUSHED], [None])
+        self.assertEqual(push.call_count, 1)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(self.payment.status, Payment.Status.PROCESSING)
+        self.assertEqual(self.payment.push_attempts, 2)
+
+    def test_connect_error_retried(self, publish):
+        push, lookup = self.run_task(
+            [requests.exceptions.ConnectTimeout('unreachable'), PUSHED],
+            [None],
+        )
+        self.assertEqual(push.call_count, 2)
+        self.assertEqual(lookup.call_count, 1)
+
+
+@override_settings(CLICKPESA_TOKEN_TTL=3600, CLICKPESA_TOKEN_REFRESH_MARGIN=300)
+@mock.patch.object(TokenManager, 'POLL_INTERVAL', 0.01)
+class TokenManagerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.minted = []
+
+    def mint(self):
+        time.sleep(0.1)
+        self.minted.append(1)
+        return f'token-{len(self.minted)}'
+
+    def test_concurrent_callers_mint_once(self):
+        # Two managers stand for two processes sharing the cache
+        managers = [TokenManager(), TokenManager()]
+        barrier = threading.Barrier(16)
+        tokens = []
+
+        def call(manager):
+            barrier.wait()
+            tokens.append(manager.get_token(self.mint))
+
+        threads = [threading.Thread(target=call, args=(managers[i % 2],)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.minted), 1)
+        self.assertEqual(tokens, ['token-1'] * 16)
+
+    def test_token_reused_until_refresh_due(self):
+        manager = TokenManager()
+        manager.get_token(self.mint)
+
+        self.assertEqual(TokenManager().get_token(self.mint), 'token-1')
+        self.assertEqual(len(self.minted), 1)
+
+    def test_refreshing_elsewhere_keeps_current_token_in_use(self):
+        # Inside the refresh margin but not expired, and another process
+        # holds the refresh lock
+        cache.set(TOKEN_CACHE_KEY, ('old', time.time() + 60))
+        cache.add(TOKEN_LOCK_KEY, 1)
+
+        self.assertEqual(TokenManager().get_token(self.mint), 'old')
+        self.assertEqual(self.minted, [])
+
+    def test_invalidated_token_replaced(self):
+        manager = TokenManager()
+        token = manager.get_token(self.mint)
+
+        manager.invalidate(token)
+
+        self.assertEqual(manager.get_token(self.mint), 'token-2')
+        self.assertEqual(cache.get(TOKEN_CACHE_KEY)[0], 'token-2')
+
+
+QUOTE_QUERY = '''
+query ($items: [OrderItemInput]!, $shopIds: [UUID], $radiusKm: Float, $limit: Int) {
+  quoteCart(items: $items, shopIds: $shopIds, latitude: -6.8, longitude: 39.28, radiusKm: $radiusKm, limit: $limit) {
+    response { success message }
+    data { totalPrice distance }
+  }
+}
+'''
+ITEMS = [{'documentId': '00000000-0000-0000-0000-000000000000', 'pageCount': 10, 'isColor': False}]
+
+
+class QuoteCartTests(GraphQLTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user(email='o@example.com', password='x')
+
+    def quote(self, **variables):
+        return self.graphql(QUOTE_QUERY, items=ITEMS, **variables)['quoteCart']
+
+    def test_limit_clamped(self):
+        for i in range(MAX_ITEMS_PER_PAGE + 1):
+            Shop.objects.create(owner=self.owner, name=f's{i}', address='x', latitude=-6.8, longitude=39.28 + i * 1e-4)
+
+        result = self.quote(radiusKm=5, limit=10 ** 6)
+
+        self.assertTrue(result['response']['success'])
+        self.assertEqual(len(result['data']), MAX_ITEMS_PER_PAGE)
+
+    def test_radius_clamped(self):
+        Shop.objects.create(owner=self.owner, name='near', address='x', latitude=-6.8, longitude=39.29)
+        Shop.objects.create(owner=self.owner, name='other city', address='x', latitude=-0.8, longitude=39.28)
+
+        result = self.quote(radiusKm=1e9)
+
+        self.assertEqual(len(result['data']), 1)
+        self.assertLess(result['data'][0]['distance'], 2)
+
+    def test_too_many_shop_ids_rejected(self):
+        shop_ids = [f'00000000-0000-0000-0000-{i:012d}' for i in range(MAX_QUOTED_SHOPS + 1)]
+
+        result = self.quote(shopIds=shop_ids)
+
+        self.assertFalse(result['response']['success'])
+        self.assertEqual(result['data'], [])
+
+
+FEED_QUERY = '''
+query ($filter: OrderFeedFilterInput) {
+  myOrderFeed(filterInput: $filter) {
+    response { success message }
+    data {
+      id customerInfo
+      shop { name owner { email } }
+      payment { status }
+      items { price document { fileName } }
+    }
+    page { hasNextPage endCursor }
+  }
+}
+'''
+
+
+class OrderFeedTests(GraphQLTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = User.objects.create_user(email='c@example.com', password='x')
+
+    def create_orders(self, count):
+        start = Order.objects.count()
+        for i in range(start, start + count):
+            owner = User.objects.create_user(email=f'o{i}@example.com', password='x')
+            shop = Shop.objects.create(owner=owner, name=f's{i}', address='a', latitude=-6.1, longitude=35.7)
+            order = Order.objects.create(customer=self.customer, shop=shop, total_price=Decimal('1000'))
+            Payment.objects.create(order=order, payment_method='MPESA', amount=Decimal('1000'))
+            for j in range(2):
+                document = Document.objects.create(
+                    owner=self.customer, file=f'secure_uploads/{i}-{j}.pdf', file_name=f'{i}-{j}.pdf', file_size=1,
+                )
+                OrderItem.objects.create(order=order, document=document, config_snapshot={}, price=Decimal('500'), page_count=5)
+
+    def feed(self, **filter_input):
+        return self.graphql(FEED_QUERY, user=self.customer, filter=filter_input)['myOrderFeed']
+
+    def count_queries(self, **filter_input):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.feed(**filter_input)
+        self.assertTrue(result['data'])
+        for order in result['data']:
+            self.assertEqual(len(order['items']), 2)
+            self.assertIsNotNone(order['shop']['owner'])
+            self.assertIsNotNone(order['payment'])
+        return len(queries)
+
+    def test_query_count_independent_of_page_size(self):
+        self.create_orders(8)
+
+        self.assertEqual(self.count_queries(first=2), self.count_queries(first=8))
+
+    def test_selection_planned_into_joins(self):
+        self.create_orders(3)
+
+        # Orders joined with shop, shop owner, customer and payment; then
+        # items joined with their documents
+        self.assertEqual(self.count_queries(), 2)
+
+    @mock.patch('stationary_orders.schema.optimize_queryset', lambda qs, info: qs)
+    def test_relations_batched_without_planning(self):
+        self.create_orders(8)
+
+        # Rows loaded without joins fall back on the request's loaders: one
+        # query each for the orders, shops, shop owners, customers,
+        # payments, items and documents, whatever the number of rows
+        self.assertEqual(self.count_queries(first=1), 7)
+        self.assertEqual(self.count_queries(first=8), 7)
+
+    def test_pages_cover_orders_tied_on_created_at_once(self):
+        self.create_orders(5)
+        Order.objects.update(created_at=timezone.now())
+
+        ids, after = [], None
+        while True:
+            result = self.feed(first=2, after=after)
+            ids += [order['id'] for order in result['data']]
+            if not result['page']['hasNextPage']:
+                break
+            after = result['page']['endCursor']
+
+        expected = sorted((str(pk) for pk in Order.objects.values_list('id', flat=True)), reverse=True)
+        self.assertEqual(ids, expected)
+
+    def test_malformed_cursor_rejected(self):
+        self.create_orders(1)
+
+        result = self.feed(after='not-a-cursor')
+
+        self.assertFalse(result['response']['success'])
+        self.assertEqual(result['data'], [])
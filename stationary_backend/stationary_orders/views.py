@@ -1,6 +1,6 @@
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
@@ -13,28 +13,12 @@ from django.http import JsonResponse
 
 
 from .models import Payment, Order
-from .clickpesa_service import ClickPesaService
+from .clickpesa_service import ClickPesaService, pool_stats
 
 logger = logging.getLogger(__name__)
 
 
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def clickpesa_webhook(request):
-    try:
-        webhook_data = json.loads(request.body)
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON'}, status=400)
-
-    clickpesa_service = ClickPesaService()
-    result = clickpesa_service.process_webhook(webhook_data)
-
-    if result['success']:
-        return JsonResponse({'success': True}, status=200)
-    else:
-        return JsonResponse({'error': result['error']}, status=400)
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def check_payment_status(request, payment_id):
@@ -53,29 +37,20 @@ def check_payment_status(request, payment_id):
                 'error': 'Payment not found or access denied'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Check status with ClickPesa
-        clickpesa_service = ClickPesaService()
-        result = clickpesa_service.check_payment_status(payment)
-        
-        if result['success']:
-            return Response({
-                'success': True,
-                'payment_status': payment.status,
-                'payment_method': payment.payment_method,
-                'amount': float(payment.amount),
-                'transaction_id': payment.transaction_id,
-                'reference_number': payment.reference_number,
-                'failure_reason': payment.failure_reason,
-                'created_at': payment.created_at,
-                'updated_at': payment.updated_at
-            }, status=status.HTTP_200_OK)
-        else:
-            return Response({
-                'success': False,
-                'error': result['error'],
-                'payment_status': payment.status
-            }, status=status.HTTP_400_BAD_REQUEST)
-            
+        # Status as last recorded from a webhook or reconcile_payments;
+        # client requests never reach ClickPesa
+        return Response({
+            'success': True,
+            'payment_status': payment.status,
+            'payment_method': payment.payment_method,
+            'amount': float(payment.amount),
+            'transaction_id': payment.transaction_id,
+            'reference_number': payment.reference_number,
+            'failure_reason': payment.failure_reason,
+            'created_at': payment.created_at,
+            'updated_at': payment.updated_at
+        }, status=status.HTTP_200_OK)
+
     except Exception as e:
         logger.error(f"Payment status check error: {str(e)}")
         return Response({
@@ -111,43 +86,44 @@ def get_payment_methods(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def clickpesa_pool_stats(request):
+    """
+    Keep-alive pool counters of the ClickPesa client in the worker process
+    that serves this request
+    """
+    return Response(pool_stats(), status=status.HTTP_200_OK)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def clickpesa_webhook(request):
     """
-    Webhook endpoint for ClickPesa payment notifications
+    Webhook endpoint for ClickPesa payment notifications.
+
+    Verifies the checksum and records the event in the webhook inbox, then
+    answers at once; ``apply_webhook_events`` updates the payment in the
+    background. Redeliveries are acknowledged and ignored.
     """
     try:
-        # Parse webhook data
-        try:
-            webhook_data = json.loads(request.body)
-        except json.JSONDecodeError:
-            logger.error("Invalid JSON in webhook payload")
-            return Response({
-                'error': 'Invalid JSON'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Process webhook
-        clickpesa_service = ClickPesaService()
-        result = clickpesa_service.process_webhook(webhook_data)
-        
-        if result['success']:
-            logger.info(f"Webhook processed successfully for payment {result['payment_id']}")
-            return Response({
-                'success': True,
-                'message': 'Webhook processed successfully'
-            }, status=status.HTTP_200_OK)
-        else:
-            logger.error(f"Webhook processing failed: {result['error']}")
-            return Response({
-                'error': result['error']
-            }, status=status.HTTP_400_BAD_REQUEST)
-            
-    except Exception as e:
-        logger.error(f"Webhook processing error: {str(e)}")
-        return Response({
-            'error': 'Internal server error'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        webhook_data = json.loads(request.body)
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in webhook payload")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    if not isinstance(webhook_data, dict) or not webhook_data.get('id'):
+        return JsonResponse({'error': 'No transaction id in webhook payload'}, status=400)
+
+    clickpesa_service = ClickPesaService()
+    if not clickpesa_service.secret_key:
+        logger.error("CLICKPESA_SECRET_KEY is not set; webhooks cannot be verified and are rejected")
+    if not clickpesa_service.verify_webhook_checksum(webhook_data):
+        logger.warning(f"Rejected webhook with invalid checksum for transaction {webhook_data.get('id')}")
+        return JsonResponse({'error': 'Invalid checksum'}, status=401)
+
+    clickpesa_service.record_webhook(webhook_data)
+    return JsonResponse({'success': True}, status=200)
 
 
 def get_payment_method_description(method_code):
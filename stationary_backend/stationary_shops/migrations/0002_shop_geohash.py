@@ -0,0 +1,35 @@
+# Generated by Django 4.2.28 on 2026-10-18 01:26
+
+from django.db import migrations, models
+
+from stationary_geo import geohash
+
+
+def populate_geohash(apps, schema_editor):
+    Shop = apps.get_model("stationary_shops", "Shop")
+    shops = list(Shop.objects.only("id", "latitude", "longitude"))
+    for shop in shops:
+        shop.geohash = geohash.encode(shop.latitude, shop.longitude)
+    Shop.objects.bulk_update(shops, ["geohash"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stationary_shops", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="shop",
+            name="geohash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="Spatial index cell, derived from the coordinates",
+                max_length=12,
+            ),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
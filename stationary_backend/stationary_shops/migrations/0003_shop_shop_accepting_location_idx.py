@@ -0,0 +1,17 @@
+# Generated by Django 4.2.28 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_shops', '0002_shop_geohash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['is_accepting_orders', 'latitude', 'longitude'], name='shop_accepting_location_idx'),
+        ),
+    ]
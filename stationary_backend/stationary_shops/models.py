@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from stationary_core.models import BaseModel
+from stationary_geo import geohash
 
 class Shop(BaseModel):
     class Subscription(models.TextChoices):
@@ -17,6 +18,7 @@ class Shop(BaseModel):
     # Geo-location
     latitude = models.FloatField(help_text="Latitude coordinate")
     longitude = models.FloatField(help_text="Longitude coordinate")
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False, help_text="Spatial index cell, derived from the coordinates")
     
     is_verified = models.BooleanField(default=False)
     is_accepting_orders = models.BooleanField(default=True)
@@ -33,9 +35,22 @@ class Shop(BaseModel):
     operating_hours = models.JSONField(default=dict, blank=True, help_text="Structured operating hours")
     commission_rate = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, help_text="Override system commission rate")
 
+    class Meta:
+        indexes = [
+            # Shop discovery filters accepting shops by a coordinate box
+            models.Index(fields=['is_accepting_orders', 'latitude', 'longitude'], name='shop_accepting_location_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.geohash = geohash.encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
 class ServiceType(models.TextChoices):
     PRINTING_BW = "PRINTING_BW", "Black & White Printing"
     PRINTING_COLOR = "PRINTING_COLOR", "Color Printing"
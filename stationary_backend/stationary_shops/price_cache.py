@@ -0,0 +1,150 @@
+"""
+Versioned price-sheet cache.
+
+Every shop has a version counter in the shared cache (Redis in production),
+plus one global counter for the shop-less PageRangeDiscount tiers. A compiled
+``PriceSheet`` is stored under a key that embeds both versions, so bumping a
+counter makes every worker miss on its next read and recompile from the
+database; nothing ever has to be deleted or pushed to other processes.
+
+Lookups go through a process-local LRU first. A hit there still costs the one
+``get_many`` needed to read the current versions, which is what guarantees a
+worker never serves a sheet older than the latest committed pricing change.
+"""
+import time
+from functools import partial
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from stationary_core.cache import LocalLRUCache
+from stationary_shops.pricing import PriceSheet
+
+SHOP_VERSION_KEY = "pricing:version:shop:{}"
+GLOBAL_VERSION_KEY = "pricing:version:global"
+SHEET_KEY = "pricing:sheet:{}:{}:{}"
+
+_local_sheets = LocalLRUCache(maxsize=getattr(settings, "PRICE_SHEET_LRU_SIZE", 512))
+
+
+def _initial_version():
+    # Seeded from the clock rather than 0 so that a counter evicted from the
+    # shared cache never comes back with a value an old sheet was keyed by.
+    return time.time_ns()
+
+
+def _get_versions(keys):
+    """Read version counters, seeding any that do not exist yet."""
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        seeds = {key: _initial_version() for key in missing}
+        for key, seed in seeds.items():
+            cache.add(key, seed, timeout=None)
+        versions.update(cache.get_many(missing))
+        # A counter evicted again straight away is simply used unsaved; the
+        # sheet cached under it can never be matched later, only missed.
+        for key, seed in seeds.items():
+            versions.setdefault(key, seed)
+    return versions
+
+
+def _current_versions(shop_id):
+    shop_key = SHOP_VERSION_KEY.format(shop_id)
+    versions = _get_versions([shop_key, GLOBAL_VERSION_KEY])
+    return versions[shop_key], versions[GLOBAL_VERSION_KEY]
+
+
+def _sheet_timeout():
+    return getattr(settings, "PRICE_SHEET_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+def get_price_sheet(shop):
+    """Return the current compiled ``PriceSheet`` for *shop*."""
+    shop_version, global_version = _current_versions(shop.id)
+    key = SHEET_KEY.format(shop.id, shop_version, global_version)
+
+    sheet = _local_sheets.get(key)
+    if sheet is not None:
+        return sheet
+
+    sheet = cache.get(key)
+    if sheet is None:
+        sheet = PriceSheet.compile(shop)
+        cache.set(key, sheet, timeout=_sheet_timeout())
+
+    _local_sheets.set(key, sheet)
+    return sheet
+
+
+def get_price_sheets(shops):
+    """
+    Return ``{shop_id: PriceSheet}`` for many shops with a fixed number of
+    round trips: one ``get_many`` for the versions, one for the sheets, and
+    a single bulk compile for whatever is missing from both caches.
+    """
+    shops = list(shops)
+    if not shops:
+        return {}
+
+    version_keys = [SHOP_VERSION_KEY.format(shop.id) for shop in shops]
+    versions = _get_versions(version_keys + [GLOBAL_VERSION_KEY])
+
+    global_version = versions[GLOBAL_VERSION_KEY]
+    keys = {
+        shop.id: SHEET_KEY.format(shop.id, versions[version_key], global_version)
+        for shop, version_key in zip(shops, version_keys)
+    }
+
+    sheets = {}
+    for shop_id, key in keys.items():
+        sheet = _local_sheets.get(key)
+        if sheet is not None:
+            sheets[shop_id] = sheet
+
+    remote_keys = [keys[shop.id] for shop in shops if shop.id not in sheets]
+    if remote_keys:
+        found = cache.get_many(remote_keys)
+        for shop in shops:
+            sheet = found.get(keys[shop.id])
+            if sheet is not None:
+                sheets[shop.id] = sheet
+                _local_sheets.set(keys[shop.id], sheet)
+
+    to_compile = [shop for shop in shops if shop.id not in sheets]
+    if to_compile:
+        compiled = PriceSheet.compile_many(to_compile)
+        cache.set_many({keys[shop_id]: sheet for shop_id, sheet in compiled.items()}, timeout=_sheet_timeout())
+        for shop_id, sheet in compiled.items():
+            _local_sheets.set(keys[shop_id], sheet)
+        sheets.update(compiled)
+
+    return sheets
+
+
+# ------------------------------
+# Invalidation
+# ------------------------------
+
+def _bump(key):
+    """Atomically advance a version counter (``INCR`` on Redis)."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Counter missing or evicted: any fresh clock-based seed is newer
+        # than whatever version readers last saw.
+        if not cache.add(key, _initial_version(), timeout=None):
+            cache.incr(key)
+
+
+def bump_shop_version(shop_id):
+    """
+    Invalidate the price sheet of one shop once the current transaction
+    commits. Bumping earlier would let a concurrent reader recompile the
+    sheet from pre-commit rows and cache it under the new version.
+    """
+    transaction.on_commit(partial(_bump, SHOP_VERSION_KEY.format(shop_id)))
+
+
+def bump_global_version():
+    """Invalidate every shop's price sheet (global discount tiers changed)."""
+    transaction.on_commit(partial(_bump, GLOBAL_VERSION_KEY))
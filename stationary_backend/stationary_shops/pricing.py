@@ -0,0 +1,324 @@
+from bisect import bisect_right
+from decimal import Decimal
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from stationary_accounts.models import User
+from stationary_shops.models import ShopPricing, PageRangeDiscount, ServiceType
+from stationary_storage.access import has_document_access
+from stationary_storage.models import Document
+
+# ------------------------------
+# Defaults
+# ------------------------------
+
+DEFAULT_PAGE_RATE = Decimal("100.00")  # Standard rate of TSh 100 per page for all printing
+DEFAULT_EXTRA_RATE = Decimal("1000.00")  # Binding / lamination when the shop has no rule
+DEFAULT_COMMISSION_PERCENT = Decimal("5.00")
+
+SUBSCRIPTION_DISCOUNTS = {
+    User.Subscription.STUDENT: Decimal("0.10"),
+    User.Subscription.BUSINESS: Decimal("0.20"),
+}
+
+
+# ------------------------------
+# Price sheet
+# ------------------------------
+
+def _sort_tiers(tiers):
+    """
+    Return ``(min_pages_keys, tiers)`` sorted by ``min_pages``.
+
+    The sort is stable, so tiers sharing a ``min_pages`` keep the database
+    order, matching ``PageRangeDiscount.Meta.ordering``.
+    """
+    ordered = tuple(sorted(
+        ((t.min_pages, t.max_pages, t.discount_percent) for t in tiers),
+        key=lambda t: t[0],
+    ))
+    return tuple(t[0] for t in ordered), ordered
+
+
+class PriceSheet:
+    """
+    The compiled, read-only pricing rules of one shop.
+
+    Holds plain tuples and dicts only, so it pickles cheaply into the shared
+    cache and can be handed to any number of engines at once.
+    """
+
+    __slots__ = ('shop_id', 'commission_rate', 'rules', 'shop_tiers', 'global_tiers')
+
+    def __init__(self, shop_id, commission_rate, rules, shop_tiers, global_tiers):
+        self.shop_id = shop_id
+        self.commission_rate = commission_rate
+        # service_type -> (base_price, modifiers)
+        self.rules = rules
+        self.shop_tiers = shop_tiers
+        self.global_tiers = global_tiers
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def compile(cls, shop):
+        """Load every pricing rule that applies to *shop* (two queries)."""
+        return cls.compile_many([shop])[shop.id]
+
+    @classmethod
+    def compile_many(cls, shops):
+        """
+        Compile sheets for many shops at once: one query for all their
+        ShopPricing rows and one for their tiers plus the global ones.
+        Returns a dict keyed by shop id.
+        """
+        shops = list(shops)
+        shop_ids = [shop.id for shop in shops]
+
+        # Always compiled from the primary: a sheet read off a lagging
+        # replica would be cached under the new version and outlive it
+        rules = {shop_id: {} for shop_id in shop_ids}
+        for rule in ShopPricing.objects.using(DEFAULT_DB_ALIAS).filter(shop_id__in=shop_ids):
+            rules[rule.shop_id][rule.service_type] = (rule.base_price, dict(rule.modifiers or {}))
+
+        shop_tiers = {shop_id: [] for shop_id in shop_ids}
+        global_tiers = []
+        for tier in PageRangeDiscount.objects.using(DEFAULT_DB_ALIAS).filter(Q(shop_id__in=shop_ids) | Q(shop__isnull=True)):
+            if tier.shop_id is None:
+                global_tiers.append(tier)
+            else:
+                shop_tiers[tier.shop_id].append(tier)
+        global_tiers = _sort_tiers(global_tiers)
+
+        return {
+            shop.id: cls(
+                shop_id=shop.id,
+                commission_rate=shop.commission_rate,
+                rules=rules[shop.id],
+                shop_tiers=_sort_tiers(shop_tiers[shop.id]),
+                global_tiers=global_tiers,
+            )
+            for shop in shops
+        }
+
+
+# ------------------------------
+# Items
+# ------------------------------
+
+# What ``PricedItem`` reads off a Document
+DOCUMENT_PRICING_FIELDS = ('id', 'owner', 'metadata_status', 'page_count', 'color_pages')
+
+
+class PricedItem:
+    """
+    An order item with the page count and colour it is priced by.
+
+    Once the document's metadata has been extracted, its page count
+    replaces the one sent by the client, and colour printing of a
+    document without colour pages is priced as black and white. Until
+    then, or for formats that cannot be analysed, the client's values
+    stand.
+    """
+
+    __slots__ = ('document_id', 'page_count', 'is_color', 'paper_size', 'is_binding', 'is_lamination')
+
+    def __init__(self, item_input, document=None):
+        self.document_id = item_input.document_id
+        self.page_count = item_input.page_count
+        self.is_color = item_input.is_color
+        self.paper_size = item_input.paper_size
+        self.is_binding = item_input.is_binding
+        self.is_lamination = item_input.is_lamination
+
+        if document is not None and document.metadata_status == Document.MetadataStatus.READY:
+            if document.page_count:
+                self.page_count = document.page_count
+            if document.color_pages is not None and not document.color_pages:
+                self.is_color = False
+
+    @classmethod
+    def for_items(cls, items, user):
+        """
+        Wrap *items*, loading their documents' metadata in one query.
+        Only uploaded documents *user* may open are used; the other items
+        keep the client's values.
+        """
+        documents = (
+            Document.objects.filter(is_uploaded=True)
+            .only(*DOCUMENT_PRICING_FIELDS)
+            .in_bulk([item.document_id for item in items])
+        )
+        priced = []
+        for item in items:
+            document = documents.get(item.document_id)
+            if document is not None and not has_document_access(user, document):
+                document = None
+            priced.append(cls(item, document))
+        return priced
+
+
+class CartProfile:
+    """
+    A cart reduced to what pricing depends on, so it can be priced against
+    many shops without walking every item per shop.
+
+    Items are grouped by (service type, paper size, page count): the per-page
+    cost of a group only depends on the shop's base rate, size modifier and
+    the tier for that page count, so each shop evaluates one term per
+    distinct group rather than one per item.
+    """
+
+    def __init__(self, items):
+        groups = {}
+        self.binding_count = 0
+        self.lamination_count = 0
+        for item in items:
+            service_type = ServiceType.PRINTING_COLOR if item.is_color else ServiceType.PRINTING_BW
+            key = (service_type, item.paper_size, item.page_count)
+            groups[key] = groups.get(key, 0) + 1
+            if item.is_binding:
+                self.binding_count += 1
+            if item.is_lamination:
+                self.lamination_count += 1
+        # (service_type, paper_size, pages, item_count)
+        self.groups = tuple(key + (count,) for key, count in groups.items())
+        self.page_counts = frozenset(key[2] for key in groups)
+
+
+# ------------------------------
+# Engine
+# ------------------------------
+
+class PricingEngine:
+    """
+    Prices order items for a single shop entirely in memory.
+
+    The engine works off a ``PriceSheet``; ``for_shop`` fetches it through
+    the versioned price-sheet cache, so pricing a cart costs at most the two
+    queries needed to compile the sheet and usually none at all.
+    """
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    @classmethod
+    def for_shop(cls, shop):
+        from stationary_shops.price_cache import get_price_sheet
+
+        return cls(get_price_sheet(shop))
+
+    # ------------------------------------------------------------------
+    # Tier lookup
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _match_tier(sorted_tiers, pages):
+        """
+        Return the discount percent of the lowest tier covering *pages*.
+
+        Tiers whose ``min_pages`` exceed *pages* are cut off with a binary
+        search; the remaining candidates are scanned in ``min_pages`` order,
+        which is what ``.filter(...).first()`` used to return.
+        """
+        keys, tiers = sorted_tiers
+        end = bisect_right(keys, pages)
+        for _min_pages, max_pages, discount_percent in tiers[:end]:
+            if max_pages is None or max_pages >= pages:
+                return discount_percent
+        return None
+
+    def discount_percent_for(self, pages):
+        """Shop tiers take precedence; global tiers are the fallback."""
+        percent = self._match_tier(self.sheet.shop_tiers, pages)
+        if percent is None:
+            percent = self._match_tier(self.sheet.global_tiers, pages)
+        return percent
+
+    # ------------------------------------------------------------------
+    # Pricing
+    # ------------------------------------------------------------------
+
+    def _extra_price(self, service_type):
+        rule = self.sheet.rules.get(service_type)
+        return rule[0] if rule else DEFAULT_EXTRA_RATE
+
+    def price_item(self, item_input, user=None):
+        """
+        Calculates price for a single item.
+        """
+        pages = item_input.page_count
+        size = item_input.paper_size
+
+        # 1. Base Price
+        service_type = ServiceType.PRINTING_COLOR if item_input.is_color else ServiceType.PRINTING_BW
+        base_rate, modifiers = self.sheet.rules.get(service_type, (DEFAULT_PAGE_RATE, {}))
+
+        size_mod = Decimal(str(modifiers.get(size, "1.0")))
+        raw_cost = (Decimal(pages) * base_rate) * size_mod
+
+        # 2. Tier Discount
+        discount_percent = self.discount_percent_for(pages)
+        if discount_percent is not None:
+            raw_cost -= raw_cost * (discount_percent / Decimal("100.0"))
+
+        # 3. Extras
+        extras_cost = Decimal("0.00")
+        if item_input.is_binding:
+            extras_cost += self._extra_price(ServiceType.BINDING)
+        if item_input.is_lamination:
+            extras_cost += self._extra_price(ServiceType.LAMINATION)
+
+        # 4. Customer Subscription Discount
+        if user:
+            sub_discount = SUBSCRIPTION_DISCOUNTS.get(user.subscription_tier, Decimal("0.00"))
+            return (raw_cost + extras_cost) * (Decimal("1.0") - sub_discount)
+
+        return raw_cost + extras_cost
+
+    def price_cart(self, profile, user=None):
+        """
+        Total price of a ``CartProfile`` at this shop; equal to summing
+        ``price_item`` over the original items.
+        """
+        rules = self.sheet.rules
+        discounts = {pages: self.discount_percent_for(pages) for pages in profile.page_counts}
+
+        page_rates = {}
+        total = Decimal("0.00")
+        for service_type, size, pages, count in profile.groups:
+            page_rate = page_rates.get((service_type, size))
+            if page_rate is None:
+                base_rate, modifiers = rules.get(service_type, (DEFAULT_PAGE_RATE, {}))
+                page_rate = base_rate * Decimal(str(modifiers.get(size, "1.0")))
+                page_rates[(service_type, size)] = page_rate
+            cost = Decimal(pages) * page_rate
+            discount_percent = discounts[pages]
+            if discount_percent is not None:
+                cost -= cost * (discount_percent / Decimal("100.0"))
+            total += cost * count
+
+        if profile.binding_count:
+            total += self._extra_price(ServiceType.BINDING) * profile.binding_count
+        if profile.lamination_count:
+            total += self._extra_price(ServiceType.LAMINATION) * profile.lamination_count
+
+        if user:
+            sub_discount = SUBSCRIPTION_DISCOUNTS.get(user.subscription_tier, Decimal("0.00"))
+            return total * (Decimal("1.0") - sub_discount)
+
+        return total
+
+    def commission_for(self, total_price):
+        """
+        Platform commission on *total_price*, honouring the shop's
+        ``commission_rate`` override (a percentage) when one is set.
+        """
+        rate = self.sheet.commission_rate
+        if rate is None:
+            rate = DEFAULT_COMMISSION_PERCENT
+        return total_price * (rate / Decimal("100.0"))
@@ -12,20 +12,17 @@ from tarxemo_django_graphene_utils import (
     get_paginated_and_non_paginated_data,
     UserFilterInput # Reusing or defining new? use new.
 )
-import math
-
-# ------------------------------
-# Utility: Haversine
-# ------------------------------
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in km
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat / 2) * math.sin(dlat / 2) + \
-        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * \
-        math.sin(dlon / 2) * math.sin(dlon / 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+from stationary_shops.spatial import clamp_radius, nearest_shops, shops_by_distance
+from stationary_core.optimization import optimize_queryset, optimize_rows
+from stationary_core.dataloaders import load_related
+from stationary_core.pagination import (
+    MAX_ITEMS_PER_PAGE,
+    CursorPageObject,
+    keyset_paginate,
+    keyset_paginate_list,
+    offset_paginate,
+    estimate_count,
+)
 
 # ------------------------------
 # Types
@@ -63,8 +60,11 @@ class ShopType(DjangoObjectType):
             return self.distance
         return None
 
+    def resolve_owner(self, info):
+        return load_related(self, info, 'owner')
+
     def resolve_pricing_rules(self, info):
-        return self.pricing_rules.all()
+        return load_related(self, info, 'pricing_rules')
 
 class ShopFilterInput(graphene.InputObjectType):
     page_number = graphene.Int()
@@ -76,9 +76,16 @@ class ShopFilterInput(graphene.InputObjectType):
     latitude = graphene.Float()
     longitude = graphene.Float()
     radius_km = graphene.Float()
+    nearest = graphene.Int(description="Return the k nearest shops (used when radius_km is not given)")
+    # Keyset (cursor) paging; used instead of page_number when either is set
+    first = graphene.Int()
+    after = graphene.String()
+    order_by = graphene.String(description="'distance' (geo searches only) or 'created_at'")
+    approximate_count = graphene.Boolean(description="Estimate total_elements instead of counting exactly")
 
 class ShopResponseDTO(BaseResponseDTO):
     data = graphene.List(ShopType)
+    page = graphene.Field(CursorPageObject)
 
 class SingleShopResponseDTO(BaseResponseDTO):
     data = graphene.Field(ShopType)
@@ -179,21 +186,11 @@ class Query(graphene.ObjectType):
         lon = getattr(filter_input, 'longitude', None)
         radius = getattr(filter_input, 'radius_km', None)
         search_term = getattr(filter_input, 'search_term', None)
-        
-        # Apply geographic filtering if coordinates provided
-        if lat is not None and lon is not None and radius is not None:
-            lat_delta = radius / 111.0
-            try:
-                cos_val = math.cos(math.radians(lat))
-                if abs(cos_val) < 0.0001: cos_val = 0.0001
-                lon_delta = radius / (111.0 * cos_val)
-                
-                qs = qs.filter(
-                    latitude__range=(lat - lat_delta, lat + lat_delta),
-                    longitude__range=(lon - lon_delta, lon + lon_delta)
-                )
-            except:
-                pass
+        nearest = getattr(filter_input, 'nearest', None)
+        first = getattr(filter_input, 'first', None)
+        after = getattr(filter_input, 'after', None)
+        order_by = getattr(filter_input, 'order_by', None)
+        approximate_count = getattr(filter_input, 'approximate_count', None)
         
         # Apply search term filtering
         if search_term:
@@ -201,12 +198,69 @@ class Query(graphene.ObjectType):
                 Q(name__icontains=search_term) | 
                 Q(address__icontains=search_term)
             )
-        
-        # Return in the expected format
+
+        # Geographic search goes through the geohash index and returns
+        # shops nearest first with their distance set: a radius search as
+        # a queryset ordered by distance in SQL, the k nearest as a list
+        data = qs
+        if lat is not None and lon is not None:
+            if radius is not None:
+                data = shops_by_distance(qs, lat, lon, clamp_radius(radius))
+            elif nearest:
+                data = nearest_shops(qs, lat, lon, min(nearest, MAX_ITEMS_PER_PAGE))
+
+        by_distance = data is not qs and order_by != 'created_at'
+        ordering = ('distance', 'id') if by_distance else ('-created_at', '-id')
+        if isinstance(data, list):
+            if not by_distance:
+                data.sort(key=lambda shop: (shop.created_at, str(shop.id)), reverse=True)
+        else:
+            data = optimize_queryset(data.order_by(*ordering), info)
+
+        try:
+            if first is not None or after:
+                # Keyset mode for infinite scroll: no OFFSET and no COUNT
+                # unless an estimate is explicitly requested
+                if not isinstance(data, list):
+                    rows, has_next_page, end_cursor = keyset_paginate(
+                        data, ordering, first=first, after=after
+                    )
+                elif by_distance:
+                    rows, has_next_page, end_cursor = keyset_paginate_list(
+                        data, key=lambda shop: (shop.distance, str(shop.id)), first=first, after=after
+                    )
+                else:
+                    rows, has_next_page, end_cursor = keyset_paginate_list(
+                        data, key=lambda shop: (shop.created_at.isoformat(), str(shop.id)),
+                        first=first, after=after, descending=True
+                    )
+
+                total = None
+                if approximate_count:
+                    total = len(data) if isinstance(data, list) else estimate_count(data)
+                page = CursorPageObject(
+                    has_next_page=has_next_page,
+                    end_cursor=end_cursor,
+                    total_elements=total,
+                    is_count_approximate=bool(approximate_count) and not isinstance(data, list),
+                )
+            else:
+                rows, page = offset_paginate(
+                    data,
+                    page_number=getattr(filter_input, 'page_number', None),
+                    items_per_page=getattr(filter_input, 'items_per_page', None),
+                    approximate_count=approximate_count,
+                )
+        except ValueError as e:
+            return {"response": build_error(str(e)), "data": [], "page": None}
+
+        if isinstance(data, list):
+            rows = optimize_rows(rows, info)
+
         return {
             "response": build_success_response(),
-            "data": qs,
-            "page": PageObject(has_next_page=False, total_elements=qs.count())
+            "data": rows,
+            "page": page
         }
 
     
@@ -217,12 +271,12 @@ class Query(graphene.ObjectType):
         
         return {
             "response": build_success_response(),
-            "data": Shop.objects.filter(owner=user)
+            "data": optimize_queryset(Shop.objects.filter(owner=user), info)
         }
 
     def resolve_shop_details(self, info, id):
         try:
-            shop = Shop.objects.get(id=id)
+            shop = optimize_queryset(Shop.objects.all(), info).get(id=id)
             return {"response": build_success_response(), "data": shop}
         except Shop.DoesNotExist:
             return {"response": build_error("Shop not found"), "data": None}
@@ -235,7 +289,7 @@ class Query(graphene.ObjectType):
         qs = Shop.objects.filter(is_verified=False)
         return {
             "response": build_success_response(),
-            "data": qs,
+            "data": optimize_queryset(qs, info),
             "page": PageObject(has_next_page=False, total_elements=qs.count())
         }
 
@@ -0,0 +1,47 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from stationary_shops.models import Shop, ShopPricing, PageRangeDiscount
+from stationary_shops.price_cache import bump_shop_version, bump_global_version
+
+# Every write path - UpdatePricingMutation, the ShopAdmin inlines, the
+# standalone admins and the seed commands - saves or deletes model
+# instances, so hooking the model signals covers them all.
+
+
+def _bump_for(shop_id):
+    if shop_id is None:
+        bump_global_version()
+    else:
+        bump_shop_version(shop_id)
+
+
+@receiver(pre_save, sender=ShopPricing)
+@receiver(pre_save, sender=PageRangeDiscount)
+def remember_previous_shop(sender, instance, **kwargs):
+    # A rule moved to another shop (or to/from global) must also
+    # invalidate the sheet it was taken out of.
+    instance._previous_shop_id = (
+        sender.objects.filter(pk=instance.pk).values_list('shop_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=ShopPricing)
+@receiver(post_save, sender=PageRangeDiscount)
+def invalidate_saved_rule(sender, instance, created, **kwargs):
+    _bump_for(instance.shop_id)
+    previous_shop_id = getattr(instance, '_previous_shop_id', None)
+    if not created and previous_shop_id != instance.shop_id:
+        _bump_for(previous_shop_id)
+
+
+@receiver(post_delete, sender=ShopPricing)
+@receiver(post_delete, sender=PageRangeDiscount)
+def invalidate_deleted_rule(sender, instance, **kwargs):
+    _bump_for(instance.shop_id)
+
+
+@receiver(post_save, sender=Shop)
+def invalidate_shop(sender, instance, created, **kwargs):
+    # The sheet carries the shop's commission_rate override.
+    if not created:
+        bump_shop_version(instance.id)
@@ -0,0 +1,93 @@
+from functools import reduce
+import math
+import operator
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+from stationary_geo.geohash import covering_cells, bounding_box
+from stationary_geo.utils import EARTH_RADIUS_KM
+
+# Largest radius a client may search
+MAX_RADIUS_KM = 500.0
+
+# Geohash characters sort between '0' and 'z', so '~' bounds every hash that
+# starts with a given prefix. Range lookups use the plain B-tree index on
+# every backend, unlike LIKE 'prefix%'.
+_PREFIX_END = "~"
+
+
+def _within_cells(qs, cells):
+    return qs.filter(reduce(operator.or_, (
+        Q(geohash__gte=cell, geohash__lt=cell + _PREFIX_END) for cell in cells
+    )))
+
+
+def clamp_radius(radius_km):
+    """Clamp a client-supplied radius to ``0..MAX_RADIUS_KM``."""
+    return max(0.0, min(float(radius_km), MAX_RADIUS_KM))
+
+
+def distance_km(lat, lon):
+    """
+    Haversine distance in km from (lat, lon) to a shop's coordinates, as a
+    database expression (the same formula as ``stationary_geo.utils.haversine``).
+    """
+    half_dlat = (Radians('latitude') - Value(math.radians(lat))) / 2
+    half_dlon = (Radians('longitude') - Value(math.radians(lon))) / 2
+    a = (
+        Power(Sin(half_dlat), 2)
+        + Value(math.cos(math.radians(lat))) * Cos(Radians('latitude')) * Power(Sin(half_dlon), 2)
+    )
+    # Rounding can push sqrt(a) just past 1 for antipodal points
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)), output_field=FloatField())
+
+
+def shops_by_distance(qs, lat, lon, radius_km):
+    """
+    *qs* narrowed to the shops within *radius_km* of (lat, lon), with
+    ``distance`` (km) annotated and ordered nearest first.
+
+    Candidates come from index range scans over the few geohash cells
+    covering the circle, whose size tracks the radius, and its bounding
+    box; the exact distance bound and the ordering are applied by the
+    database too, so a slice of the result only reads that many rows into
+    Python. Order by ``('distance', 'id')`` for keyset paging.
+    """
+    cells = covering_cells(lat, lon, radius_km)
+    if cells is not None:
+        qs = _within_cells(qs, cells)
+        # Drop the corners of the cells before distances are computed
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        qs = qs.filter(latitude__range=(min_lat, max_lat))
+        if -180.0 <= min_lon and max_lon <= 180.0:
+            qs = qs.filter(longitude__range=(min_lon, max_lon))
+
+    return (
+        qs.annotate(distance=distance_km(lat, lon))
+        .filter(distance__lte=radius_km)
+        .order_by('distance', 'id')
+    )
+
+
+def shops_within_radius(qs, lat, lon, radius_km):
+    """
+    Shops from *qs* within *radius_km* of (lat, lon), nearest first, as a
+    list with ``distance`` (km) set on every shop.
+    """
+    return list(shops_by_distance(qs, lat, lon, radius_km))
+
+
+def nearest_shops(qs, lat, lon, k, max_radius_km=MAX_RADIUS_KM, initial_radius_km=1.0):
+    """
+    The *k* shops from *qs* nearest to (lat, lon), searched up to
+    *max_radius_km*.
+
+    The search radius grows until it holds at least *k* shops. Every shop
+    outside a radius is farther away than every shop inside it, so the first
+    *k* results of that radius are the exact k nearest.
+    """
+    radius = initial_radius_km
+    while True:
+        shops = shops_within_radius(qs, lat, lon, min(radius, max_radius_km))
+        if len(shops) >= k or radius >= max_radius_km:
+            return shops[:k]
+        radius *= 4
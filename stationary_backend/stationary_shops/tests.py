@@ -1,3 +1,228 @@
+from decimal import Decimal
+from itertools import product
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.db import models
 from django.test import TestCase
 
-# Create your tests here.
+from stationary_accounts.models import User
+from stationary_core.testing import GraphQLTestMixin
+from stationary_shops import price_cache
+from stationary_shops.models import PageRangeDiscount, ServiceType, Shop, ShopPricing
+from stationary_shops.pricing import CartProfile, PricingEngine
+
+ORIGIN = (-6.8, 39.28)
+
+SHOPS_QUERY = '''
+query ($filter: ShopFilterInput) {
+  shops(filterInput: $filter) {
+    response { success message }
+    data { name distance }
+    page { hasNextPage endCursor }
+  }
+}
+'''
+
+
+class ShopsQueryTests(GraphQLTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user(email='o@example.com', password='x')
+        # Shops 0, 1, 1, 2, 3 and 40 km east of the origin (about 0.009° per km)
+        for name, km in (('a', 0), ('b', 1), ('c', 1), ('d', 2), ('e', 3), ('far', 40)):
+            Shop.objects.create(
+                owner=owner, name=name, address='x',
+                latitude=ORIGIN[0], longitude=ORIGIN[1] + km * 0.00906,
+            )
+
+    def page(self, **filter_input):
+        filter_input.update(latitude=ORIGIN[0], longitude=ORIGIN[1], radiusKm=10)
+        return self.graphql(SHOPS_QUERY, filter=filter_input)['shops']
+
+    def test_distance_keyset_pages_without_gaps_or_duplicates(self):
+        names, distances, after = [], [], None
+        while True:
+            result = self.page(first=2, after=after)
+            self.assertTrue(result['response']['success'], result)
+            names += [shop['name'] for shop in result['data']]
+            distances += [shop['distance'] for shop in result['data']]
+            if not result['page']['hasNextPage']:
+                break
+            after = result['page']['endCursor']
+
+        self.assertEqual(names[0], 'a')
+        self.assertEqual(sorted(names), ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(distances, sorted(distances))
+        self.assertAlmostEqual(distances[-1], 3, delta=0.01)
+
+    def test_cursor_of_other_ordering_rejected(self):
+        cursor = self.page(first=2, orderBy='created_at')['page']['endCursor']
+
+        result = self.page(first=2, after=cursor)
+
+        self.assertFalse(result['response']['success'])
+        self.assertEqual(result['response']['message'], 'Invalid cursor')
+        self.assertEqual(result['data'], [])
+
+    def test_radius_clamped(self):
+        owner = User.objects.get()
+        Shop.objects.create(owner=owner, name='other city', address='x', latitude=ORIGIN[0] + 6, longitude=ORIGIN[1])
+
+        result = self.graphql(SHOPS_QUERY, filter={
+            'latitude': ORIGIN[0], 'longitude': ORIGIN[1], 'radiusKm': 1e9, 'first': 100,
+        })['shops']
+
+        # The 40 km shop is in, the one 667 km away beyond MAX_RADIUS_KM
+        names = [shop['name'] for shop in result['data']]
+        self.assertEqual(len(names), 6)
+        self.assertNotIn('other city', names)
+
+
+def reference_item_price(shop, item, user=None):
+    """The per-item, query-per-rule pricing PricingEngine replaced."""
+    service_type = ServiceType.PRINTING_COLOR if item.is_color else ServiceType.PRINTING_BW
+    try:
+        rule = ShopPricing.objects.get(shop=shop, service_type=service_type)
+        base_rate, modifiers = rule.base_price, rule.modifiers
+    except ShopPricing.DoesNotExist:
+        base_rate, modifiers = Decimal("100.00"), {}
+    raw_cost = Decimal(item.page_count) * base_rate * Decimal(str(modifiers.get(item.paper_size, "1.0")))
+
+    covering = models.Q(max_pages__gte=item.page_count) | models.Q(max_pages__isnull=True)
+    tier = PageRangeDiscount.objects.filter(shop=shop, min_pages__lte=item.page_count).filter(covering).first()
+    if not tier:
+        tier = PageRangeDiscount.objects.filter(shop__isnull=True, min_pages__lte=item.page_count).filter(covering).first()
+    if tier:
+        raw_cost -= raw_cost * (tier.discount_percent / Decimal("100.0"))
+
+    extras_cost = Decimal("0.00")
+    for wanted, extra in ((item.is_binding, ServiceType.BINDING), (item.is_lamination, ServiceType.LAMINATION)):
+        if wanted:
+            try:
+                extras_cost += ShopPricing.objects.get(shop=shop, service_type=extra).base_price
+            except ShopPricing.DoesNotExist:
+                extras_cost += Decimal("1000.00")
+
+    if user:
+        sub_discount = {
+            User.Subscription.STUDENT: Decimal("0.10"),
+            User.Subscription.BUSINESS: Decimal("0.20"),
+        }.get(user.subscription_tier, Decimal("0.00"))
+        return (raw_cost + extras_cost) * (Decimal("1.0") - sub_discount)
+    return raw_cost + extras_cost
+
+
+class PricingEngineTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(email='o@example.com', password='x')
+        self.priced = Shop.objects.create(owner=owner, name='priced', address='x', latitude=0, longitude=0)
+        self.bare = Shop.objects.create(owner=owner, name='bare', address='x', latitude=0, longitude=0)
+
+        for service_type, price, modifiers in (
+            (ServiceType.PRINTING_BW, '50.00', {'A3': 2}),
+            (ServiceType.PRINTING_COLOR, '250.00', {'A3': '1.75', 'A5': 0.5}),
+            (ServiceType.BINDING, '1500.00', {}),
+        ):
+            ShopPricing.objects.create(shop=self.priced, service_type=service_type, base_price=price, modifiers=modifiers)
+        # Overlapping shop tiers: the lowest min_pages covering the count wins
+        for min_pages, max_pages, percent in ((20, 99, '5.00'), (50, None, '12.50'), (100, 199, '20.00')):
+            PageRangeDiscount.objects.create(shop=self.priced, min_pages=min_pages, max_pages=max_pages, discount_percent=percent)
+        for min_pages, max_pages, percent in ((10, 49, '2.00'), (200, None, '30.00')):
+            PageRangeDiscount.objects.create(min_pages=min_pages, max_pages=max_pages, discount_percent=percent)
+
+        self.users = [None] + [
+            User.objects.create_user(email=f'{tier.lower()}@example.com', password='x', subscription_tier=tier)
+            for tier in User.Subscription.values
+        ]
+
+    def items(self):
+        return [
+            SimpleNamespace(page_count=pages, is_color=is_color, paper_size=size, is_binding=binding, is_lamination=lamination)
+            for pages, is_color, size, binding, lamination in product(
+                (1, 15, 60, 120, 250), (False, True), ('A4', 'A3', 'A5'), (False, True), (False, True),
+            )
+        ]
+
+    def test_price_item_matches_reference(self):
+        for shop, user in product((self.priced, self.bare), self.users):
+            engine = PricingEngine.for_shop(shop)
+            for item in self.items():
+                with self.subTest(shop=shop.name, user=user and user.subscription_tier, item=item):
+                    self.assertEqual(engine.price_item(item, user), reference_item_price(shop, item, user))
+
+    def test_price_cart_matches_sum_of_reference(self):
+        items = self.items()
+        profile = CartProfile(items)
+        for shop, user in product((self.priced, self.bare), self.users):
+            with self.subTest(shop=shop.name, user=user and user.subscription_tier):
+                expected = sum(reference_item_price(shop, item, user) for item in items)
+                self.assertEqual(PricingEngine.for_shop(shop).price_cart(profile, user), expected)
+
+
+class PriceSheetCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        price_cache._local_sheets.clear()
+        owner = User.objects.create_user(email='o@example.com', password='x')
+        self.shop = Shop.objects.create(owner=owner, name='a', address='x', latitude=0, longitude=0)
+        self.other = Shop.objects.create(owner=owner, name='b', address='x', latitude=0, longitude=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule = ShopPricing.objects.create(
+                shop=self.shop, service_type=ServiceType.PRINTING_BW, base_price='50.00',
+            )
+
+    def bw_rate(self, shop):
+        return price_cache.get_price_sheet(shop).rules[ServiceType.PRINTING_BW][0]
+
+    def test_sheet_cached_until_pricing_changes(self):
+        self.assertEqual(self.bw_rate(self.shop), Decimal('50.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.bw_rate(self.shop), Decimal('50.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule.base_price = Decimal('80.00')
+            self.rule.save()
+
+        # The old sheet is still in this process's LRU and the shared cache,
+        # under keys the new version no longer reaches
+        with self.assertNumQueries(2):
+            self.assertEqual(self.bw_rate(self.shop), Decimal('80.00'))
+        # Another worker, with nothing local, is served the recompiled sheet
+        price_cache._local_sheets.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.bw_rate(self.shop), Decimal('80.00'))
+
+    def test_version_bumped_only_on_commit(self):
+        self.bw_rate(self.shop)
+
+        with self.captureOnCommitCallbacks(execute=False):
+            self.rule.base_price = Decimal('80.00')
+            self.rule.save()
+            # A sheet compiled now would be cached under the new version
+            # with pre-commit rows, so the old one keeps being served
+            with self.assertNumQueries(0):
+                self.assertEqual(self.bw_rate(self.shop), Decimal('50.00'))
+
+    def test_global_tier_change_invalidates_every_shop(self):
+        sheets = price_cache.get_price_sheets([self.shop, self.other])
+        self.assertEqual(sheets[self.shop.id].global_tiers, ((), ()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PageRangeDiscount.objects.create(min_pages=10, discount_percent='5.00')
+
+        with self.assertNumQueries(2):
+            sheets = price_cache.get_price_sheets([self.shop, self.other])
+        for sheet in sheets.values():
+            self.assertEqual(sheet.global_tiers, ((10,), ((10, None, Decimal('5.00')),)))
+
+    def test_shop_change_leaves_other_shops_cached(self):
+        price_cache.get_price_sheets([self.shop, self.other])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.commission_rate = Decimal('3.00')
+            self.shop.save()
+
+        self.assertEqual(price_cache.get_price_sheet(self.shop).commission_rate, Decimal('3.00'))
+        with self.assertNumQueries(0):
+            price_cache.get_price_sheet(self.other)
@@ -0,0 +1,63 @@
+"""
+Who may open a document.
+
+A user may open a document they own, any document as staff, and any
+document in an order they placed or in an order placed at a shop they
+own. The order-based rules are decided by one query joining the
+document's order items to their orders and shops, and the answer
+(either way) is cached per (user, document) for
+``DOCUMENT_ACCESS_CACHE_TIMEOUT`` seconds, so a shop owner opening the
+files of an order pays for the join once per file.
+
+Orders only ever change who may see a document through their customer,
+their shop and their items, so the signals in
+``stationary_orders.signals`` and the order mutations drop the cached
+answers of the users involved whenever those change.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Document
+
+
+def _cache_key(user_id, document_id) -> str:
+    return f"document_access:{user_id}:{document_id}"
+
+
+def has_document_access(user, document) -> bool:
+    """Return True if *user* is permitted to access *document*."""
+    if not user.is_authenticated:
+        return False
+    if document.owner_id == user.id:
+        return True
+    if user.is_staff or user.is_superuser:
+        return True
+
+    key = _cache_key(user.id, document.id)
+    allowed = cache.get(key)
+    if allowed is None:
+        allowed = (
+            Document.objects
+            .filter(id=document.id)
+            .filter(Q(order_items__order__customer_id=user.id) | Q(order_items__order__shop__owner_id=user.id))
+            .exists()
+        )
+        cache.set(key, allowed, settings.DOCUMENT_ACCESS_CACHE_TIMEOUT)
+    return allowed
+
+
+def invalidate_document_access(user_ids, document_ids):
+    """
+    Forget the cached decisions of *user_ids* on *document_ids* once the
+    current transaction commits (so a concurrent check cannot cache the
+    old answer again in between).
+    """
+    keys = [
+        _cache_key(user_id, document_id)
+        for user_id in set(user_ids) if user_id is not None
+        for document_id in set(document_ids)
+    ]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
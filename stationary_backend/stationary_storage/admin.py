@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Document
+from .models import Blob, Document
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
@@ -19,3 +19,10 @@ class DocumentAdmin(admin.ModelAdmin):
             n += 1
         return f"{size:.2f} {power_labels[n]}"
     human_readable_size.short_description = 'Size'
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'size', 'ref_count', 'created_at')
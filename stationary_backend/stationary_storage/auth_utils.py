@@ -1,27 +1,16 @@
-from graphql_jwt.utils import jwt_decode
-from django.contrib.auth import get_user_model
+from rest_framework.authentication import BaseAuthentication
 
-User = get_user_model()
+from stationary_core.auth import authenticate_request
 
-def get_user_from_jwt(request):
-    auth_header = request.META.get("HTTP_AUTHORIZATION")
 
-    if not auth_header:
-        return None
+class JWTAuthentication(BaseAuthentication):
+    """DRF authentication from the same ``Authorization`` header."""
 
-    token = None
+    def authenticate(self, request):
+        user = authenticate_request(request._request)
+        if user is None:
+            return None
+        return (user, None)
 
-    if auth_header.startswith("Bearer "):
-        token = auth_header[7:]
-
-    elif auth_header.startswith("JWT "):
-        token = auth_header[4:]
-
-    if not token:
-        return None
-
-    try:
-        payload = jwt_decode(token)
-        return User.objects.get(id=payload["user_id"])
-    except Exception:
-        return None
\ No newline at end of file
+    def authenticate_header(self, request):
+        return 'JWT'
@@ -0,0 +1,114 @@
+"""
+Content-addressed file storage.
+
+Every uploaded file is stored once per distinct content, as a ``Blob``
+keyed by its SHA-256; each ``Document`` uploading that content holds a
+reference to it. Uploading a file that is already stored costs a
+counter increment instead of another copy on disk, and deleting a
+Document frees the file only when no other Document uses it.
+
+Reference counts are changed with single ``UPDATE`` statements, so
+concurrent uploads and deletions of the same content never lose a count.
+"""
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Blob, Document
+
+
+def blob_path(sha256) -> str:
+    # Two levels of fan-out keep directories small
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+class SHA256UploadHandler(FileUploadHandler):
+    """
+    Hashes each file as the multipart parser streams it in, so the
+    digest is ready without reading the upload back. Install it ahead of
+    the default handlers; ``digests`` maps field names to hex digests.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self._hash = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hash.hexdigest()
+        return None
+
+
+def add_reference(sha256):
+    """Take a reference to the stored blob *sha256*; ``None`` if unknown."""
+    if not Blob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1):
+        return None
+    return Blob.objects.get(sha256=sha256)
+
+
+def store(sha256, size, content=None, *, name=None) -> Blob:
+    """
+    Return the blob for *sha256* with a reference taken on it.
+
+    If the content is new it is stored, either by saving *content* (a
+    file object) or by adopting the file already at *name* in storage.
+    If it is already stored, *content* is not written and the file at
+    *name* is deleted as a duplicate.
+    """
+    blob = add_reference(sha256)
+    if blob is None:
+        path = name or default_storage.save(blob_path(sha256), content)
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(sha256=sha256, file=path, size=size, ref_count=1)
+        except IntegrityError:
+            # Someone stored the same content first; use theirs
+            blob = add_reference(sha256)
+            if blob is None:
+                raise
+            name = path
+    if name and name != blob.file.name:
+        transaction.on_commit(lambda: default_storage.delete(name))
+    return blob
+
+
+def release(blob_id):
+    """
+    Drop one reference to *blob_id*, deleting the blob and its file once
+    nothing references it any more.
+    """
+    unreferenced = Blob.objects.filter(sha256=blob_id, ref_count=0)
+    Blob.objects.filter(sha256=blob_id).update(ref_count=F('ref_count') - 1)
+    name = unreferenced.values_list('file', flat=True).first()
+    # Delete the row only if still unreferenced; another upload may have
+    # taken a reference in the meantime
+    if name is not None and unreferenced.delete()[0]:
+        transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def attach(document: Document, blob: Blob):
+    """Point *document* at *blob* (whose reference the caller already holds)."""
+    document.blob = blob
+    document.file = blob.file.name
+    document.sha256 = blob.sha256
+
+
+def delete_document(document: Document):
+    """
+    Delete *document* and, for documents predating blobs, its own file.
+    Blob references are released by the ``post_delete`` signal.
+    """
+    if document.blob_id is None and document.file and default_storage.exists(document.file.name):
+        default_storage.delete(document.file.name)
+    document.delete()
@@ -0,0 +1,34 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from stationary_storage import blobs
+from stationary_storage.models import Document
+from stationary_storage.uploads import file_sha256
+
+
+class Command(BaseCommand):
+    help = 'Moves documents uploaded before deduplication onto shared blobs, deleting duplicate files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Process at most this many documents')
+
+    def handle(self, *args, limit=None, **options):
+        documents = Document.objects.filter(blob__isnull=True, is_uploaded=True).order_by('created_at')
+        if limit:
+            documents = documents[:limit]
+
+        moved = missing = 0
+        for document in documents.iterator():
+            name = document.file.name
+            if not name or not default_storage.exists(name):
+                missing += 1
+                continue
+            with transaction.atomic():
+                blobs.attach(document, blobs.store(file_sha256(name), document.file_size, name=name))
+                document.save(update_fields=['blob', 'file', 'sha256', 'updated_at'])
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} documents moved to blobs, {missing} skipped with no file'
+        ))
@@ -0,0 +1,263 @@
+"""
+Document metadata extraction.
+
+After an upload completes, ``extract_document_metadata`` reads the file
+once and caches on the Document what pricing needs:
+
+- ``page_count``;
+- ``page_sizes``, the number of pages per paper size, e.g. ``{"A4": 12}``;
+- ``color_pages``, the 1-based numbers of pages with colour content
+  (``None`` when the format gives no way to tell).
+
+PDFs are read with pypdf when it is installed. A page counts as colour
+when its content stream sets a non-grey colour or it draws an image with
+more than ``COLOR_PIXEL_THRESHOLD`` of its pixels in colour. DOCX files
+report the page count Word saved in ``docProps/app.xml`` and the section
+page size. Images are a single page whose colour is sampled with Pillow.
+
+Documents sharing a blob share their content, so the result is copied
+from any other Document of the same blob instead of parsing again.
+
+Extraction only ever runs in the background: until a document is READY
+it is priced by the page count and colour the client sent. FAILED
+documents are retried by ``extract_pending_metadata`` up to
+``MAX_ATTEMPTS`` analyses.
+"""
+import logging
+import zipfile
+from collections import Counter
+from xml.etree import ElementTree
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image
+
+from .models import Document
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - optional dependency
+    pypdf = None
+
+
+logger = logging.getLogger(__name__)
+
+# (name, short side mm, long side mm), matched within PAPER_TOLERANCE_MM
+PAPER_SIZES = (
+    ('A3', 297, 420),
+    ('A4', 210, 297),
+    ('A5', 148, 210),
+    ('LETTER', 215.9, 279.4),
+    ('LEGAL', 215.9, 355.6),
+)
+PAPER_TOLERANCE_MM = 5
+OTHER_SIZE = 'OTHER'
+
+# Channel spread above which a colour value or pixel is not grey
+COLOR_TOLERANCE = 0.05
+# Share of coloured pixels from which an image counts as colour
+COLOR_PIXEL_THRESHOLD = 0.01
+# Images are downsampled to this many pixels a side before sampling
+COLOR_SAMPLE_SIZE = 64
+
+PDF_TYPES = {'application/pdf'}
+DOCX_TYPES = {'application/vnd.openxmlformats-officedocument.wordprocessingml.document'}
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff'}
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+APP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/extended-properties}'
+
+
+class Unsupported(Exception):
+    """The file's format cannot be analysed here."""
+
+
+def paper_size(width_mm, height_mm) -> str:
+    short, long = sorted((width_mm, height_mm))
+    for name, size_short, size_long in PAPER_SIZES:
+        if abs(short - size_short) <= PAPER_TOLERANCE_MM and abs(long - size_long) <= PAPER_TOLERANCE_MM:
+            return name
+    return OTHER_SIZE
+
+
+def _is_color(values) -> bool:
+    """Whether a gray, RGB or CMYK colour operand list is not grey."""
+    values = [float(v) for v in values if isinstance(v, (int, float))]
+    if len(values) == 3:
+        return max(values) - min(values) > COLOR_TOLERANCE
+    if len(values) == 4:
+        cyan, magenta, yellow, _black = values
+        return max(cyan, magenta, yellow) - min(cyan, magenta, yellow) > COLOR_TOLERANCE
+    return False
+
+
+def image_color_fraction(image) -> float:
+    """Share of *image*'s pixels (sampled) that are not grey."""
+    image = image.convert('RGB')
+    image.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    pixels = list(image.getdata())
+    if not pixels:
+        return 0.0
+    spread = COLOR_TOLERANCE * 255
+    colored = sum(1 for r, g, b in pixels if max(r, g, b) - min(r, g, b) > spread)
+    return colored / len(pixels)
+
+
+# ------------------------------
+# Formats
+# ------------------------------
+
+COLOR_OPERATORS = {b'rg', b'RG', b'k', b'K', b'sc', b'SC', b'scn', b'SCN'}
+
+
+def _pdf_page_has_color(page) -> bool:
+    contents = page.get_contents()
+    if contents is not None:
+        for operands, operator in contents.operations:
+            if operator in COLOR_OPERATORS and _is_color(operands):
+                return True
+
+    try:
+        images = list(page.images)
+    except Exception:
+        # Filters pypdf cannot decode; judge the page by its vectors
+        return False
+    for image_file in images:
+        try:
+            if image_color_fraction(image_file.image) > COLOR_PIXEL_THRESHOLD:
+                return True
+        except Exception:
+            continue
+    return False
+
+
+def analyse_pdf(fh) -> dict:
+    if pypdf is None:
+        raise Unsupported('pypdf is not installed')
+    reader = pypdf.PdfReader(fh)
+    if reader.is_encrypted and not reader.decrypt(''):
+        raise Unsupported('PDF is password protected')
+
+    sizes = Counter()
+    color_pages = []
+    for number, page in enumerate(reader.pages, start=1):
+        box = page.mediabox
+        sizes[paper_size(float(box.width) * 25.4 / 72, float(box.height) * 25.4 / 72)] += 1
+        if _pdf_page_has_color(page):
+            color_pages.append(number)
+
+    return {
+        'page_count': len(reader.pages),
+        'page_sizes': dict(sizes),
+        'color_pages': color_pages,
+    }
+
+
+def analyse_docx(fh) -> dict:
+    with zipfile.ZipFile(fh) as archive:
+        try:
+            app = ElementTree.fromstring(archive.read('docProps/app.xml'))
+        except KeyError:
+            raise Unsupported('DOCX has no saved page count')
+        pages = app.findtext(f'{APP_NS}Pages')
+        if not pages or not pages.strip().isdigit():
+            raise Unsupported('DOCX has no saved page count')
+        page_count = int(pages)
+
+        # The first section's page size; twips are 1/1440 inch
+        size = OTHER_SIZE
+        with archive.open('word/document.xml') as document:
+            for _event, element in ElementTree.iterparse(document):
+                if element.tag == f'{WORD_NS}pgSz':
+                    width = int(element.get(f'{WORD_NS}w', 0))
+                    height = int(element.get(f'{WORD_NS}h', 0))
+                    size = paper_size(width * 25.4 / 1440, height * 25.4 / 1440)
+                    break
+                element.clear()
+
+    return {
+        'page_count': page_count,
+        'page_sizes': {size: page_count},
+        'color_pages': None,
+    }
+
+
+def analyse_image(fh) -> dict:
+    with Image.open(fh) as image:
+        colored = image_color_fraction(image) > COLOR_PIXEL_THRESHOLD
+    return {
+        'page_count': 1,
+        'page_sizes': {},
+        'color_pages': [1] if colored else [],
+    }
+
+
+def analyse(document: Document) -> dict:
+    file_type = (document.file_type or '').lower()
+    name = document.file_name.lower()
+    if file_type in PDF_TYPES or name.endswith('.pdf'):
+        analyser = analyse_pdf
+    elif file_type in DOCX_TYPES or name.endswith('.docx'):
+        analyser = analyse_docx
+    elif file_type in IMAGE_TYPES:
+        analyser = analyse_image
+    else:
+        raise Unsupported(f'No analyser for {file_type or name}')
+
+    with default_storage.open(document.file.name, 'rb') as fh:
+        return analyser(fh)
+
+
+# ------------------------------
+# Extraction
+# ------------------------------
+
+METADATA_FIELDS = ['metadata_status', 'page_count', 'page_sizes', 'color_pages', 'metadata_attempts']
+# Analyses of a file before a FAILED document is left for good
+MAX_ATTEMPTS = 3
+
+
+def queue_extraction(document: Document):
+    """Analyse *document* in the background once the upload has committed."""
+    from .tasks import extract_document_metadata
+
+    document_id = document.id
+    transaction.on_commit(lambda: extract_document_metadata.delay(str(document_id)))
+
+
+def extract(document: Document) -> Document:
+    """Fill in *document*'s metadata, reusing that of its blob's other documents."""
+    shared = None
+    if document.blob_id:
+        shared = (
+            Document.objects
+            .filter(blob_id=document.blob_id, metadata_status=Document.MetadataStatus.READY)
+            .exclude(id=document.id)
+            .only(*METADATA_FIELDS)
+            .first()
+        )
+
+    if shared is not None:
+        document.page_count = shared.page_count
+        document.page_sizes = shared.page_sizes
+        document.color_pages = shared.color_pages
+        document.metadata_status = Document.MetadataStatus.READY
+    else:
+        document.metadata_attempts += 1
+        try:
+            result = analyse(document)
+        except Unsupported as exc:
+            logger.info("Document %s not analysed: %s", document.id, exc)
+            document.metadata_status = Document.MetadataStatus.UNSUPPORTED
+        except Exception:
+            logger.exception("Metadata extraction failed for document %s", document.id)
+            document.metadata_status = Document.MetadataStatus.FAILED
+        else:
+            document.page_count = result['page_count']
+            document.page_sizes = result['page_sizes']
+            document.color_pages = result['color_pages']
+            document.metadata_status = Document.MetadataStatus.READY
+
+    document.save(update_fields=METADATA_FIELDS + ['updated_at'])
+    return document
+
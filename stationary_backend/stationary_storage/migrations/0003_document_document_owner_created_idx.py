@@ -0,0 +1,17 @@
+# Generated by Django 4.2.28 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_storage', '0002_alter_document_owner'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', 'created_at'], name='document_owner_created_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.28 on 2026-10-18 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_storage', '0003_document_document_owner_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='is_uploaded',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='sha256',
+            field=models.CharField(blank=True, help_text='Hex SHA-256 of the file', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='upload_offset',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
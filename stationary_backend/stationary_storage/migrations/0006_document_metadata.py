@@ -0,0 +1,33 @@
+# Generated by Django 4.2.28 on 2026-10-18 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_storage', '0005_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='color_pages',
+            field=models.JSONField(blank=True, help_text='Numbers of the pages with colour content; null if unknown', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='metadata_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('READY', 'Ready'), ('UNSUPPORTED', 'Unsupported'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='page_sizes',
+            field=models.JSONField(blank=True, default=dict, help_text='Pages per paper size, e.g. {"A4": 12}'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.28 on 2026-10-18 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationary_storage', '0006_document_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='metadata_attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Times the file has been analysed'),
+        ),
+    ]
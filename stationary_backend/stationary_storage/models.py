@@ -2,14 +2,57 @@ from django.db import models
 from django.conf import settings
 from stationary_core.models import BaseModel
 
+class Blob(models.Model):
+    """
+    One stored file, shared by every Document with the same content.
+
+    ``ref_count`` is the number of Documents pointing at the blob; the
+    blob and its file are deleted when the last of them goes (see
+    stationary_storage.blobs).
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(upload_to='blobs/', max_length=255)
+    size = models.PositiveIntegerField(help_text="Size in bytes")
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
 class Document(BaseModel):
+    class MetadataStatus(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        READY = "READY", "Ready"
+        UNSUPPORTED = "UNSUPPORTED", "Unsupported"
+        FAILED = "FAILED", "Failed"
+
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='documents', null=True, blank=True)
     file = models.FileField(upload_to='secure_uploads/')
+    # Shared content; ``file`` then names the blob's file. Documents
+    # uploaded before deduplication own their file and have no blob.
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='documents', null=True, blank=True)
     file_name = models.CharField(max_length=255)
     file_type = models.CharField(max_length=50, blank=True, help_text="MIME type")
     file_size = models.PositiveIntegerField(help_text="Size in bytes")
     is_scanned = models.BooleanField(default=False)
     virus_detected = models.BooleanField(default=False)
+    # Resumable uploads (see stationary_storage.uploads): bytes received so
+    # far, and whether the upload has been completed and verified
+    upload_offset = models.PositiveIntegerField(default=0)
+    is_uploaded = models.BooleanField(default=True)
+    sha256 = models.CharField(max_length=64, blank=True, help_text="Hex SHA-256 of the file")
+    # Extracted from the file after upload (see stationary_storage.metadata)
+    metadata_status = models.CharField(max_length=20, choices=MetadataStatus.choices, default=MetadataStatus.PENDING.value)
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    page_sizes = models.JSONField(default=dict, blank=True, help_text="Pages per paper size, e.g. {\"A4\": 12}")
+    color_pages = models.JSONField(null=True, blank=True, help_text="Numbers of the pages with colour content; null if unknown")
+    metadata_attempts = models.PositiveSmallIntegerField(default=0, help_text="Times the file has been analysed")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'created_at'], name='document_owner_created_idx'),
+        ]
 
     def __str__(self):
         return self.file_name
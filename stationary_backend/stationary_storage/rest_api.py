@@ -1,22 +1,41 @@
 from django.http import JsonResponse, HttpResponse
-from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
-from rest_framework.decorators import api_view, permission_classes
+from django.conf import settings
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
+from . import blobs, metadata, uploads
+from .access import has_document_access
+from .auth_utils import JWTAuthentication
 from .models import Document
+import io
 import mimetypes
-import uuid
-import os
 
-class MediaUploadViewDev(APIView):
+class HashedUploadMixin:
+    """
+    Hashes uploaded files while the multipart parser streams them in
+    (``self.hasher``, a ``blobs.SHA256UploadHandler``).
+
+    The handler is installed before DRF authenticates: the CSRF check of
+    session authentication parses the body, and handlers cannot be added
+    once it has been read.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        self.hasher = blobs.SHA256UploadHandler(request)
+        request.upload_handlers.insert(0, self.hasher)
+        return super().initialize_request(request, *args, **kwargs)
+
+
+class MediaUploadViewDev(HashedUploadMixin, APIView):
     """
     Development-only upload endpoint without authentication
     POST /api/storage/upload/dev/
@@ -44,13 +63,8 @@ class MediaUploadViewDev(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Generate unique filename
-            file_extension = os.path.splitext(file_name)[1]
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            upload_path = f"secure_uploads/{unique_filename}"
-            
-            # Save file to storage
-            path = default_storage.save(upload_path, uploaded_file)
+            # Store the content once; a known hash only takes a reference
+            blob = blobs.store(self.hasher.digests['file'], file_size, uploaded_file)
             
             # Create document record with dummy user (for development)
             from django.contrib.auth import get_user_model
@@ -59,13 +73,16 @@ class MediaUploadViewDev(APIView):
             
             document = Document.objects.create(
                 owner=dummy_user or User.objects.create_user('devuser', 'dev@example.com', 'devpass123'),
-                file=path,
+                blob=blob,
+                file=blob.file.name,
+                sha256=blob.sha256,
                 file_name=file_name,
                 file_type=file_type,
                 file_size=file_size,
                 is_scanned=False,
                 virus_detected=False
             )
+            metadata.queue_extraction(document)
             
             # Build URLs
             request_host = f"{request.scheme}://{request.get_host()}"
@@ -89,7 +106,7 @@ class MediaUploadViewDev(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class MediaUploadView(APIView):
+class MediaUploadView(HashedUploadMixin, APIView):
     """
     REST API for media uploads
     POST /api/storage/upload/
@@ -98,6 +115,13 @@ class MediaUploadView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request, *args, **kwargs):
+        # Refuse oversized bodies before the multipart parser reads them
+        if int(request.META.get('CONTENT_LENGTH') or 0) > settings.UPLOAD_MAX_SIZE + 64 * 1024:
+            return Response(
+                {'error': 'File too large. Maximum size is 50MB'}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
         try:
             # Get uploaded file
             if 'file' not in request.FILES:
@@ -118,24 +142,22 @@ class MediaUploadView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Generate unique filename
-            file_extension = os.path.splitext(file_name)[1]
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            upload_path = f"secure_uploads/{unique_filename}"
-            
-            # Save file to storage
-            path = default_storage.save(upload_path, uploaded_file)
+            # Store the content once; a known hash only takes a reference
+            blob = blobs.store(self.hasher.digests['file'], file_size, uploaded_file)
             
             # Create document record
             document = Document.objects.create(
                 owner=request.user,
-                file=path,
+                blob=blob,
+                file=blob.file.name,
+                sha256=blob.sha256,
                 file_name=file_name,
                 file_type=file_type,
                 file_size=file_size,
                 is_scanned=False,  # In production, implement virus scanning
                 virus_detected=False
             )
+            metadata.queue_extraction(document)
             
             # Build URLs
             request_host = f"{request.scheme}://{request.get_host()}"
@@ -201,12 +223,8 @@ class MediaDetailViewDev(APIView):
         try:
             document = Document.objects.get(id=document_id)
             
-            # Delete file from storage
-            if document.file and default_storage.exists(document.file.name):
-                default_storage.delete(document.file.name)
-            
-            # Delete document record
-            document.delete()
+            # Delete document record, and its file once no other document shares it
+            blobs.delete_document(document)
             
             return Response({
                 'message': 'File deleted successfully (dev mode)'
@@ -236,19 +254,11 @@ class MediaDetailView(APIView):
             document = Document.objects.get(id=document_id)
             
             # Check permissions
-            if document.owner != request.user:
-                # Check if user has access through orders
-                from stationary_orders.models import OrderItem
-                has_access = OrderItem.objects.filter(
-                    document=document,
-                    order__customer=request.user
-                ).exists()
-                
-                if not has_access and not (request.user.is_staff or request.user.is_superuser):
-                    return Response(
-                        {'error': 'Permission denied'}, 
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            if not has_document_access(request.user, document):
+                return Response(
+                    {'error': 'Permission denied'}, 
+                    status=status.HTTP_403_FORBIDDEN
+                )
             
             request_host = f"{request.scheme}://{request.get_host()}"
             upload_url = f"{request_host}/api/storage/files/{document.id}/"
@@ -285,12 +295,8 @@ class MediaDetailView(APIView):
             # In production, you might want to enforce ownership: if document.owner != request.user and not request.user.is_superuser:
             # For now, let's allow cross-ownership for testing purposes
             
-            # Delete file from storage
-            if document.file and default_storage.exists(document.file.name):
-                default_storage.delete(document.file.name)
-            
-            # Delete document record
-            document.delete()
+            # Delete document record, and its file once no other document shares it
+            blobs.delete_document(document)
             
             return Response({
                 'message': 'File deleted successfully'
@@ -358,7 +364,7 @@ class MediaListView(APIView):
     def get(self, request, *args, **kwargs):
         try:
             # Get user's documents
-            documents = Document.objects.filter(owner=request.user).order_by('-created_at')
+            documents = Document.objects.filter(owner=request.user, is_uploaded=True).order_by('-created_at')
             
             request_host = f"{request.scheme}://{request.get_host()}"
             
@@ -391,55 +397,133 @@ class MediaListView(APIView):
             )
 
 @api_view(['POST'])
+@authentication_classes([JWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
 def create_presigned_upload(request):
     """
-    Create presigned upload URL for client-side uploads
+    Start a resumable upload
     POST /api/storage/presigned-upload/
+    Body: fileName, fileType, fileSize and optionally checksum (hex SHA-256)
     """
     try:
         file_name = request.data.get('fileName')
         file_type = request.data.get('fileType')
-        file_size = request.data.get('fileSize')
-        
-        if not file_name or not file_size:
+
+        if not file_name or not request.data.get('fileSize'):
             return Response(
                 {'error': 'fileName and fileSize are required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Validate file size
-        if file_size > 50 * 1024 * 1024:  # 50MB limit
-            return Response(
-                {'error': 'File too large. Maximum size is 50MB'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Create document record first
-        document = Document.objects.create(
-            owner=request.user,
-            file=f"pending_upload/{uuid.uuid4()}_{file_name}",
-            file_name=file_name,
-            file_type=file_type,
-            file_size=file_size,
-            is_scanned=False,
-            virus_detected=False
-        )
-        
-        # Return upload URL (for now, return the file serving URL)
+
+        file_size = uploads.parse_size(request.data.get('fileSize'))
+        checksum = uploads.parse_checksum(request.data.get('checksum'))
+
+        # Create document record first; the file is filled in by PATCH requests
+        document = uploads.start_upload(request.user, file_name, file_type, file_size, checksum)
+
         request_host = f"{request.scheme}://{request.get_host()}"
         upload_url = f"{request_host}/api/storage/upload/{document.id}/"
-        
+
         return Response({
             'documentId': str(document.id),
             'uploadUrl': upload_url,
+            'completeUrl': f"{upload_url}complete/",
+            'uploadOffset': document.upload_offset,
+            'chunkSize': settings.UPLOAD_CHUNK_MAX_SIZE,
             'fileName': file_name,
             'fileType': file_type,
-            'fileSize': file_size
-        })
-        
+            'fileSize': file_size,
+            'isUploaded': document.is_uploaded
+        }, status=status.HTTP_201_CREATED)
+
+    except uploads.UploadError as e:
+        return Response({'error': str(e)}, status=e.status)
     except Exception as e:
         return Response(
             {'error': f'Presigned URL creation failed: {str(e)}'}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+class ResumableUploadView(APIView):
+    """
+    Chunks of a resumable upload started by create_presigned_upload
+    HEAD /api/storage/upload/:id/ - Offset to resume from (Upload-Offset header)
+    PATCH /api/storage/upload/:id/ - Append the body at the Upload-Offset header
+    """
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def head(self, request, document_id, *args, **kwargs):
+        try:
+            document = uploads.pending_upload(document_id, request.user)
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return self._offset_response(document.upload_offset, document.file_size, status.HTTP_200_OK)
+
+    def patch(self, request, document_id, *args, **kwargs):
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return Response(
+                {'error': 'Upload-Offset header is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        content_length = request.headers.get('Content-Length')
+        length = int(content_length) if content_length and content_length.isdigit() else None
+
+        try:
+            new_offset = uploads.append_chunk(
+                document_id, request.user, offset, length, request.stream or io.BytesIO()
+            )
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        except Exception as e:
+            return Response(
+                {'error': f'Upload failed: {str(e)}'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return self._offset_response(new_offset, None, status.HTTP_204_NO_CONTENT)
+
+    def _offset_response(self, offset, length, status_code):
+        response = HttpResponse(status=status_code)
+        response['Upload-Offset'] = str(offset)
+        if length is not None:
+            response['Upload-Length'] = str(length)
+        response['Cache-Control'] = 'no-store'
+        return response
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def complete_upload(request, document_id):
+    """
+    Finish a resumable upload once every byte has been sent
+    POST /api/storage/upload/:id/complete/
+    Body: optionally checksum (hex SHA-256), if not given when the upload was created
+    """
+    try:
+        checksum = uploads.parse_checksum(request.data.get('checksum'))
+        document = uploads.complete_upload(document_id, request.user, checksum)
+    except uploads.UploadError as e:
+        return Response({'error': str(e)}, status=e.status)
+    except Exception as e:
+        return Response(
+            {'error': f'Upload failed: {str(e)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    request_host = f"{request.scheme}://{request.get_host()}"
+    upload_url = f"{request_host}/api/storage/files/{document.id}/"
+    download_url = f"{request_host}/api/storage/files/{document.id}/?download=1"
+
+    return Response({
+        'id': str(document.id),
+        'fileName': document.file_name,
+        'fileType': document.file_type,
+        'fileSize': document.file_size,
+        'sha256': document.sha256,
+        'uploadUrl': upload_url,
+        'downloadUrl': download_url,
+        'createdAt': document.created_at.isoformat(),
+        'message': 'File uploaded successfully'
+    })
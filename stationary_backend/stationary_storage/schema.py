@@ -2,6 +2,8 @@ import graphene
 from graphene_django import DjangoObjectType
 from stationary_storage.models import Document
 from stationary_accounts.models import User
+from stationary_core.optimization import optimize_queryset
+from stationary_core.dataloaders import load_related
 from tarxemo_django_graphene_utils import (
     BaseResponseDTO,
     ResponseObject,
@@ -18,6 +20,12 @@ class DocumentType(DjangoObjectType):
         model = Document
         fields = "__all__"
 
+    def resolve_owner(self, info):
+        return load_related(self, info, 'owner')
+
+    def resolve_order_items(self, info):
+        return load_related(self, info, 'order_items')
+
     def resolve_upload_url(self, info):
         """Return URL for inline preview using REST API"""
         request = info.context
@@ -105,7 +113,7 @@ class Query(graphene.ObjectType):
     def resolve_my_documents(self, info):
         user = info.context.user
         if user.is_authenticated:
-            return Document.objects.filter(owner=user)
+            return optimize_queryset(Document.objects.filter(owner=user, is_uploaded=True), info)
         return []
 
     def resolve_documents(self, info):
@@ -115,7 +123,7 @@ class Query(graphene.ObjectType):
             return {"response": build_error("Permission denied"), "data": []}
         
         try:
-            documents = Document.objects.all()
+            documents = optimize_queryset(Document.objects.all(), info)
             return {
                 "response": build_success_response("Documents retrieved successfully"),
                 "data": documents
@@ -0,0 +1,295 @@
+"""
+Document file responses.
+
+The views decide who may see a document; this module decides how its
+bytes reach the client, according to ``DOCUMENT_SERVE_MODE``:
+
+``accel``
+    nginx serves the file. Django answers with an empty response carrying
+    ``X-Accel-Redirect: <DOCUMENT_ACCEL_PREFIX><file name>``, which nginx
+    resolves against an ``internal`` location aliased to the media
+    directory. The worker is free as soon as the headers are written.
+``sendfile``
+    The same hand-off for Apache (mod_xsendfile) or lighttpd, using
+    ``X-Sendfile`` with the file's absolute path.
+``stream``
+    Django streams the file itself (development). Under ASGI (daphne, and
+    runserver with daphne installed) the response body is an async
+    iterator reading ``CHUNK_SIZE`` pieces in a worker thread, so a
+    download never holds more than one chunk in memory; a sync iterator
+    would be drained into a list by Django before the first byte is sent.
+
+Every mode answers conditional requests from Django: documents carry a
+strong ETag (the content's SHA-256, or size and mtime for files stored
+before hashing) and a Last-Modified date, so a client revalidating a
+file it already has gets a 304 without the file being opened. In
+``stream`` mode Django also serves byte ranges (206, multipart for
+several ranges); nginx and mod_xsendfile do that themselves.
+"""
+import mimetypes
+import re
+import uuid
+from functools import partial
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+ACCEL = 'accel'
+SENDFILE = 'sendfile'
+STREAM = 'stream'
+
+
+def content_type_for(document) -> str:
+    return (
+        document.file_type
+        or mimetypes.guess_type(document.file_name)[0]
+        or 'application/octet-stream'
+    )
+
+
+# ------------------------------
+# Validators
+# ------------------------------
+
+def file_validators(document):
+    """
+    ``(etag, last_modified)`` of *document*'s file; ``Http404`` if the
+    file is missing from storage.
+    """
+    try:
+        modified = default_storage.get_modified_time(document.file.name)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('File not found on storage backend')
+    last_modified = int(modified.timestamp())
+    if document.sha256:
+        etag = f'"{document.sha256}"'
+    else:
+        etag = f'"{document.file_size:x}-{last_modified:x}"'
+    return etag, last_modified
+
+
+def _if_range_passes(request, etag, last_modified) -> bool:
+    """Whether a Range request may be honoured under its If-Range header."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Only a strong match will do for ranges
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and date == last_modified
+
+
+# ------------------------------
+# Ranges
+# ------------------------------
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+# More ranges than this are answered with the whole file
+MAX_RANGES = 16
+CHUNK_SIZE = 64 * 1024
+
+
+class Unsatisfiable(Exception):
+    pass
+
+
+def parse_ranges(header, size):
+    """
+    ``[(start, end), ...]`` (inclusive, sorted, overlaps merged) for a
+    ``Range: bytes=...`` header, or ``None`` if the header is to be
+    ignored. Raises ``Unsatisfiable`` if no range overlaps the file.
+    """
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = RANGE_RE.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+
+    if not ranges:
+        raise Unsatisfiable
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_range(fh, start, end):
+    fh.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = fh.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def _iter_parts(name, parts):
+    """The bytes of *parts*: literal ``bytes``, or ``(start, end)`` ranges of the file."""
+    with default_storage.open(name, 'rb') as fh:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield from _read_range(fh, *part)
+
+
+async def _aiter_parts(name, parts):
+    """``_iter_parts`` for ASGI; file I/O runs in worker threads."""
+    # Not thread-sensitive: reads must not queue behind the sync views
+    run = partial(sync_to_async, thread_sensitive=False)
+    fh = await run(default_storage.open)(name, 'rb')
+    try:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, end = part
+            await run(fh.seek)(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = await run(fh.read)(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+    finally:
+        await run(fh.close)()
+
+
+def streaming_response(request, name, parts, **kwargs):
+    """
+    ``StreamingHttpResponse`` of *parts* of file *name*, with an async
+    iterator when *request* came in over ASGI.
+    """
+    if isinstance(request, ASGIRequest):
+        content = _aiter_parts(name, parts)
+    else:
+        content = _iter_parts(name, parts)
+    return StreamingHttpResponse(content, **kwargs)
+
+
+def range_response(request, document, ranges, content_type):
+    """206 response with *ranges* of *document*'s file."""
+    name = document.file.name
+    size = document.file_size
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = streaming_response(request, name, ranges, status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        return response
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, end in ranges:
+        parts.append((
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode('ascii'))
+        parts.append((start, end))
+    parts.append(f'\r\n--{boundary}--\r\n'.encode('ascii'))
+    response = streaming_response(
+        request, name, parts,
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = sum(
+        len(part) if isinstance(part, bytes) else part[1] - part[0] + 1
+        for part in parts
+    )
+    return response
+
+
+# ------------------------------
+# Responses
+# ------------------------------
+
+def document_response(request, document, *, as_attachment: bool, cache_control: str):
+    """
+    Response delivering *document*'s file, inline or as an attachment.
+    The caller has already checked access; a missing file raises
+    ``Http404``.
+    """
+    mode = settings.DOCUMENT_SERVE_MODE
+    name = document.file.name
+    etag, last_modified = file_validators(document)
+
+    validators = HttpResponse()
+    validators['ETag'] = etag
+    validators['Last-Modified'] = http_date(last_modified)
+    validators['Cache-Control'] = cache_control
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified, response=validators)
+    if conditional is not validators:
+        return conditional
+
+    ranges = None
+    range_header = request.META.get('HTTP_RANGE')
+    if mode == STREAM and range_header and _if_range_passes(request, etag, last_modified):
+        try:
+            ranges = parse_ranges(range_header, document.file_size)
+        except Unsatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{document.file_size}'
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    if ranges:
+        response = range_response(request, document, ranges, content_type_for(document))
+    elif mode == ACCEL:
+        response = HttpResponse(content_type=content_type_for(document))
+        response['X-Accel-Redirect'] = settings.DOCUMENT_ACCEL_PREFIX + quote(name)
+    elif mode == SENDFILE:
+        response = HttpResponse(content_type=content_type_for(document))
+        response['X-Sendfile'] = default_storage.path(name)
+    else:
+        response = streaming_response(
+            request, name, [(0, document.file_size - 1)], content_type=content_type_for(document)
+        )
+        response['Content-Length'] = document.file_size
+
+    # nginx keeps Content-Type, Content-Disposition and Cache-Control
+    # from the redirecting response and sets its own validators
+    response['Content-Disposition'] = content_disposition_header(as_attachment, document.file_name)
+    response['Cache-Control'] = cache_control
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
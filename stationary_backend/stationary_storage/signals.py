@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from stationary_storage import blobs
+from stationary_storage.models import Document
+
+# Documents are deleted by the media views, stale-upload purges and
+# cascades from their owner; the signal releases the blob in every case.
+
+
+@receiver(post_delete, sender=Document)
+def release_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        blobs.release(instance.blob_id)
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metadata, uploads
+from .models import Document
+
+
+@shared_task
+def purge_stale_uploads():
+    """Remove resumable uploads abandoned for ``UPLOAD_EXPIRE_AFTER`` seconds."""
+    return uploads.purge_stale_uploads()
+
+
+# A FAILED document may be retried (see extract_pending_metadata)
+RETRIED_STATUSES = (Document.MetadataStatus.PENDING, Document.MetadataStatus.FAILED)
+
+
+@shared_task
+def extract_document_metadata(document_id):
+    """Count pages, detect paper sizes and colour pages of an uploaded document."""
+    document = Document.objects.filter(id=document_id, is_uploaded=True).first()
+    if document is None or document.metadata_status not in RETRIED_STATUSES:
+        return None
+    return metadata.extract(document).metadata_status
+
+
+@shared_task
+def extract_pending_metadata():
+    """
+    Queue extraction again for uploaded documents still pending after
+    ten minutes (lost task, worker crash, documents uploaded before
+    extraction existed) and for failed ones, ten minutes after their last
+    attempt, until they have been tried ``metadata.MAX_ATTEMPTS`` times.
+    """
+    cutoff = timezone.now() - timedelta(minutes=10)
+    document_ids = list(
+        Document.objects
+        .filter(
+            Q(metadata_status=Document.MetadataStatus.PENDING)
+            | Q(metadata_status=Document.MetadataStatus.FAILED, metadata_attempts__lt=metadata.MAX_ATTEMPTS),
+            is_uploaded=True,
+            updated_at__lte=cutoff,
+        )
+        .values_list('id', flat=True)[:200]
+    )
+    for document_id in document_ids:
+        extract_document_metadata.delay(str(document_id))
+    return len(document_ids)
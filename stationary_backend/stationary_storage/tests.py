@@ -1,3 +1,371 @@
-from django.test import TestCase
+import hashlib
+import io
+import shutil
+import tempfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token
+from PIL import Image
+
+from stationary_accounts.models import User
+from stationary_shops.pricing import PricedItem
+
+from . import metadata, tasks
+from .models import Blob, Document
+from .serving import MAX_RANGES, Unsatisfiable, parse_ranges
+
+CONTENT = b'private content of user A\n' * 100
+
+
+class MediaRootMixin:
+    """
+    Runs the tests against a throwaway MEDIA_ROOT and an empty cache
+    (cached auth snapshots and access decisions outlive the rolled-back
+    users of earlier tests).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+        super().tearDownClass()
+
+
+class BlobTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(email='a@example.com', password='x')
+        self.bob = User.objects.create_user(email='b@example.com', password='x')
+
+    def upload(self, user, content=CONTENT, name='notes.txt'):
+        client = Client()
+        client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(
+                '/api/storage/upload/',
+                {'file': SimpleUploadedFile(name, content, content_type='text/plain')},
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+        return Document.objects.get(id=response.json()['id'])
+
+    def test_duplicate_uploads_share_one_blob(self):
+        first = self.upload(self.alice)
+        second = self.upload(self.bob, name='copy.txt')
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(CONTENT).hexdigest())
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+
+    def test_file_freed_with_last_reference(self):
+        first = self.upload(self.alice)
+        second = self.upload(self.bob)
+        name = first.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_session_upload_with_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.alice)
+        csrf_token = 'c' * 32
+        client.cookies['csrftoken'] = csrf_token
+        response = client.post(
+            '/api/storage/upload/',
+            {'file': SimpleUploadedFile('notes.txt', CONTENT, content_type='text/plain')},
+            HTTP_X_CSRFTOKEN=csrf_token,
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        document = Document.objects.get(id=response.json()['id'])
+        self.assertEqual(document.sha256, hashlib.sha256(CONTENT).hexdigest())
+        self.assertEqual(document.blob.ref_count, 1)
+
+    def test_declared_checksum_does_not_claim_stored_content(self):
+        original = self.upload(self.alice)
+        token = f'JWT {get_token(self.bob)}'
+        client = Client()
+
+        response = client.post(
+            '/api/storage/presigned-upload/',
+            {'fileName': 'stolen.txt', 'fileType': 'text/plain',
+             'fileSize': len(CONTENT), 'checksum': original.sha256},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=token,
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertFalse(response.json()['isUploaded'])
+        self.assertEqual(response.json()['uploadOffset'], 0)
+        document = Document.objects.get(id=response.json()['documentId'])
+        self.assertIsNone(document.blob_id)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        # Nothing was sent, so there is nothing to complete or read back
+        response = client.post(f'/api/storage/upload/{document.id}/complete/', HTTP_AUTHORIZATION=token)
+        self.assertEqual(response.status_code, 409)
+        response = client.get(f'/api/storage/files/{document.id}/', HTTP_AUTHORIZATION=token)
+        self.assertNotIn(CONTENT[:40], b''.join(response.streaming_content))
+
+
+class ResumableUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='a@example.com', password='x')
+        self.client.force_login(self.user)
+
+    def start(self):
+        return self.client.post(
+            '/api/storage/presigned-upload/',
+            {'fileName': 'notes.txt', 'fileType': 'text/plain', 'fileSize': len(CONTENT),
+             'checksum': hashlib.sha256(CONTENT).hexdigest()},
+            content_type='application/json',
+        )
+
+    def test_chunks_resumed_and_completed(self):
+        upload = self.start().json()
+        half = len(CONTENT) // 2
+        for offset, chunk in ((0, CONTENT[:half]), (half, CONTENT[half:])):
+            response = self.client.patch(
+                upload['uploadUrl'], chunk, content_type='application/offset+octet-stream',
+                HTTP_UPLOAD_OFFSET=str(offset),
+            )
+            self.assertEqual(response.status_code, 204, response.content)
+            self.assertEqual(int(response['Upload-Offset']), offset + len(chunk))
+
+        response = self.client.patch(
+            upload['uploadUrl'], b'x', content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET='0',
+        )
+        self.assertEqual(response.status_code, 409)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(upload['completeUrl'])
+        self.assertEqual(response.status_code, 200, response.content)
+        document = Document.objects.get(id=upload['documentId'])
+        self.assertTrue(document.is_uploaded)
+        with default_storage.open(document.file.name, 'rb') as fh:
+            self.assertEqual(fh.read(), CONTENT)
+
+    def test_refused_without_local_storage(self):
+        with mock.patch.object(default_storage, 'path', side_effect=NotImplementedError):
+            response = self.start()
+        self.assertEqual(response.status_code, 501, response.content)
+        self.assertFalse(Document.objects.exists())
+
+
+class MetadataTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='a@example.com', password='x')
+
+    def grey_png(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), (128, 128, 128)).save(buffer, 'PNG')
+        path = default_storage.save('secure_uploads/grey.png', ContentFile(buffer.getvalue()))
+        return Document.objects.create(
+            owner=self.user, file=path, file_name='grey.png', file_type='image/png',
+            file_size=len(buffer.getvalue()),
+        )
+
+    def cart_item(self, document):
+        return SimpleNamespace(
+            document_id=document.id, page_count=40, is_color=True,
+            paper_size='A4', is_binding=False, is_lamination=False,
+        )
+
+    def priced(self, document, user):
+        [priced] = PricedItem.for_items([self.cart_item(document)], user)
+        return priced.page_count, priced.is_color
+
+    def test_pending_document_priced_by_client_values(self):
+        document = self.grey_png()
+
+        self.assertEqual(self.priced(document, self.user), (40, True))
+        # Pricing never analyses the file itself
+        document.refresh_from_db()
+        self.assertEqual(document.metadata_status, Document.MetadataStatus.PENDING)
+
+    def test_ready_document_priced_by_content_for_its_readers_only(self):
+        document = self.grey_png()
+        metadata.extract(document)
+        stranger = User.objects.create_user(email='b@example.com', password='x')
+
+        self.assertEqual(self.priced(document, self.user), (1, False))
+        self.assertEqual(self.priced(document, stranger), (40, True))
+        self.assertEqual(self.priced(document, AnonymousUser()), (40, True))
+
+        Document.objects.filter(id=document.id).update(is_uploaded=False)
+        self.assertEqual(self.priced(document, self.user), (40, True))
+
+    def test_failed_documents_retried_up_to_the_cap(self):
+        retried = self.grey_png()
+        exhausted = self.grey_png()
+        Document.objects.filter(id=retried.id).update(
+            metadata_status=Document.MetadataStatus.FAILED, metadata_attempts=1,
+            updated_at=timezone.now() - timedelta(hours=1),
+        )
+        Document.objects.filter(id=exhausted.id).update(
+            metadata_status=Document.MetadataStatus.FAILED, metadata_attempts=metadata.MAX_ATTEMPTS,
+            updated_at=timezone.now() - timedelta(hours=1),
+        )
+
+        with mock.patch.object(tasks.extract_document_metadata, 'delay') as delay:
+            self.assertEqual(tasks.extract_pending_metadata(), 1)
+        delay.assert_called_once_with(str(retried.id))
+
+        tasks.extract_document_metadata(str(retried.id))
+        retried.refresh_from_db()
+        self.assertEqual(retried.metadata_status, Document.MetadataStatus.READY)
+        self.assertEqual(retried.metadata_attempts, 2)
+
+
+class ParseRangesTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_ranges('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_ranges('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_ranges('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_ranges('bytes=-5000', 1000), [(0, 999)])
+        self.assertEqual(parse_ranges('bytes=990-2000', 1000), [(990, 999)])
+
+    def test_ranges_sorted_and_merged(self):
+        self.assertEqual(parse_ranges('bytes=500-599, 0-9, 5-20, 21-30', 1000), [(0, 30), (500, 599)])
+
+    def test_ignored_headers(self):
+        for header in ('items=0-10', 'bytes=', 'bytes=abc', 'bytes=10-5', 'bytes=-'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_ranges(header, 1000))
+        too_many = 'bytes=' + ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_ranges(too_many, 1000))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=2000-3000', 'bytes=-0'):
+            with self.subTest(header=header), self.assertRaises(Unsatisfiable):
+                parse_ranges(header, 1000)
+
+
+@override_settings(DOCUMENT_SERVE_MODE='stream')
+class DocumentServingTests(MediaRootMixin, TestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='a@example.com', password='x')
+        path = default_storage.save('secure_uploads/doc.pdf', ContentFile(self.content))
+        self.document = Document.objects.create(
+            owner=self.user, file=path, file_name='doc.pdf', file_type='application/pdf',
+            file_size=len(self.content), sha256=hashlib.sha256(self.content).hexdigest(),
+        )
+        self.url = f'/api/storage/files/{self.document.id}/'
+        self.auth = f'JWT {get_token(self.user)}'
+
+    def get(self, **headers):
+        return self.client.get(self.url, HTTP_AUTHORIZATION=self.auth, **headers)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_single_range(self):
+        response = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+    def test_multiple_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=0-9,-10')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+
+        parts = body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[-1], b'--\r\n')
+        size = len(self.content)
+        for part, (start, end) in zip(parts[1:-1], [(0, 9), (size - 10, size - 1)]):
+            head, _, data = part.partition(b'\r\n\r\n')
+            self.assertIn(f'Content-Range: bytes {start}-{end}/{size}'.encode(), head)
+            self.assertEqual(data.removesuffix(b'\r\n'), self.content[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        # A changed file: the whole of it instead of the range
+        response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(DOCUMENT_SERVE_MODE='stream')
+class AsyncDocumentServingTests(MediaRootMixin, TestCase):
+    content = b'0123456789' * 20000
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='a@example.com', password='x')
+        path = default_storage.save('secure_uploads/doc.pdf', ContentFile(self.content))
+        self.document = Document.objects.create(
+            owner=self.user, file=path, file_name='doc.pdf', file_type='application/pdf',
+            file_size=len(self.content),
+        )
+        self.headers = {'authorization': f'JWT {get_token(self.user)}'}
+
+    async def read(self, response):
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertTrue(all(len(chunk) <= 64 * 1024 for chunk in chunks))
+        return b''.join(chunks)
+
+    async def test_whole_file_streamed_in_chunks(self):
+        response = await AsyncClient().get(f'/api/storage/files/{self.document.id}/', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.read(response), self.content)
+
+    async def test_ranges_streamed_in_chunks(self):
+        response = await AsyncClient().get(
+            f'/api/storage/files/{self.document.id}/', headers={**self.headers, 'range': 'bytes=0-'},
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await self.read(response), self.content)
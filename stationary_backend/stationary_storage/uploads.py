@@ -0,0 +1,217 @@
+"""
+Resumable document uploads.
+
+A tus-like protocol built on the placeholder ``Document`` created by
+``create_presigned_upload``:
+
+1. ``POST /api/storage/presigned-upload/`` declares the file's name, size
+   and (optionally) SHA-256; an empty file is created in storage.
+2. ``PATCH /api/storage/upload/<id>/`` with an ``Upload-Offset`` header
+   appends the request body at that offset. After a dropped connection
+   ``HEAD`` on the same URL returns the offset to resume from.
+3. ``POST /api/storage/upload/<id>/complete/`` checks the size and the
+   checksum and makes the document usable in orders. The file becomes
+   the content's blob, or is dropped if the content is already stored
+   (judged by the hash of the bytes received, not the declared one).
+
+Each chunk is copied from the request stream into the document's file in
+``READ_SIZE`` pieces. Under WSGI that is the socket itself, so a body
+that runs past the declared size is cut off as soon as it does. Under
+ASGI, Django's handler spools the whole body before the view runs, so
+``UPLOAD_CHUNK_MAX_SIZE`` only rejects oversized chunks after the fact;
+the proxy has to cap them (nginx ``client_max_body_size`` on the PATCH
+URL).
+
+Chunks are appended to the file in place, which needs local storage
+(``FileSystemStorage``). With any other backend uploads are refused up
+front with 501 Not Implemented.
+"""
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import blobs, metadata
+from .models import Document
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A rejected upload request; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_size(value) -> int:
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise UploadError('fileSize must be an integer')
+    if size <= 0:
+        raise UploadError('fileSize must be positive')
+    if size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError(
+            f'File too large. Maximum size is {settings.UPLOAD_MAX_SIZE // (1024 * 1024)}MB',
+            status=413,
+        )
+    return size
+
+
+def parse_checksum(value) -> str:
+    """A hex SHA-256 digest, or ``''`` when the client sent none."""
+    checksum = (value or '').strip().lower()
+    if checksum and (len(checksum) != 64 or any(c not in '0123456789abcdef' for c in checksum)):
+        raise UploadError('checksum must be a hex SHA-256 digest')
+    return checksum
+
+
+def local_path(name) -> str:
+    """Filesystem path of the stored file *name*; see the module docstring."""
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        raise UploadError('Resumable uploads need local file storage', status=501)
+
+
+def start_upload(owner, file_name, file_type, file_size, checksum='') -> Document:
+    """
+    Create the placeholder document and its empty file.
+
+    *checksum* is only what the client claims; it is checked against the
+    received bytes on completion. Content is shared with an existing blob
+    only then, never on the strength of a declared hash, which would hand
+    out (and reveal the existence of) files the client never had.
+    """
+    file_extension = os.path.splitext(file_name)[1]
+    name = f"secure_uploads/{uuid.uuid4()}{file_extension}"
+    local_path(name)
+    return Document.objects.create(
+        owner=owner,
+        file=default_storage.save(name, ContentFile(b'')),
+        file_name=file_name,
+        file_type=file_type or '',
+        file_size=file_size,
+        sha256=checksum,
+        is_uploaded=False,
+        is_scanned=False,
+        virus_detected=False,
+    )
+
+
+def pending_upload(document_id, user, *, lock=False, completed_ok=False) -> Document:
+    """The unfinished upload *document_id* of *user*."""
+    documents = Document.objects.select_for_update() if lock else Document.objects
+    document = documents.filter(id=document_id, owner=user).first()
+    if document is None:
+        raise UploadError('Upload not found', status=404)
+    if document.is_uploaded and not completed_ok:
+        raise UploadError('Upload already completed', status=409)
+    return document
+
+
+def append_chunk(document_id, user, offset, length, stream) -> int:
+    """
+    Write *length* bytes of *stream* at *offset* and return the new offset.
+
+    The document row stays locked while the chunk is written, so two
+    clients resuming the same upload cannot interleave. Whatever arrived
+    before the stream ended is kept; the client resumes from the returned
+    offset.
+    """
+    if length is None:
+        raise UploadError('Content-Length is required', status=411)
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError(
+            f'Chunk too large. Maximum chunk size is {settings.UPLOAD_CHUNK_MAX_SIZE} bytes',
+            status=413,
+        )
+
+    with transaction.atomic():
+        document = pending_upload(document_id, user, lock=True)
+        if offset != document.upload_offset:
+            raise UploadError(
+                f'Upload-Offset {offset} does not match the current offset {document.upload_offset}',
+                status=409,
+            )
+        if offset + length > document.file_size:
+            raise UploadError('Chunk runs past the declared file size', status=413)
+
+        written = 0
+        with open(local_path(document.file.name), 'r+b') as fh:
+            fh.seek(offset)
+            fh.truncate()
+            while written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                fh.write(data)
+                written += len(data)
+
+        document.upload_offset = offset + written
+        document.save(update_fields=['upload_offset', 'updated_at'])
+        return document.upload_offset
+
+
+def file_sha256(name) -> str:
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as fh:
+        for data in iter(lambda: fh.read(READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def complete_upload(document_id, user, checksum='') -> Document:
+    """
+    Verify a fully received upload and mark it usable.
+
+    *checksum* (or the one declared when the upload was created) must
+    match the SHA-256 of the stored file. On a mismatch the received data
+    is discarded and the upload starts over from offset 0. Completing an
+    upload twice returns the document.
+    """
+    with transaction.atomic():
+        document = pending_upload(document_id, user, lock=True, completed_ok=True)
+        if document.is_uploaded:
+            return document
+        if document.upload_offset != document.file_size:
+            raise UploadError(
+                f'Upload incomplete: {document.upload_offset} of {document.file_size} bytes received',
+                status=409,
+            )
+
+        expected = checksum or document.sha256
+        actual = file_sha256(document.file.name)
+        if expected and expected != actual:
+            with open(local_path(document.file.name), 'r+b') as fh:
+                fh.truncate(0)
+            document.upload_offset = 0
+            document.save(update_fields=['upload_offset', 'updated_at'])
+        else:
+            # Keep the received file as the blob, or drop it for the copy
+            # already stored
+            blobs.attach(document, blobs.store(actual, document.file_size, name=document.file.name))
+            document.is_uploaded = True
+            document.save(update_fields=['blob', 'file', 'sha256', 'is_uploaded', 'updated_at'])
+            metadata.queue_extraction(document)
+
+    if not document.is_uploaded:
+        raise UploadError('Checksum mismatch; upload the file again', status=422)
+    return document
+
+
+def purge_stale_uploads() -> int:
+    """Delete uploads left unfinished for ``UPLOAD_EXPIRE_AFTER`` seconds."""
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_EXPIRE_AFTER)
+    stale = list(Document.objects.filter(is_uploaded=False, updated_at__lt=cutoff)[:500])
+    for document in stale:
+        blobs.delete_document(document)
+    return len(stale)
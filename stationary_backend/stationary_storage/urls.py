@@ -1,5 +1,5 @@
 from django.urls import path
-from . import rest_api
+from . import rest_api, views
 
 app_name = 'storage'
 
@@ -11,5 +11,8 @@ urlpatterns = [
     path('media/dev/', rest_api.MediaListView.as_view(), name='media_list_dev'),
     path('media/<uuid:document_id>/', rest_api.MediaDetailView.as_view(), name='media_detail'),
     path('media/dev/<uuid:document_id>/', rest_api.MediaDetailViewDev.as_view(), name='media_detail_dev'),
+    path('files/<uuid:document_id>/', views.document_file, name='document_file'),
     path('presigned-upload/', rest_api.create_presigned_upload, name='presigned_upload'),
+    path('upload/<uuid:document_id>/', rest_api.ResumableUploadView.as_view(), name='resumable_upload'),
+    path('upload/<uuid:document_id>/complete/', rest_api.complete_upload, name='complete_upload'),
 ]
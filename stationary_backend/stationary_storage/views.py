@@ -1,19 +1,17 @@
 import logging
-import mimetypes
-import os
 
-from django.contrib.auth import get_user_model
-from django.core.files.storage import default_storage
-from django.http import FileResponse, Http404, HttpResponseForbidden, JsonResponse
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET
-from graphql_jwt.utils import jwt_decode
 
+from stationary_core.auth import authenticate_request
+
+from .access import has_document_access
 from .models import Document
+from .serving import document_response
 
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
 
 # ─── Authentication ──────────────────────────────────────────────────────────
@@ -26,66 +24,7 @@ def _authenticate_jwt(request) -> bool:
 
     Expected header format:  Authorization: JWT <token>
     """
-    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-
-    if not auth_header.startswith('JWT '):
-        return False
-
-    token = auth_header[4:]  # strip 'JWT ' prefix
-
-    try:
-        payload = jwt_decode(token)
-        request.user = User.objects.get(id=payload['user_id'])
-        return True
-    except Exception:
-        return False
-
-
-# ─── Permission ───────────────────────────────────────────────────────────────
-
-
-def _has_document_access(user, document) -> bool:
-    """
-    Return True if *user* is permitted to access *document*.
-
-    Access is granted when any of the following is true:
-    - The user is the document owner.
-    - The user is staff or a superuser.
-    - The user placed an order that contains the document.
-    - The user owns a shop whose orders contain the document.
-    """
-    if document.owner == user:
-        return True
-
-    if user.is_staff or user.is_superuser:
-        return True
-
-    # Access via order (as customer)
-    try:
-        from stationary_orders.models import OrderItem
-
-        if OrderItem.objects.filter(document=document, order__customer=user).exists():
-            return True
-    except Exception:
-        pass
-
-    # Access via shop (as shop owner)
-    try:
-        from stationary_orders.models import OrderItem
-        from stationary_shops.models import Shop
-
-        shop_ids = (
-            OrderItem.objects.filter(document=document)
-            .values_list('order__shop', flat=True)
-            .distinct()
-        )
-
-        if Shop.objects.filter(id__in=shop_ids, owner=user).exists():
-            return True
-    except Exception:
-        pass
-
-    return False
+    return authenticate_request(request) is not None
 
 
 # ─── Shared file-serving logic ────────────────────────────────────────────────
@@ -106,45 +45,36 @@ def _serve_document(request, document_id: str, *, as_attachment: bool):
     document = get_object_or_404(Document, id=document_id)
 
     # 3. Authorise
-    if not _has_document_access(request.user, document):
+    if not has_document_access(request.user, document):
         return JsonResponse({'error': 'Permission denied'}, status=403)
 
     # 4. Validate file
     if not document.file.name:
         raise Http404('File path is not set on this document')
 
-    if not default_storage.exists(document.file.name):
-        raise Http404('File not found on storage backend')
-
-    # 5. Determine MIME type
-    content_type = (
-        document.file_type
-        or mimetypes.guess_type(document.file_name)[0]
-        or 'application/octet-stream'
+    # 5. Hand the file over (nginx, X-Sendfile or streamed); 404 if it is
+    #    missing from storage, 304 if the client's copy is current
+    return document_response(
+        request,
+        document,
+        as_attachment=as_attachment,
+        cache_control='private, max-age=3600',
     )
 
-    # 6. Build response
-    file_handle = default_storage.open(document.file.name, 'rb')
 
-    if as_attachment:
-        response = FileResponse(
-            file_handle,
-            as_attachment=True,
-            filename=document.file_name,
-            content_type=content_type,
-        )
-    else:
-        response = FileResponse(file_handle, content_type=content_type)
-        response['Content-Disposition'] = f'inline; filename="{document.file_name}"'
-
-    response['Content-Length'] = document.file_size
-    response['Cache-Control'] = 'private, max-age=3600'
-    response['X-Content-Type-Options'] = 'nosniff'
+# ─── Views ────────────────────────────────────────────────────────────────────
 
-    return response
 
+@require_GET
+@csrf_exempt
+def document_file(request, document_id):
+    """
+    Serve a document to an authenticated user with access to it.
 
-# ─── Views ────────────────────────────────────────────────────────────────────
+    GET /api/storage/files/<id>/             inline
+    GET /api/storage/files/<id>/?download=1  as an attachment
+    """
+    return _serve_document(request, document_id, as_attachment=request.GET.get('download') == '1')
 
 
 @require_GET
@@ -167,25 +97,8 @@ def document_view(request, document_id):
         if not document.file.name:
             raise Http404('File path is not set on this document')
 
-        if not default_storage.exists(document.file.name):
-            raise Http404('File not found on storage backend')
-
-        # Determine MIME type
-        content_type = (
-            document.file_type
-            or mimetypes.guess_type(document.file_name)[0]
-            or 'application/octet-stream'
-        )
-
-        # Build response for inline viewing
-        file_handle = default_storage.open(document.file.name, 'rb')
-        response = FileResponse(file_handle, content_type=content_type)
-        response['Content-Disposition'] = f'inline; filename="{document.file_name}"'
-        response['Content-Length'] = document.file_size
-        response['Cache-Control'] = 'public, max-age=3600'
-        response['X-Content-Type-Options'] = 'nosniff'
-
-        return response
+        # Hand the file over for inline viewing
+        return document_response(request, document, as_attachment=False, cache_control='public, max-age=3600')
     except Http404:
         raise
     except Exception as exc:
@@ -213,29 +126,8 @@ def document_download(request, document_id):
         if not document.file.name:
             raise Http404('File path is not set on this document')
 
-        if not default_storage.exists(document.file.name):
-            raise Http404('File not found on storage backend')
-
-        # Determine MIME type
-        content_type = (
-            document.file_type
-            or mimetypes.guess_type(document.file_name)[0]
-            or 'application/octet-stream'
-        )
-
-        # Build response for download
-        file_handle = default_storage.open(document.file.name, 'rb')
-        response = FileResponse(
-            file_handle,
-            as_attachment=True,
-            filename=document.file_name,
-            content_type=content_type,
-        )
-        response['Content-Length'] = document.file_size
-        response['Cache-Control'] = 'public, max-age=3600'
-        response['X-Content-Type-Options'] = 'nosniff'
-
-        return response
+        # Hand the file over as a download
+        return document_response(request, document, as_attachment=True, cache_control='public, max-age=3600')
     except Http404:
         raise
     except Exception as exc:
@@ -1,20 +1,5 @@
-import React, { useState, useEffect } from 'react';
-import { useQuery } from '@apollo/client/react';
-import { GET_PAYMENT_STATUS } from '../../orders/api';
-
-interface PaymentStatusData {
-    paymentStatus: {
-        id: string;
-        status: string;
-        paymentMethod: string;
-        amount: number;
-        referenceNumber?: string;
-        transactionId?: string;
-        failureReason?: string;
-        createdAt: string;
-        updatedAt: string;
-    };
-}
+import React from 'react';
+import { usePaymentStatusSocket } from '../../orders/hooks/usePaymentStatusSocket';
 
 interface PaymentStatusTrackerProps {
     paymentId: string;
@@ -33,31 +18,10 @@ export const PaymentStatusTracker: React.FC<PaymentStatusTrackerProps> = ({
     onComplete,
     onPaymentFailed
 }) => {
-    const [pollingCount, setPollingCount] = useState(0);
-
-    const { data, loading, error, refetch } = useQuery<PaymentStatusData>(
-        GET_PAYMENT_STATUS,
-        {
-            variables: { paymentId },
-            pollInterval: 3000,
-            skip: !paymentId,
-            fetchPolicy: 'network-only'
-        }
-    );
-
-    const payment = data?.paymentStatus;
+    // Pushed over a WebSocket as soon as ClickPesa confirms or rejects
+    const { payment, loading, error, refetch } = usePaymentStatusSocket(paymentId);
     const currentStatus = payment?.status || 'PROCESSING';
 
-    useEffect(() => {
-        if (pollingCount >= 60 || ['COMPLETED', 'FAILED', 'CANCELLED'].includes(currentStatus)) {
-            return;
-        }
-        const timer = setTimeout(() => {
-            setPollingCount(prev => prev + 1);
-        }, 3000);
-        return () => clearTimeout(timer);
-    }, [pollingCount, currentStatus]);
-
     const handleCancel = () => {
         if (onPaymentFailed) {
             onPaymentFailed();
@@ -0,0 +1,106 @@
+import { useEffect, useState } from 'react';
+import { useQuery } from '@apollo/client/react';
+import { GET_PAYMENT_STATUS } from '../api';
+import { getAuthToken } from '../../../../lib/auth';
+
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+const FINAL_STATUSES = ['COMPLETED', 'FAILED', 'CANCELLED'];
+// Only used when the WebSocket cannot be opened or drops before a final status
+const FALLBACK_POLL_INTERVAL = 10000;
+
+export interface PaymentStatus {
+    id: string;
+    status: string;
+    paymentMethod: string;
+    amount: number;
+    referenceNumber?: string;
+    transactionId?: string;
+    failureReason?: string;
+    createdAt: string;
+    updatedAt: string;
+    order?: {
+        id: string;
+        paymentStatus: string;
+        status: string;
+    };
+}
+
+interface PaymentStatusData {
+    paymentStatus: PaymentStatus | null;
+}
+
+const paymentStatusSocketUrl = (paymentId: string): string => {
+    const url = new URL(`/ws/payments/${paymentId}/`, API_URL);
+    url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+    const token = getAuthToken();
+    if (token) {
+        url.searchParams.set('token', token);
+    }
+    return url.toString();
+};
+
+const latest = (a?: PaymentStatus | null, b?: PaymentStatus | null) => {
+    if (!a || !b) return a || b || undefined;
+    return Date.parse(a.updatedAt) >= Date.parse(b.updatedAt) ? a : b;
+};
+
+/**
+ * Status of a payment, pushed by the server over a WebSocket as soon as
+ * ClickPesa reports a change. The query is fetched once for the initial
+ * render; it is only polled if the socket fails.
+ */
+export const usePaymentStatusSocket = (paymentId?: string) => {
+    const [pushed, setPushed] = useState<PaymentStatus | null>(null);
+    const [socketFailed, setSocketFailed] = useState(false);
+
+    const { data, loading, error, refetch, startPolling, stopPolling } = useQuery<PaymentStatusData>(
+        GET_PAYMENT_STATUS,
+        {
+            variables: { paymentId },
+            skip: !paymentId,
+            fetchPolicy: 'network-only'
+        }
+    );
+
+    const payment = latest(pushed, data?.paymentStatus);
+    const isFinal = !!payment && FINAL_STATUSES.includes(payment.status);
+
+    useEffect(() => {
+        if (!paymentId) return;
+
+        let finished = false;
+        const socket = new WebSocket(paymentStatusSocketUrl(paymentId));
+
+        socket.onmessage = (event) => {
+            const update: PaymentStatus = JSON.parse(event.data);
+            setPushed(update);
+            if (FINAL_STATUSES.includes(update.status)) {
+                finished = true;
+            }
+        };
+        socket.onclose = () => {
+            if (!finished) {
+                setSocketFailed(true);
+            }
+        };
+
+        return () => {
+            finished = true;
+            socket.close();
+        };
+    }, [paymentId]);
+
+    useEffect(() => {
+        if (!socketFailed || isFinal) return;
+        startPolling(FALLBACK_POLL_INTERVAL);
+        return () => stopPolling();
+    }, [socketFailed, isFinal, startPolling, stopPolling]);
+
+    return {
+        payment,
+        loading,
+        error,
+        refetch,
+    };
+};
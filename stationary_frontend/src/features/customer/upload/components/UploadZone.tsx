@@ -4,6 +4,7 @@ import { useCustomerStore } from '../../../../stores/customerStore';
 import { cn } from '../../../../lib/utils';
 import { Card, CardContent } from '../../../../components/ui/LegacyCard';
 import { mediaAPI } from '../../../../services/mediaAPI';
+import { getAuthToken } from '../../../../lib/auth';
 import type { UploadedFile } from '../../../../stores/customerStore';
 
 // Supported formats with their icons and colors
@@ -49,7 +50,12 @@ export const UploadZone = () => {
       try {
         updateFile(tempId, { progress: 40 });
         
-        const uploadResponse = await mediaAPI.uploadFile(file);
+        // Signed-in users upload in resumable chunks; guests in one request
+        const uploadResponse = getAuthToken()
+          ? await mediaAPI.uploadFileResumable(file, (uploaded, total) => {
+              updateFile(tempId, { progress: 40 + Math.round((40 * uploaded) / total) });
+            })
+          : await mediaAPI.uploadFile(file);
         console.log('File uploaded successfully:', uploadResponse);
         
         // Update with the real document ID from the upload response
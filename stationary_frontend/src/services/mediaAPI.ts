@@ -42,11 +42,27 @@ export interface UploadResponse {
 export interface PresignedUploadResponse {
     documentId: string;
     uploadUrl: string;
+    completeUrl: string;
+    uploadOffset: number;
+    chunkSize: number;
     fileName: string;
     fileType: string;
     fileSize: number;
+    isUploaded: boolean;
 }
 
+// Attempts per chunk before a resumable upload gives up
+const UPLOAD_CHUNK_RETRIES = 5;
+
+const sha256Hex = async (file: Blob): Promise<string> => {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest))
+        .map((b) => b.toString(16).padStart(2, '0'))
+        .join('');
+};
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
 class MediaAPI {
     /**
      * Auth headers for binary file fetches (NO Content-Type).
@@ -149,6 +165,61 @@ class MediaAPI {
         }
     }
 
+    /**
+     * Upload a file in chunks that survive dropped connections: after a
+     * failed chunk the server is asked how much it already has and the
+     * upload continues from there.
+     */
+    async uploadFileResumable(
+        file: File,
+        onProgress?: (uploaded: number, total: number) => void
+    ): Promise<UploadResponse> {
+        const checksum = await sha256Hex(file);
+        const { data: upload } = await apiClient().post<PresignedUploadResponse>('/presigned-upload/', {
+            fileName: file.name,
+            fileType: file.type,
+            fileSize: file.size,
+            checksum,
+        });
+
+        let offset = upload.uploadOffset;
+        let failures = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + upload.chunkSize);
+            try {
+                const response = await axios.patch(upload.uploadUrl, chunk, {
+                    headers: {
+                        ...getAuthHeaders(),
+                        'Content-Type': 'application/offset+octet-stream',
+                        'Upload-Offset': String(offset),
+                    },
+                });
+                offset = Number(response.headers['upload-offset']);
+                failures = 0;
+                onProgress?.(offset, file.size);
+            } catch (error: any) {
+                if (++failures > UPLOAD_CHUNK_RETRIES) {
+                    throw new Error(error.response?.data?.error || 'Upload failed');
+                }
+                await sleep(1000 * 2 ** failures);
+                // Resume from whatever the server kept
+                try {
+                    const head = await axios.head(upload.uploadUrl, { headers: getAuthHeaders() });
+                    offset = Number(head.headers['upload-offset']);
+                } catch {
+                    // Still offline; the next attempt will try again
+                }
+            }
+        }
+
+        try {
+            const response = await axios.post(upload.completeUrl, {}, { headers: getJsonAuthHeaders() });
+            return response.data;
+        } catch (error: any) {
+            throw new Error(error.response?.data?.error || 'Upload failed');
+        }
+    }
+
     /**
      * Delete a document from the server
      * @param documentId - Document ID to delete